@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Check that the streaming ReplyParser gives the same devices as parsing the
+whole reply, however the reply is split while it arrives, and that a
+stream stopped early leaves the connection framed for the next command.
+Fails when a check does.
+
+Usage: python3 benchmarks/check_parser.py
+"""
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qemu_usb_device_manager.monitor import Monitor, ReplyParser
+from fake_monitor import FakeMonitor
+
+
+SPEEDS = ("480", "12", "1.5", "5000+", "?")
+
+# 'info usbhost' of 200 devices, some without product, and a stray line
+USBHOST = "info usbhost\r\n" + "".join(
+	"  Bus %d, Addr %d, Port 1.%d, Speed %s Mb/s\r\n"
+	"    Class %02x: USB device %04x:%04x%s\r\n" % (
+		1 + i // 100, i % 100, i, SPEEDS[i % len(SPEEDS)], 0 if i % 7 else 0xef,
+		0x1000 + i, 0x2000 + i, ", Device %d" % i if i % 3 else ""
+	) for i in range(200)
+) + "  Bus 3, Addr 1, Port 3, Speed 12 Mb/s\r\n  unexpected\r\n(qemu) "
+
+# 'info usb' of 200 devices, with and without product and user ID
+USB = "info usb\r\n" + "".join(
+	"  Device 0.%d, Port 1.%d, Speed %s Mb/s%s%s\r\n" % (
+		i, i, SPEEDS[i % len(SPEEDS)], ", Product Device %d" % i if i % 4 else "",
+		", ID: device-%04x-%04x" % (0x1000 + i, 0x2000 + i) if i % 3 else ""
+	) for i in range(200)
+) + "(qemu) "
+
+REPLIES = (
+	("info usbhost", USBHOST, Monitor.usbhost_pattern, Monitor.usbhost_device, 2, Monitor.parse_usbhost),
+	("info usb", USB, Monitor.usb_pattern, Monitor.usb_device, 1, Monitor.parse_usb),
+)
+
+
+
+def parse(pattern, make, lines, chunks):
+	"""
+	Feed chunks to a new parser.
+
+	Args:
+		pattern (re.Pattern): Pattern of one device record
+		make (function): Creates a UsbDevice from a match
+		lines (int): Lines per record
+		chunks (list): Parts of the reply
+
+	Returns:
+		tuple: (list of device representations, parser saw the prompt)
+	"""
+	parser = ReplyParser(pattern, make, lines)
+	devices = []
+	for chunk in chunks:
+		devices.extend(parser.feed(chunk))
+	return ([repr(device) for device in devices], parser.done)
+
+
+def check_chunkings():
+	rng = random.Random(0)
+
+	for name, text, pattern, make, lines, reference in REPLIES:
+		data = text.encode("utf-8")
+		expected = [repr(device) for device in reference(text)]
+		assert len(expected) == 200, (name, len(expected))
+
+		splits = []
+
+		# Every split point of the first records, one boundary of each kind
+		head = data.index(b"\n", data.index(b"Bus 1, Addr 3") if lines == 2 else data.index(b"Device 0.3"))
+		for i in range(head + 1):
+			splits.append([data[:i], data[i:]])
+
+		# Fixed sizes, from byte by byte to more than a record
+		for size in range(1, 129):
+			splits.append([data[i:i + size] for i in range(0, len(data), size)])
+
+		# Random sizes
+		for trial in range(200):
+			chunks, i = [], 0
+			while i < len(data):
+				size = rng.randint(1, 256)
+				chunks.append(data[i:i + size])
+				i += size
+			splits.append(chunks)
+
+		for chunks in splits:
+			devices, done = parse(pattern, make, lines, chunks)
+			assert devices == expected, (name, [len(chunk) for chunk in chunks[:4]])
+			assert done, name
+
+
+def check_stopped_stream():
+	server = FakeMonitor(40)
+	monitor = Monitor(server.address)
+	assert monitor.connect()
+
+	# Only the first device is wanted, the rest must still be read
+	devices = monitor.iter_host_usb_devices()
+	first = next(devices)
+	devices.close()
+	assert first.id == server.ids()[0], first
+
+	assert [d.id for d in monitor.host_usb_devices()] == server.ids()
+	assert monitor.is_connected
+	monitor.disconnect()
+
+
+def main():
+	checks = (check_chunkings, check_stopped_stream)
+
+	failed = 0
+	for check in checks:
+		try:
+			check()
+			print("ok   %s" % check.__name__)
+		except AssertionError as exc:
+			failed += 1
+			print("FAIL %s: %s" % (check.__name__, exc))
+
+	if failed:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Check QMPMonitor against a fake QMP server: capabilities negotiation,
+'device_add' and 'device_del' errors, the 'info usb' fallback when QEMU lacks
+'x-query-usb', waiting for DEVICE_DELETED events and importing without
+telnetlib, which Python 3.13 removed. Fails when a check does.
+
+Usage: python3 benchmarks/check_qmp.py
+"""
+import os
+import sys
+import json
+import socket
+import logging
+import subprocess
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qemu_usb_device_manager import constants
+from qemu_usb_device_manager.qmp import QMPMonitor
+from fake_qmp import FakeQMPMonitor
+
+
+
+def connected(server):
+	"""
+	Monitor connected to a fake server.
+
+	Args:
+		server (FakeQMPMonitor): Fake server
+
+	Returns:
+		QMPMonitor
+	"""
+	monitor = QMPMonitor(server.address)
+	assert monitor.connect(), monitor.last_error
+	return monitor
+
+
+def check_negotiation():
+	server = FakeQMPMonitor()
+
+	# Commands are refused until capabilities are negotiated
+	with socket.create_connection(("127.0.0.1", server.port)) as sock, \
+			sock.makefile("rb") as reader:
+		assert "QMP" in json.loads(reader.readline())
+		sock.sendall(b'{"execute": "x-query-usb"}\n')
+		assert json.loads(reader.readline())["error"]["class"] == "CommandNotFound"
+
+	monitor = connected(server)
+	assert server.executed[-1] == "qmp_capabilities", server.executed
+	assert "return" in monitor.execute("x-query-usb")
+	monitor.disconnect()
+
+
+def check_device_errors():
+	server = FakeQMPMonitor(device_count=2)
+	monitor = connected(server)
+	userid = "device-%s" % server.ids()[0].replace(":", "-")
+
+	assert monitor.device_add_batch([("ffff", "ffff", "device-ffff-ffff")]) == \
+		["failed to find host usb device"]
+	assert monitor.add_usb_results(server.ids()[0]) == {server.ids()[0]: ""}
+	assert monitor.device_add_batch([server.ids()[0].split(":") + [userid]]) == \
+		["Duplicate device ID '%s' for device" % userid]
+	assert monitor.add_usb_results(server.ids()[0]) == \
+		{server.ids()[0]: constants.MONITOR_ALREADY_ADDED}
+
+	assert monitor.device_del_batch(["device-ffff-ffff"]) == \
+		["Device 'device-ffff-ffff' not found"]
+	assert monitor.remove_usb_results(server.ids()[0]) == {server.ids()[0]: ""}
+	monitor.disconnect()
+
+
+def check_query_usb_fallback():
+	server = FakeQMPMonitor(device_count=2, query_usb=False)
+	monitor = connected(server)
+	monitor.add_usb_results(server.ids())
+
+	devices = monitor.usb_devices()
+	assert [d.userid for d in devices] == list(server.attached), devices
+	assert not monitor.query_usb
+	assert server.executed.count("x-query-usb") == 1
+
+	# Not asked again
+	monitor.usb_devices()
+	assert server.executed.count("x-query-usb") == 1
+	monitor.disconnect()
+
+
+def check_device_deleted():
+	server = FakeQMPMonitor(device_count=2, release_delay=0.1)
+	monitor = connected(server)
+	ids = server.ids()
+	monitor.add_usb_results(ids)
+
+	start = monotonic()
+	assert monitor.remove_usb_results(ids, confirm=True) == {id: "" for id in ids}
+	assert monotonic() - start >= 0.1
+	assert not server.attached
+
+	# Guest never releases the device
+	monitor.add_usb_results(ids[0])
+	server.emit_events = False
+	results = monitor.remove_usb_results(ids[0], confirm=True, timeout=0.2)
+	assert results == {ids[0]: constants.MONITOR_NOT_RELEASED % 0.2}, results
+	monitor.disconnect()
+
+
+def check_stale_event():
+	server = FakeQMPMonitor(device_count=1, release_delay=0.01)
+	monitor = connected(server)
+	id = server.ids()[0]
+
+	# Unconfirmed removal, its event is queued during the next command
+	monitor.add_usb_results(id)
+	monitor.remove_usb_results(id)
+	sleep(0.1)
+	monitor.usb_devices()
+	assert monitor.events
+
+	# Must not be confirmed by the earlier removal's event
+	monitor.add_usb_results(id)
+	server.emit_events = False
+	results = monitor.remove_usb_results(id, confirm=True, timeout=0.2)
+	assert results == {id: constants.MONITOR_NOT_RELEASED % 0.2}, results
+	monitor.disconnect()
+
+
+def check_without_telnetlib():
+	# Python 3.13 has no telnetlib, only the telnet monitor may need it
+	code = (
+		"import sys; sys.modules['telnetlib'] = None; "
+		"from qemu_usb_device_manager.pool import MonitorPool; "
+		"from qemu_usb_device_manager.qmp import QMPMonitor"
+	)
+	root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	result = subprocess.run(
+		[sys.executable, "-W", "ignore", "-c", code], stderr=subprocess.PIPE,
+		env=dict(os.environ, PYTHONPATH=root)
+	)
+	assert result.returncode == 0, result.stderr.decode("utf-8").strip()
+
+
+def main():
+	logging.disable(logging.WARNING)
+	checks = (
+		check_negotiation, check_device_errors, check_query_usb_fallback,
+		check_device_deleted, check_stale_event, check_without_telnetlib,
+	)
+
+	failed = 0
+	for check in checks:
+		try:
+			check()
+			print("ok   %s" % check.__name__)
+		except AssertionError as exc:
+			failed += 1
+			print("FAIL %s: %s" % (check.__name__, exc))
+
+	if failed:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,188 @@
+import socket
+import threading
+from time import sleep
+
+
+
+class FakeMonitor(object):
+	"""
+	Fake QEMU HMP monitor served over TCP. Emulates 'info usb', 'info usbhost',
+	'device_add' and 'device_del' for a generated set of host devices and
+	counts every command and round trip it receives.
+	"""
+	greeting = b"QEMU 8.0.0 monitor - type 'help' for more information\r\n(qemu) "
+
+
+	def __init__(self, device_count=8, latency=0.0, release_delay=0.0):
+		"""
+		Initialize FakeMonitor class and start listening on a free port.
+
+		Args:
+			device_count (int, optional): Amount of host USB devices
+			latency (float, optional): Seconds added before every reply
+			release_delay (float, optional): Seconds before a removed device
+				disappears from 'info usb'
+		"""
+		self.latency = latency
+		self.release_delay = release_delay
+		self.host_devices = [
+			(1 + i // 16, 2 + i % 16, "%d.%d" % (1 + i // 16, 1 + i % 16),
+				0x1000 + i, 0x2000 + i, "Device %d" % i)
+			for i in range(device_count)
+		]
+		self.attached = {}  # user ID -> host device
+		self.releasing = set()  # user IDs removed but not yet released
+		self.commands = 0
+		self.round_trips = 0  # Writes answered, pipelined commands count once
+		self.connections = 0
+		self.lock = threading.Lock()
+
+		self.sock = socket.socket()
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.sock.bind(("127.0.0.1", 0))
+		self.sock.listen(1)
+		self.port = self.sock.getsockname()[1]
+		self.address = "127.0.0.1:%d" % self.port
+
+		thread = threading.Thread(target=self.serve)
+		thread.daemon = True
+		thread.start()
+
+
+	def ids(self):
+		"""
+		Vendor:product ids of all host devices.
+
+		Returns:
+			list
+		"""
+		return ["%04x:%04x" % (d[3], d[4]) for d in self.host_devices]
+
+
+	def serve(self):
+		"""
+		Accept one client at a time, like QEMU does.
+		"""
+		while True:
+			try:
+				conn, _ = self.sock.accept()
+			except OSError:
+				return
+			self.connections += 1
+			self.handle(conn)
+
+
+	def close(self):
+		"""
+		Stop listening.
+		"""
+		self.sock.close()
+
+
+	def handle(self, conn):
+		"""
+		Answer commands of a single connection until it closes.
+
+		Args:
+			conn (socket.socket): Client connection
+		"""
+		conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		conn.sendall(self.greeting)
+		buffer = b""
+
+		with conn:
+			while True:
+				try:
+					data = conn.recv(65536)
+				except OSError:
+					return
+				if not data:
+					return
+
+				buffer += data
+				replies = []
+				while b"\n" in buffer:
+					line, buffer = buffer.split(b"\n", 1)
+					line = line.decode("utf-8").strip("\r")
+					self.commands += 1
+					replies.append(line + "\r\n" + self.reply(line) + "(qemu) ")
+
+				if replies:
+					self.round_trips += 1
+					if self.latency:
+						sleep(self.latency)
+					conn.sendall("".join(replies).encode("utf-8"))
+
+
+	def reply(self, line):
+		"""
+		Output of a monitor command.
+
+		Args:
+			line (str): Command line
+
+		Returns:
+			str
+		"""
+		command, _, args = line.partition(" ")
+
+		if line == "info usbhost":
+			return "".join(
+				"  Bus %d, Addr %d, Port %s, Speed 12 Mb/s\r\n"
+				"    Class 00: USB device %04x:%04x, %s\r\n" % device
+				for device in self.host_devices
+			)
+
+		if line == "info usb":
+			with self.lock:
+				attached = list(self.attached.items())
+			return "".join(
+				"  Device 0.%d, Port %s, Speed 12 Mb/s, Product %s, ID: %s\r\n" % (
+					i + 2, device[2], device[5], userid
+				) for i, (userid, device) in enumerate(attached)
+			)
+
+		if command == "device_add":
+			options = dict(o.split("=", 1) for o in args.split(",")[1:])
+			vendor_id = int(options.get("vendorid", "0"), 16)
+			product_id = int(options.get("productid", "0"), 16)
+			device = next((
+				d for d in self.host_devices
+					if d[3] == vendor_id and d[4] == product_id
+			), None)
+
+			with self.lock:
+				if options.get("id") in self.attached:
+					return "Duplicate ID '%s' for device\r\n" % options.get("id")
+				if device is None:
+					return "could not add USB device '%s'\r\n" % args
+				self.attached[options.get("id")] = device
+			return ""
+
+		if command == "device_del":
+			with self.lock:
+				if args not in self.attached:
+					return "Device '%s' not found\r\n" % args
+
+			if self.release_delay:
+				self.releasing.add(args)
+				timer = threading.Timer(self.release_delay, self.release, (args,))
+				timer.daemon = True
+				timer.start()
+			else:
+				self.release(args)
+			return ""
+
+		return "unknown command: '%s'\r\n" % command if line else ""
+
+
+	def release(self, userid):
+		"""
+		Detach device from the emulated guest.
+
+		Args:
+			userid (str): ID of the device
+		"""
+		with self.lock:
+			self.attached.pop(userid, None)
+			self.releasing.discard(userid)
@@ -0,0 +1,188 @@
+import json
+import socket
+import threading
+from time import sleep
+from fake_monitor import FakeMonitor
+
+
+
+class FakeQMPMonitor(FakeMonitor):
+	"""
+	Fake QEMU QMP monitor served over TCP. Shares its devices and the text of
+	'human-monitor-command' with FakeMonitor, and adds what QMP does
+	differently: capabilities negotiation, structured 'device_add' and
+	'device_del' errors, 'x-query-usb' and DEVICE_DELETED events.
+	"""
+	greeting = {"QMP": {"version": {"qemu": {"major": 8, "minor": 0, "micro": 0}}, "capabilities": []}}
+
+
+	def __init__(self, device_count=8, latency=0.0, release_delay=0.0,
+			query_usb=True):
+		"""
+		Initialize FakeQMPMonitor class and start listening on a free port.
+
+		Args:
+			device_count (int, optional): Amount of host USB devices
+			latency (float, optional): Seconds added before every reply
+			release_delay (float, optional): Seconds before a removed device
+				is released and its DEVICE_DELETED event is sent
+			query_usb (bool, optional): Answer 'x-query-usb', like QEMU 8.2
+				and later do
+		"""
+		self.query_usb = query_usb
+		self.emit_events = True  # Unset to emulate a guest that never lets go
+		self.executed = []  # Names of executed commands, in order
+		self.send_lock = threading.Lock()
+		FakeMonitor.__init__(self, device_count, latency, release_delay)
+		self.address = "qmp:127.0.0.1:%d" % self.port
+
+
+	def handle(self, conn):
+		"""
+		Answer commands of a single connection until it closes.
+
+		Args:
+			conn (socket.socket): Client connection
+		"""
+		conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.send(conn, self.greeting)
+		negotiated = False
+		buffer = b""
+
+		with conn:
+			while True:
+				try:
+					data = conn.recv(65536)
+				except OSError:
+					return
+				if not data:
+					return
+
+				buffer += data
+				replies = []
+				while b"\n" in buffer:
+					line, buffer = buffer.split(b"\n", 1)
+					if not line.strip():
+						continue
+
+					request = json.loads(line.decode("utf-8"))
+					name = request.get("execute")
+					self.commands += 1
+					self.executed.append(name)
+
+					if name == "qmp_capabilities":
+						negotiated = True
+						replies.append({"return": {}})
+					elif not negotiated:
+						replies.append(self.error(
+							"CommandNotFound",
+							"Expecting capabilities negotiation with 'qmp_capabilities'"
+						))
+					else:
+						replies.append(self.execute(conn, name, request.get("arguments", {})))
+
+				if replies:
+					self.round_trips += 1
+					if self.latency:
+						sleep(self.latency)
+					for reply in replies:
+						self.send(conn, reply)
+
+
+	def send(self, conn, message):
+		"""
+		Send one message, events come from other threads.
+
+		Args:
+			conn (socket.socket): Client connection
+			message (dict): Reply or event
+		"""
+		with self.send_lock:
+			try:
+				conn.sendall(json.dumps(message).encode("utf-8") + b"\r\n")
+			except OSError:
+				pass  # Client went away
+
+
+	@staticmethod
+	def error(error_class, desc):
+		"""
+		QMP error reply.
+
+		Args:
+			error_class (str): Error class, e.g. "GenericError"
+			desc (str): Error text
+
+		Returns:
+			dict
+		"""
+		return {"error": {"class": error_class, "desc": desc}}
+
+
+	def execute(self, conn, name, arguments):
+		"""
+		Reply to a negotiated command.
+
+		Args:
+			conn (socket.socket): Client connection, for events
+			name (str): Command name
+			arguments (dict): Command arguments
+
+		Returns:
+			dict
+		"""
+		if name == "human-monitor-command":
+			return {"return": self.reply(arguments.get("command-line", ""))}
+
+		if name == "x-query-usb":
+			if not self.query_usb:
+				return self.error("CommandNotFound", "The command x-query-usb has not been found")
+			return {"return": {"human-readable-text": self.reply("info usb")}}
+
+		if name == "device_add":
+			userid = arguments.get("id")
+			device = next((
+				d for d in self.host_devices
+					if d[3] == arguments.get("vendorid") and d[4] == arguments.get("productid")
+			), None)
+
+			with self.lock:
+				if userid in self.attached:
+					return self.error("GenericError", "Duplicate device ID '%s' for device" % userid)
+				if device is None:
+					return self.error("GenericError", "failed to find host usb device")
+				self.attached[userid] = device
+			return {"return": {}}
+
+		if name == "device_del":
+			userid = arguments.get("id")
+			with self.lock:
+				if userid not in self.attached:
+					return self.error("DeviceNotFound", "Device '%s' not found" % userid)
+				self.releasing.add(userid)
+
+			timer = threading.Timer(self.release_delay, self.release_event, (conn, userid))
+			timer.daemon = True
+			timer.start()
+			return {"return": {}}
+
+		return self.error("CommandNotFound", "The command %s has not been found" % name)
+
+
+	def release_event(self, conn, userid):
+		"""
+		Release a removed device and announce it, unless events are off.
+
+		Args:
+			conn (socket.socket): Client connection
+			userid (str): ID of the device
+		"""
+		if not self.emit_events:
+			return  # Guest holds on to the device
+
+		self.release(userid)
+		self.send(conn, {
+			"event": "DEVICE_DELETED",
+			"data": {"device": userid, "path": "/machine/peripheral/" + userid},
+			"timestamp": {"seconds": 0, "microseconds": 0},
+		})
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Check start up cost of 'usb_dm -c ...' using 'python -X importtime'. Fails
+when the entry point imports modules that only full start ups need, or when
+importing it takes longer than allowed. The same is checked for 'usb_dm -c'
+without a daemon, up to and including the Client it creates.
+
+Usage: python3 benchmarks/importtime.py [--max-ms MS] [--client-max-ms MS] [--runs N]
+"""
+import os
+import sys
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What 'usb_dm' runs before it knows whether a daemon takes the commands
+ENTRY_POINT = "from qemu_usb_device_manager import run"
+
+# Not needed to forward commands to a daemon
+FORBIDDEN = (
+	"argparse", "asyncio", "logging", "platform", "subprocess", "telnetlib",
+	"urllib.request", "yaml",
+)
+
+# 'usb_dm --config FILE -c version', which never forwards to a daemon
+CLIENT_PATH = (
+	"import sys; sys.argv = ['usb_dm', '--config', %r, '-c', 'version']; "
+	"from qemu_usb_device_manager import run; run()"
+)
+
+# Only needed by the daemon, broker, hotplug watcher or fan-out
+CLIENT_FORBIDDEN = (
+	"asyncio", "concurrent.futures", "queue", "socketserver", "subprocess",
+	"telnetlib", "qemu_usb_device_manager.broker", "qemu_usb_device_manager.daemon",
+	"qemu_usb_device_manager.fanout", "qemu_usb_device_manager.hotplug",
+)
+
+CONFIG = """
+host-machine:
+  hostname: ''
+usb-devices: {}
+virtual-machines:
+  vm-1:
+    monitor: '127.0.0.1:1'
+"""
+
+
+
+def import_times(code=ENTRY_POINT):
+	"""
+	Run code in a fresh interpreter and collect what it imported.
+
+	Args:
+		code (str, optional): Code to run
+
+	Returns:
+		dict: module -> cumulative import time in microseconds, "" -> total
+		of modules imported outside of other imports
+	"""
+	env = dict(os.environ, PYTHONPATH=ROOT)
+	output = subprocess.run(
+		[sys.executable, "-X", "importtime", "-W", "ignore", "-c", code],
+		stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, check=True
+	).stderr.decode("utf-8")
+
+	times = {"": 0}
+	for line in output.splitlines():
+		if not line.startswith("import time:") or "cumulative" in line:
+			continue
+		_, cumulative, module = line[len("import time:"):].split("|")
+		times[module.strip()] = int(cumulative)
+		if not module[1:].startswith(" "):
+			times[""] += int(cumulative)
+	return times
+
+
+def client_path_times(runs):
+	"""
+	Import cost of 'usb_dm -c' without a daemon, over what the interpreter
+	imports for itself.
+
+	Args:
+		runs (int): Best of this many runs
+
+	Returns:
+		tuple: (milliseconds, list of modules that should not be imported)
+	"""
+	config = tempfile.NamedTemporaryFile("w", suffix=".yml", delete=False)
+	with config:
+		config.write(CONFIG)
+
+	try:
+		startup = min(import_times("pass")[""] for i in range(runs))
+		results = [import_times(CLIENT_PATH % config.name) for i in range(runs)]
+	finally:
+		os.unlink(config.name)
+		cache = os.path.join(
+			os.path.dirname(config.name), "." + os.path.basename(config.name) + ".cache"
+		)
+		if os.path.exists(cache):
+			os.unlink(cache)
+
+	best = (min(times[""] for times in results) - startup) / 1000.0
+	return (best, sorted(module for module in results[0] if module in CLIENT_FORBIDDEN))
+
+
+def main():
+	parser = ArgumentParser(description="Check start up import cost")
+	parser.add_argument("--max-ms", type=float, default=40.0, help="Allowed import time")
+	parser.add_argument("--client-max-ms", type=float, default=90.0, help="Allowed import time of 'usb_dm -c' without a daemon")
+	parser.add_argument("--runs", type=int, default=5, help="Best of this many runs")
+	args = parser.parse_args()
+
+	runs = [import_times() for i in range(args.runs)]
+	best = min(run["qemu_usb_device_manager"] for run in runs) / 1000.0
+	forbidden = sorted(module for module in runs[0] if module in FORBIDDEN)
+
+	print("import qemu_usb_device_manager: %.1f ms (max %.1f ms)" % (best, args.max_ms))
+	if forbidden:
+		print("imported on start up: %s" % ", ".join(forbidden))
+
+	client_best, client_forbidden = client_path_times(args.runs)
+	print("usb_dm -c without daemon: %.1f ms (max %.1f ms)" % (client_best, args.client_max_ms))
+	if client_forbidden:
+		print("imported without daemon: %s" % ", ".join(client_forbidden))
+
+	if forbidden or best > args.max_ms or client_forbidden or \
+			client_best > args.client_max_ms:
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Benchmark Monitor and Client against fake QEMU monitors.
+
+Usage: python3 benchmarks/run.py [--devices N] [--attach N] [--latency MS]
+"""
+import os
+import sys
+import json
+import socket
+import tempfile
+from io import StringIO
+from time import perf_counter, sleep
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qemu_usb_device_manager import Monitor, Client
+from qemu_usb_device_manager.config import cache_path
+from qemu_usb_device_manager.script import Script
+from fake_monitor import FakeMonitor
+
+
+CONFIG = """
+host-machine:
+  hostname: '%(hostname)s'
+  sysfs: false  # Host devices of the fake monitor, not of this computer
+usb-devices:
+%(devices)s
+virtual-machines:
+  vm-1:
+    monitor: ':%(port_1)d'
+  vm-2:
+    monitor: ':%(port_2)d'
+"""
+
+
+
+def percentile(values, fraction):
+	"""
+	Nearest-rank percentile.
+
+	Args:
+		values (list): Measurements
+		fraction (float): Percentile between 0 and 1
+
+	Returns:
+		float
+	"""
+	values = sorted(values)
+	return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+
+class Benchmark(object):
+	"""
+	Runs scenarios repeatedly and collects latency, command and round trip
+	counts.
+	"""
+
+	def __init__(self, iterations):
+		"""
+		Initialize Benchmark class.
+
+		Args:
+			iterations (int): Runs per scenario
+		"""
+		self.iterations = iterations
+		self.results = []
+
+
+	def measure(self, name, servers, func, setup=None):
+		"""
+		Time a scenario. Commands sent during 'setup' are not counted.
+
+		Args:
+			name (str): Scenario name
+			servers (list): Fake monitors involved in the scenario
+			func (function): Scenario
+			setup (function, optional): Run before every iteration
+		"""
+		timings, commands, round_trips = [], 0, 0
+		count = lambda key: sum(getattr(server, key) for server in servers)
+
+		for i in range(self.iterations):
+			if setup:
+				setup()
+			before = (count("commands"), count("round_trips"))
+			start = perf_counter()
+			func()
+			timings.append(perf_counter() - start)
+			commands += count("commands") - before[0]
+			round_trips += count("round_trips") - before[1]
+
+		self.results.append({
+			"scenario": name,
+			"p50_ms": percentile(timings, 0.5) * 1000,
+			"p99_ms": percentile(timings, 0.99) * 1000,
+			"commands": commands / float(self.iterations),
+			"round_trips": round_trips / float(self.iterations),
+		})
+
+
+	def report(self, as_json=False):
+		"""
+		Print results.
+
+		Args:
+			as_json (bool, optional): One JSON object per line
+		"""
+		if as_json:
+			for result in self.results:
+				print(json.dumps(result))
+			return
+
+		print("%-20s %10s %10s %10s %12s" % (
+			"scenario", "p50 ms", "p99 ms", "commands", "round trips"
+		))
+		for result in self.results:
+			print(
+				"%(scenario)-20s %(p50_ms)10.2f %(p99_ms)10.2f "
+				"%(commands)10.1f %(round_trips)12.1f" % result
+			)
+
+
+def main():
+	parser = ArgumentParser(description="Benchmark against fake QEMU monitors")
+	parser.add_argument("--devices", type=int, default=8, help="Host USB devices")
+	parser.add_argument("--attach", type=int, default=4, help="Devices to add and remove")
+	parser.add_argument("--latency", type=float, default=0.0, help="Reply latency in ms")
+	parser.add_argument("--release", type=float, default=0.0, help="Device release delay in ms")
+	parser.add_argument("--iterations", type=int, default=50, help="Runs per scenario")
+	parser.add_argument("--json", action="store_true", help="Print JSON lines")
+	args = parser.parse_args()
+
+	servers = [
+		FakeMonitor(args.devices, args.latency / 1000.0, args.release / 1000.0)
+		for i in range(2)
+	]
+	ids = servers[0].ids()[:args.attach]
+	benchmark = Benchmark(args.iterations)
+
+	def settled():
+		wait_for(lambda: not any(server.releasing for server in servers))
+
+	# Monitor scenarios
+	monitor = Monitor(servers[0].address)
+
+	def connect():
+		fresh = Monitor(servers[0].address)
+		fresh.connect()
+		fresh.disconnect()
+
+	benchmark.measure("monitor connect", servers[:1], connect)
+	monitor.connect()
+	benchmark.measure("monitor list", servers[:1], monitor.usb_devices_more)
+	benchmark.measure("monitor hostlist", servers[:1], monitor.host_usb_devices_more)
+	benchmark.measure(
+		"monitor add", servers[:1], lambda: monitor.add_usb(ids),
+		lambda: (monitor.remove_usb(ids), settled())
+	)
+	benchmark.measure(
+		"monitor remove", servers[:1], lambda: monitor.remove_usb(ids),
+		lambda: (settled(), monitor.add_usb(ids))
+	)
+	monitor.remove_usb(ids)
+	monitor.disconnect()
+	settled()
+
+	# Client scenarios
+	config = tempfile.NamedTemporaryFile("w", suffix=".yml", delete=False)
+	with config:
+		config.write(CONFIG % {
+			"hostname": socket.gethostname(),
+			"devices": "".join(
+				"  device-%d:\n    id: '%s'\n" % (i, id) for i, id in enumerate(ids)
+			),
+			"port_1": servers[0].port,
+			"port_2": servers[1].port,
+		})
+
+	try:
+		with redirect_stdout(StringIO()):
+			client = Client("vm-1", config.name)
+			run = lambda command: lambda: client.run_command(command)
+
+			benchmark.measure("client list", servers[:1], run("list"), client.pool.invalidate)
+			benchmark.measure("client list cached", servers[:1], run("list"))
+			benchmark.measure("client hostlist", servers[:1], run("hostlist"), client.pool.invalidate)
+			benchmark.measure(
+				"client add", servers[:1], run("add"),
+				lambda: (client.run_command("remove"), settled())
+			)
+			benchmark.measure(
+				"client remove", servers[:1], run("remove"),
+				lambda: (settled(), client.run_command("add"))
+			)
+
+			# One 'add' per device, one after another and as a script
+			each = ["add device-%d" % i for i in range(len(ids))]
+			benchmark.measure(
+				"client add each", servers[:1],
+				lambda: [client.run_command(command) for command in each],
+				lambda: (client.run_command("remove"), settled())
+			)
+			benchmark.measure(
+				"script add each", servers[:1], lambda: Script(client).run(each),
+				lambda: (client.run_command("remove"), settled())
+			)
+			client.run_command("remove")
+			settled()
+
+			benchmark.measure(
+				"client switch", servers, run("switch vm-1 vm-2"),
+				lambda: (client.run_command("switch vm-2 vm-1"), settled())
+			)
+			client.pool.close()
+	finally:
+		os.unlink(config.name)
+		if os.path.exists(cache_path(config.name)):
+			os.unlink(cache_path(config.name))
+
+	benchmark.report(args.json)
+
+
+def wait_for(condition, timeout=5.0):
+	"""
+	Wait until the fake monitor reached a state.
+
+	Args:
+		condition (function): Returns True when done
+		timeout (float, optional): Give up after this many seconds
+	"""
+	start = perf_counter()
+	while not condition() and perf_counter() - start < timeout:
+		sleep(0.001)
+
+
+if __name__ == "__main__":
+	main()
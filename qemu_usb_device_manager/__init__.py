@@ -1,8 +1,27 @@
 #!/usr/bin/env python3
+from importlib import import_module
 from .constants import VERSION
 from .main import main as run
-from .monitor import Monitor
-from .client import Client
 
 
-__all__ = ["VERSION", "run", "Monitor", "Client"]
\ No newline at end of file
+# Imported on first access, so that 'run' does not load every module
+lazy_modules = {
+	"Monitor": ".monitor",
+	"QMPMonitor": ".qmp",
+	"BrokerMonitor": ".broker",
+	"Client": ".client",
+	"AsyncMonitor": ".aio",
+	"AsyncClient": ".aio",
+}
+
+
+def __getattr__(name):
+	if name not in lazy_modules:
+		raise AttributeError("module %r has no attribute %r" % (__name__, name))
+	return getattr(import_module(lazy_modules[name], __name__), name)
+
+
+__all__ = [
+	"VERSION", "run", "Monitor", "QMPMonitor", "BrokerMonitor", "Client",
+	"AsyncMonitor", "AsyncClient"
+]
@@ -0,0 +1,528 @@
+import asyncio
+import logging
+from . import constants
+from .client import Client
+from .monitor import Monitor
+from .devices import DeviceIndex, UsbDevice
+from .utils import backoff
+
+
+
+class AsyncMonitor(object):
+	"""
+	Asyncio variant of Monitor for the telnet (HMP) monitor. Any number of
+	monitors can be driven concurrently from one event loop.
+	"""
+
+	def __init__(self, host, timeout=constants.MONITOR_TIMEOUT):
+		"""
+		Initialize AsyncMonitor class.
+
+		Args:
+			host (str): IP address and Port of Telnet monitor
+			timeout (float, optional): Deadline for each command's reply
+		"""
+		self.host = Monitor.parse_address(host)
+		self.timeout = timeout
+		self.is_connected = False
+		self.reader = self.writer = None
+		self.lock = None  # Created inside the running event loop
+		self.inventory = None  # Local host device source, see 'SysfsInventory'
+		self.last_error = None  # Why the last 'connect' failed
+
+
+	async def connect(self, retry=True, retry_wait=constants.MONITOR_BACKOFF_INITIAL,
+			max_retries=None, deadline=constants.MONITOR_CONNECT_DEADLINE):
+		"""
+		Connect to Telnet monitor, see 'Monitor.connect'. The reason of a
+		failure is kept in 'last_error'.
+
+		Args:
+			retry (bool, optional): Retry when the monitor hangs up
+			retry_wait (float, optional): First backoff step in seconds
+			max_retries (int, optional): Maximum amount of retries, None
+				retries until the deadline
+			deadline (float, optional): Seconds until giving up
+		"""
+		if self.is_connected:
+			return True
+
+		if not self.lock:
+			self.lock = asyncio.Lock()
+
+		loop = asyncio.get_running_loop()
+		end = loop.time() + deadline
+		delays = backoff(retry_wait, constants.MONITOR_BACKOFF_MAX)
+		retries = 0
+
+		while True:
+			self.reader = None
+			try:
+				self.reader, self.writer = await asyncio.wait_for(
+					asyncio.open_connection(*self.host), max(end - loop.time(), 0)
+				)
+				greeting = await asyncio.wait_for(
+					self.reader.readuntil(constants.MONITOR_PROMPT),
+					max(end - loop.time(), 0)
+				)
+				if b"QEMU" in greeting:
+					self.is_connected = True
+					self.last_error = None
+					return True
+				self.last_error = constants.MONITOR_NO_GREETING
+			except ConnectionRefusedError:
+				self.last_error = constants.MONITOR_REFUSED
+				await self.disconnect()
+				return False
+			except asyncio.TimeoutError:
+				# Still queued behind another client when the deadline passed,
+				# unless the connection itself was not made in time
+				self.last_error = constants.MONITOR_IN_USE if self.reader \
+					else constants.MONITOR_CONNECT_TIMEOUT
+				await self.disconnect()
+				return False
+			except asyncio.IncompleteReadError:
+				self.last_error = constants.MONITOR_NO_GREETING
+			except OSError as exc:
+				self.last_error = str(exc) or type(exc).__name__
+				await self.disconnect()
+				return False
+
+			await self.disconnect()
+			wait = next(delays)
+			if not retry or (max_retries is not None and retries >= max_retries) \
+					or loop.time() + wait >= end:
+				return False
+
+			await asyncio.sleep(wait)
+			retries += 1
+
+
+	async def disconnect(self):
+		"""
+		Close Telnet monitor socket.
+		"""
+		if self.writer:
+			self.writer.close()
+			self.writer = None
+		self.is_connected = False
+		return not self.is_connected
+
+
+	async def __read(self, timeout=None):
+		"""
+		Read from monitor until the prompt comes back. A reply that misses the
+		deadline leaves the stream unframed, so the connection is closed.
+
+		Args:
+			timeout (float, optional): Deadline in seconds
+
+		Returns:
+			str, everything received up to and including the prompt
+		"""
+		if not self.is_connected:
+			return ""
+
+		timeout = self.timeout if timeout is None else timeout
+		try:
+			data = await asyncio.wait_for(
+				self.reader.readuntil(constants.MONITOR_PROMPT), timeout
+			)
+		except (asyncio.TimeoutError, asyncio.IncompleteReadError, OSError):
+			logging.warning(constants.MONITOR_READ_TIMEOUT % timeout)
+			await self.disconnect()
+			return ""
+
+		return data.decode("utf-8", "replace")
+
+
+	async def commands(self, values, timeout=None):
+		"""
+		Write several commands at once and read their replies, which costs a
+		single round trip.
+
+		Args:
+			values (list): Commands to run
+			timeout (float, optional): Deadline in seconds for each reply
+
+		Returns:
+			list of str, reply for each command
+		"""
+		if not self.is_connected:
+			return ["" for value in values]
+
+		async with self.lock:
+			try:
+				self.writer.write("".join(v + "\n" for v in values).encode("utf-8"))
+				await self.writer.drain()
+			except OSError:
+				await self.disconnect()
+
+			return [await self.__read(timeout) for value in values]
+
+
+	async def command(self, value, timeout=None):
+		"""
+		Write command to monitor and read its reply.
+
+		Args:
+			value (str): Command to run
+			timeout (float, optional): Deadline in seconds for the reply
+
+		Returns:
+			str, reply of the monitor
+		"""
+		return (await self.commands([value], timeout))[0]
+
+
+	async def usb_devices(self):
+		"""
+		List USB devices from monitor.
+		"""
+		return Monitor.parse_usb(await self.command("info usb"))
+
+
+	async def host_usb_devices(self):
+		"""
+		List USB devices connected to host.
+		"""
+		if self.inventory:
+			return self.inventory.devices()
+		return Monitor.parse_usbhost(await self.command("info usbhost"))
+
+
+	async def host_usb_devices_more(self):
+		"""
+		Show all USB device along with their details.
+		"""
+		return (await self.device_index()).devices
+
+
+	async def usb_devices_more(self):
+		"""
+		Show all USB device information from connected devices.
+		"""
+		return (await self.device_index()).connected()
+
+
+	async def device_index(self):
+		"""
+		Query host and virtual machine devices and join them. Both queries
+		are sent together.
+
+		Returns:
+			DeviceIndex
+		"""
+		if self.inventory:
+			return DeviceIndex(self.inventory.devices(), await self.usb_devices())
+
+		host_data, vm_data = await self.commands(["info usbhost", "info usb"])
+		return DeviceIndex(
+			Monitor.parse_usbhost(host_data), Monitor.parse_usb(vm_data)
+		)
+
+
+	async def add_usb(self, device, snapshot=None):
+		"""
+		Add USB device by vendor:product id, skipping devices that are already
+		added. Device state is queried once and every 'device_add' is sent in
+		a single write.
+
+		Args:
+			device (Union[str, list]): Device ID
+			snapshot (DeviceIndex, optional): Device state from
+				'device_index', queried when not given
+
+		Returns:
+			bool, every device was added
+		"""
+		devices = [device] if type(device) is str else list(device)
+		if snapshot is None:
+			snapshot = await self.device_index()
+
+		pending = [
+			Monitor.device_ids(device) for device in dict.fromkeys(devices)
+				if not snapshot.is_connected(device)
+		]
+		replies = await self.commands(
+			[Monitor.device_add_command(*ids) for ids in pending]
+		)
+		result = len(pending) == len(dict.fromkeys(devices))
+
+		for ids, reply in zip(pending, replies):
+			if Monitor.reply_error(reply):
+				result = False
+			else:
+				snapshot.attach(UsbDevice(device="", userid=ids[2]))
+
+		return result
+
+
+	async def remove_usb(self, device, confirm=False,
+			timeout=constants.MONITOR_RELEASE_TIMEOUT):
+		"""
+		Remove USB device by vendor:product id, preferring the user-supplied
+		ID. Device state is queried once for the whole batch and devices that
+		are not attached are skipped.
+
+		Args:
+			device (Union[str, list]): Device ID
+			confirm (bool, optional): Wait until the guest released them
+			timeout (float, optional): Deadline in seconds for 'confirm'
+
+		Returns:
+			bool, every removal was accepted, or confirmed with 'confirm'
+		"""
+		devices = [device] if type(device) is str else list(device)
+		snapshot = await self.device_index()
+		userids = [
+			snapshot.userid(d) or Monitor.device_ids(d)[2]
+				for d in dict.fromkeys(devices) if snapshot.is_connected(d)
+		]
+		replies = await self.commands(["device_del " + userid for userid in userids])
+		errors = [Monitor.reply_error(reply) for reply in replies]
+
+		if confirm:
+			accepted = [userid for userid, error in zip(userids, errors) if not error]
+			if not all(await self.wait_removed_batch(accepted, timeout)):
+				return False
+		return not any(errors)
+
+
+	async def wait_removed_batch(self, userids,
+			timeout=constants.MONITOR_RELEASE_TIMEOUT):
+		"""
+		Wait until the virtual machine released devices after 'device_del',
+		like 'Monitor.wait_removed_batch'.
+
+		Args:
+			userids (list): IDs of the devices inside QEMU
+			timeout (float, optional): Deadline in seconds
+
+		Returns:
+			list of bool, released or not for each device
+		"""
+		loop = asyncio.get_running_loop()
+		deadline = loop.time() + timeout
+		interval = constants.MONITOR_POLL_INTERVAL
+		pending = set(userids)
+
+		while pending:
+			devices = await self.usb_devices()
+			if not self.is_connected:
+				break
+
+			pending.intersection_update(d.userid for d in devices)
+			remaining = deadline - loop.time()
+			if not pending or remaining <= 0:
+				break
+
+			await asyncio.sleep(min(interval, remaining))
+			interval = min(interval * 2, constants.MONITOR_POLL_MAX_INTERVAL)
+
+		return [userid not in pending for userid in userids]
+
+
+
+class AsyncMonitorPool(object):
+	"""
+	One AsyncMonitor per monitor address, kept open until 'close'.
+	"""
+
+	def __init__(self):
+		"""
+		Initialize AsyncMonitorPool class.
+		"""
+		self.monitors = {}
+		self.idle_timeout = None  # Set by Client.load_config, unused here
+		self.inventory = None  # Set by Client.load_config
+		self.index_ttl = None  # Set by Client.load_config, unused here
+
+
+	def get(self, host, local=True):
+		"""
+		Get monitor for host, created on first use.
+
+		Args:
+			host (str): IP address and Port of Telnet monitor
+			local (bool, optional): Monitor belongs to a virtual machine of
+				this computer, which may use the pool's inventory
+
+		Returns:
+			AsyncMonitor
+		"""
+		if host not in self.monitors:
+			self.monitors[host] = AsyncMonitor(host)
+		self.monitors[host].inventory = self.inventory if local else None
+		return self.monitors[host]
+
+
+	async def close(self):
+		"""
+		Close every connection in the pool.
+		"""
+		await asyncio.gather(*(m.disconnect() for m in self.monitors.values()))
+
+
+
+class AsyncClient(Client):
+	"""
+	Client for running USB operations against many virtual machines at once.
+	Uses the same configuration as Client.
+	"""
+
+	def __init__(self, machine_name, config_filepath, log_filepath=None):
+		"""
+		Load configuration from yaml file.
+
+		Args:
+			machine_name (str): Virtual machine name
+			config_filepath (str): Configuration file path
+		"""
+		if log_filepath:
+			logging.basicConfig(filename=log_filepath)
+
+		self.config_filepath = config_filepath
+		self.machine_name = machine_name
+		self.pool = AsyncMonitorPool()
+		self.load_config()
+
+
+	async def monitor_for(self, name):
+		"""
+		Connected monitor of a virtual machine.
+
+		Args:
+			name (str): Virtual machine name
+
+		Returns:
+			AsyncMonitor, None if the machine is unknown or unreachable
+		"""
+		address = self.endpoint(name)
+		if not address:
+			print(constants.CLIENT_INVALID_VM)
+			return
+
+		if address.startswith(constants.QMP_PREFIX):
+			print(constants.ASYNC_QMP_UNSUPPORTED % name)
+			return
+
+		if address.startswith(constants.BROKER_PREFIX):
+			print(constants.ASYNC_BROKER_UNSUPPORTED % name)
+			return
+
+		monitor = self.pool.get(address, self.is_local(name))
+		if not await monitor.connect():
+			print(constants.MONITOR_CANNOT_CONNECT % monitor.last_error)
+			return
+
+		return monitor
+
+
+	async def device_ids(self, monitor, devices, exclude):
+		"""
+		Resolve device names to vendor:product ids.
+
+		Args:
+			monitor (AsyncMonitor): Monitor to look up host devices with
+			devices (list): Device names or ids, all devices when empty
+			exclude (str): Skip devices with this action when 'devices' is empty
+
+		Returns:
+			list
+		"""
+		if not devices:
+			return self.device_list(exclude)
+		return self.device_names_to_ids(devices, await monitor.host_usb_devices())
+
+
+	async def add(self, name, devices=None):
+		"""
+		Add USB devices to virtual machine.
+
+		Args:
+			name (str): Virtual machine name
+			devices (list, optional): Device names or ids, all when not given
+
+		Returns:
+			bool, added or not
+		"""
+		monitor = await self.monitor_for(name)
+		if not monitor:
+			return False
+		return await monitor.add_usb(
+			await self.device_ids(monitor, devices, "remove only")
+		)
+
+
+	async def remove(self, name, devices=None):
+		"""
+		Remove USB devices from virtual machine.
+
+		Args:
+			name (str): Virtual machine name
+			devices (list, optional): Device names or ids, all when not given
+
+		Returns:
+			bool, removed or not
+		"""
+		monitor = await self.monitor_for(name)
+		if not monitor:
+			return False
+		return await monitor.remove_usb(
+			await self.device_ids(monitor, devices, "add only")
+		)
+
+
+	async def move(self, source, target, devices=None):
+		"""
+		Move USB devices from one virtual machine to another. Both monitors
+		are connected at the same time and the target's devices are queried
+		while the source removes its devices. Devices are added once the
+		source released them.
+
+		Args:
+			source (str): Virtual machine to remove devices from
+			target (str): Virtual machine to add devices to
+			devices (list, optional): Device names or ids, all when not given
+
+		Returns:
+			tuple: (removed, added)
+		"""
+		source_monitor, target_monitor = await asyncio.gather(
+			self.monitor_for(source), self.monitor_for(target)
+		)
+		if not (source_monitor and target_monitor):
+			return (False, False)
+
+		ids = await self.device_ids(source_monitor, devices, "add only")
+		if not devices:
+			# Only the configured devices the source holds
+			source_snapshot = await source_monitor.device_index()
+			ids = [id for id in ids if source_snapshot.is_connected(id)]
+
+		removed, snapshot = await asyncio.gather(
+			source_monitor.remove_usb(ids, confirm=True), target_monitor.device_index()
+		)
+		return (removed, await target_monitor.add_usb(ids, snapshot))
+
+
+	async def run(self, *operations):
+		"""
+		Run operations concurrently, e.g.
+		'await client.run(client.add("vm-1"), client.remove("vm-2"))'.
+
+		Args:
+			*operations (coroutine): Operations of this client
+
+		Returns:
+			list, result of each operation
+		"""
+		return await asyncio.gather(*operations)
+
+
+	async def close(self):
+		"""
+		Close every monitor connection.
+		"""
+		await self.pool.close()
@@ -0,0 +1,417 @@
+import os
+import json
+import socket
+import logging
+from queue import Queue
+from threading import Thread
+from time import monotonic
+from concurrent.futures import Future
+from socketserver import ThreadingUnixStreamServer, StreamRequestHandler
+from . import constants
+from .monitor import Monitor
+from .qmp import QMPMonitor
+from .control import owned
+from .stats import stats, span
+
+
+
+class BrokerHandler(StreamRequestHandler):
+	"""
+	Serves one client connection: greets, then answers every request line
+	once the broker ran its commands.
+	"""
+
+	def handle(self):
+		broker = self.server.broker
+		self.wfile.write(broker.greeting())
+
+		for line in self.rfile:
+			try:
+				request = json.loads(line.decode("utf-8"))
+			except ValueError:
+				return
+
+			future = broker.submit(request.get("commands", []), request.get("timeout"))
+			reply = future.result()
+			try:
+				self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+			except OSError:
+				return  # Client went away while waiting for its turn
+
+
+
+class Broker(object):
+	"""
+	Holds the single connection to a QEMU monitor and shares it with any
+	number of clients over a UNIX domain socket. Requests are queued in the
+	order they arrive and run one at a time, each request's commands
+	together, so clients take turns instead of retrying a busy monitor.
+	"""
+
+	def __init__(self, pool, address, path):
+		"""
+		Initialize Broker class.
+
+		Args:
+			pool (MonitorPool): Pool that keeps the monitor connection, should
+				not close idle connections
+			address (str): Monitor address, as given to 'MonitorPool.get'
+			path (str): Socket path clients connect to
+		"""
+		self.pool = pool
+		self.address = address
+		self.monitor = pool.get(address)
+		self.path = path
+		self.queue = Queue()
+		self.worker = None
+
+
+	def greeting(self):
+		"""
+		First line sent to every client.
+
+		Returns:
+			bytes
+		"""
+		greeting = {"broker": constants.VERSION, "monitor": self.address}
+		return json.dumps(greeting).encode("utf-8") + b"\n"
+
+
+	def submit(self, commands, timeout=None):
+		"""
+		Queue commands of a client.
+
+		Args:
+			commands (list): Human monitor commands
+			timeout (float, optional): Deadline in seconds for each reply
+
+		Returns:
+			Future, resolves to the reply sent to the client
+		"""
+		future = Future()
+		self.queue.put((commands, timeout, future, monotonic()))
+		return future
+
+
+	def work(self):
+		"""
+		Run queued requests in order until 'None' is queued.
+		"""
+		while True:
+			request = self.queue.get()
+			if request is None:
+				return
+
+			commands, timeout, future, queued = request
+			stats.record("broker.queue", monotonic() - queued)
+			try:
+				future.set_result(self.run(commands, timeout))
+			except Exception as exc:
+				logging.exception(exc)
+				future.set_result({"replies": [], "error": str(exc)})
+
+
+	def run(self, commands, timeout=None):
+		"""
+		Run commands on the monitor, connecting first if needed.
+
+		Args:
+			commands (list): Human monitor commands
+			timeout (float, optional): Deadline in seconds for each reply
+
+		Returns:
+			dict: "replies" with a reply for each command, as the Telnet
+			monitor gives them, and "error" when the monitor is unreachable
+		"""
+		if not commands:
+			return {"replies": [], "error": None}
+
+		if not self.pool.acquire(self.monitor):
+			return {"replies": [], "error": self.monitor.last_error}
+
+		try:
+			with span("broker.run"):
+				if isinstance(self.monitor, QMPMonitor):
+					replies = self.qmp_replies(commands, timeout)
+				else:
+					replies = self.monitor.commands(commands, timeout)
+		finally:
+			self.pool.release(self.monitor)
+
+		return {"replies": replies, "error": None}
+
+
+	def qmp_replies(self, commands, timeout):
+		"""
+		Run commands through QMP and frame their replies like the Telnet
+		monitor does, so clients parse them the same way.
+
+		Args:
+			commands (list): Human monitor commands
+			timeout (float): Deadline in seconds for each reply
+
+		Returns:
+			list of str
+		"""
+		prompt = constants.MONITOR_PROMPT.decode("utf-8")
+		responses = self.monitor.execute_batch([
+			("human-monitor-command", {"command-line": command})
+				for command in commands
+		], timeout)
+
+		replies = []
+		for command, response in zip(commands, responses):
+			if not response:
+				replies.append("")  # No reply, the connection was dropped
+			elif "return" in response:
+				replies.append(command + "\r\n" + response["return"] + prompt)
+			else:
+				replies.append(
+					command + "\r\n" + QMPMonitor.response_error(response) + "\r\n" + prompt
+				)
+		return replies
+
+
+	def serve_forever(self):
+		"""
+		Listen on the broker socket until interrupted.
+
+		Returns:
+			bool, False if the socket is taken by another broker
+		"""
+		if os.path.exists(self.path):
+			if not owned(self.path):
+				print(constants.BROKER_NOT_OWNED % self.path)
+				return False
+			probe = BrokerMonitor(constants.BROKER_PREFIX + self.path)
+			if probe.connect():
+				probe.disconnect()
+				print(constants.BROKER_ALREADY_RUNNING % self.path)
+				return False
+			os.unlink(self.path)  # Left over from a broker that died
+
+		# Take the monitor right away, clients are served either way
+		if self.pool.acquire(self.monitor):
+			self.pool.release(self.monitor)
+		else:
+			print(constants.MONITOR_CANNOT_CONNECT % self.monitor.last_error)
+
+		server = ThreadingUnixStreamServer(self.path, BrokerHandler)
+		server.daemon_threads = True
+		server.broker = self
+		os.chmod(self.path, 0o600)
+
+		self.worker = Thread(target=self.work)
+		self.worker.daemon = True
+		self.worker.start()
+		print(constants.BROKER_LISTENING % (self.address, self.path))
+
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			server.server_close()
+			os.unlink(self.path)
+			self.queue.put(None)
+			self.worker.join()
+			self.pool.close()
+
+		return True
+
+
+
+class BrokerMonitor(Monitor):
+	"""
+	Monitor reached through a Broker instead of directly. Commands travel as
+	JSON lines and come back as the Telnet monitor's replies, so everything
+	else Monitor does works unchanged.
+	"""
+
+	def __init__(self, host, timeout=constants.MONITOR_TIMEOUT):
+		"""
+		Initialize BrokerMonitor class.
+
+		Args:
+			host (str): Broker socket path, prefixed with "broker:"
+			timeout (float, optional): Deadline for each command's reply
+		"""
+		Monitor.__init__(self, host, timeout)
+		self.sock = None
+		self.reader = None
+
+
+	@staticmethod
+	def parse_address(host):
+		"""
+		Broker socket path of an address.
+
+		Args:
+			host (str): Broker socket path, prefixed with "broker:"
+
+		Returns:
+			str
+		"""
+		if host.startswith(constants.BROKER_PREFIX):
+			return host[len(constants.BROKER_PREFIX):]
+		return host
+
+
+	def connect(self, retry=True, retry_wait=constants.MONITOR_BACKOFF_INITIAL,
+			max_retries=None, deadline=constants.MONITOR_CONNECT_DEADLINE):
+		"""
+		Connect to the broker and read its greeting. The broker never turns
+		clients away, so there is nothing to retry. The reason of a failure
+		is kept in 'last_error'.
+
+		Args:
+			retry (bool, optional): Unused, kept for Monitor compatibility
+			retry_wait (float, optional): Unused
+			max_retries (int, optional): Unused
+			deadline (float, optional): Seconds until giving up
+		"""
+		if self.is_connected:
+			return True
+
+		try:
+			with span("broker.connect"):
+				self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+				self.sock.settimeout(deadline)
+				self.sock.connect(self.host)
+				self.reader = self.sock.makefile("rb")
+				greeting = json.loads(self.reader.readline().decode("utf-8") or "{}")
+
+			if "broker" not in greeting:
+				raise ConnectionAbortedError(constants.MONITOR_NO_GREETING)
+			self.sock.settimeout(None)  # Replies wait for other clients' turns
+		except (ConnectionRefusedError, FileNotFoundError):
+			self.last_error = constants.BROKER_NOT_RUNNING
+			self.disconnect()
+			return False
+		except (OSError, ValueError) as exc:
+			self.last_error = str(exc) or type(exc).__name__
+			self.disconnect()
+			return False
+
+		self.is_connected = True
+		self.last_error = None
+		return True
+
+
+	def disconnect(self):
+		"""
+		Close broker socket.
+		"""
+		if self.reader:
+			self.reader.close()
+			self.reader = None
+		if self.sock:
+			self.sock.close()
+			self.sock = None
+		self.is_connected = False
+		return not self.is_connected
+
+
+	def check_connection(self):
+		"""
+		Verify that the broker did not go away.
+
+		Returns:
+			bool, connection is usable or not
+		"""
+		if not self.is_connected:
+			return False
+
+		try:
+			self.sock.setblocking(False)
+			closed = not self.sock.recv(1, socket.MSG_PEEK)
+		except BlockingIOError:
+			closed = False  # Nothing to read, still open
+		except OSError:
+			closed = True
+		finally:
+			if self.sock:
+				self.sock.setblocking(True)
+
+		if closed:
+			self.disconnect()
+		return self.is_connected
+
+
+	def __request(self, values, timeout):
+		"""
+		Send commands to the broker and wait for their replies.
+
+		Args:
+			values (list): Commands to run
+			timeout (float): Deadline in seconds for each reply, None for the
+				broker's default
+
+		Returns:
+			list of str, reply for each command, empty when there was none
+		"""
+		if not self.is_connected:
+			return ["" for value in values]
+
+		request = {"commands": values, "timeout": timeout}
+		try:
+			self.sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+			reply = json.loads(self.reader.readline().decode("utf-8"))
+		except (OSError, ValueError):
+			self.disconnect()
+			return ["" for value in values]
+
+		if reply.get("error"):
+			self.last_error = reply["error"]
+			logging.warning(constants.MONITOR_CANNOT_CONNECT % self.last_error)
+
+		replies = reply.get("replies", [])
+		return replies + ["" for value in values[len(replies):]]
+
+
+	def command(self, value, timeout=None):
+		"""
+		Run command through the broker.
+
+		Args:
+			value (str): Command to run
+			timeout (float, optional): Deadline in seconds for the reply
+
+		Returns:
+			str, reply of the monitor
+		"""
+		name = value if value.startswith("info ") else value.split(" ", 1)[0]
+		with span("broker." + name):
+			return self.__request([value], timeout)[0]
+
+
+	def stream(self, value, parser, timeout=None):
+		"""
+		Run command through the broker and parse its reply, which the broker
+		sends as a whole.
+
+		Args:
+			value (str): Command to run
+			parser (ReplyParser): Parser of the reply
+			timeout (float, optional): Deadline in seconds for the reply
+
+		Returns:
+			iterator of UsbDevice
+		"""
+		return iter(parser.feed(self.command(value, timeout).encode("utf-8")))
+
+
+	def commands(self, values, timeout=None):
+		"""
+		Run several commands through the broker in one request. They run
+		back to back, without other clients' commands in between.
+
+		Args:
+			values (list): Commands to run
+			timeout (float, optional): Deadline in seconds for each reply
+
+		Returns:
+			list of str, reply for each command
+		"""
+		with span("broker.batch"):
+			return self.__request(values, timeout)
@@ -3,9 +3,12 @@ import logging
 import yaml
 from sys import exit
 from socket import gethostname
-from time import sleep
-from . import constants
-from .monitor import Monitor
+from time import sleep, monotonic
+from . import constants, config
+from .control import broker_path, owned
+from .pool import MonitorPool
+from .stats import stats, span
+from .sysfs import SysfsInventory
 from .utils import get_gateway, download_string
 
 
@@ -14,21 +17,49 @@ class Client(object):
 	"""
 	Client that interacts with monitor on a higher level.
 	"""
-	required_keys = ("usb-devices", "host-machine", "virtual-machines")
+	required_keys = constants.CONFIG_REQUIRED_KEYS
 	actions = {
 		"ignore": ("ignore", "ignored", "disable", "disabled"),
 		"add only": ("add only", "addonly", "add_only", "add-only"),
 		"remove only": ("remove only", "removeonly", "remove_only", "remove-only")
 	}
 
+	# Command name -> (method, talks to the monitor of the active machine)
+	command_table = {
+		"help": ("command_help", False),
+		"exit": ("command_exit", False),
+		"quit": ("command_exit", False),
+		"version": ("command_version", False),
+		"wait": ("command_wait", False),
+		"sleep": ("command_wait", False),
+		"reload": ("command_reload", False),
+		"update": ("command_update", False),
+		"monitor": ("command_monitor", False),
+		"set": ("command_set", False),
+		"switch": ("command_switch", False),
+		"move": ("command_switch", False),
+		"apply": ("command_apply", False),
+		"stats": ("command_stats", False),
+		"list": ("command_list", True),
+		"hostlist": ("command_hostlist", True),
+		"listhost": ("command_hostlist", True),
+		"add": ("command_add", True),
+		"remove": ("command_remove", True),
+		"rem": ("command_remove", True),
+		"del": ("command_remove", True),
+	}
+
 
-	def __init__(self, machine_name, config_filepath, log_filepath=None):
+	def __init__(self, machine_name, config_filepath, log_filepath=None,
+			pool=None):
 		"""
 		Load configuration from yaml file.
 		
 		Args:
 			config_filepath (str): Configuration file path
 			machine_name (str): Virtual machine name
+			pool (MonitorPool, optional): Share monitor connections with
+				another client
 		"""
 		# Initiate logging
 		if log_filepath:
@@ -36,34 +67,31 @@ class Client(object):
 
 		self.config_filepath = config_filepath
 		self.machine_name = machine_name
+		self.pool = pool or MonitorPool()
 		self.load_config()
 		print(constants.CLIENT_WELCOME)
 
 
 	def load_config(self):
 		"""
-		Load configuration file.
-		** This method needs to be split up and cleaned.
+		Load configuration file. The file is only parsed when it changed,
+		otherwise its compiled form is reused.
 		"""
 		try:
-			with open(self.config_filepath) as f:
-				self.config = yaml.load(f, Loader=yaml.FullLoader)
+			with span("config.load"):
+				compiled = config.load(self.config_filepath, self.actions)
 		except Exception as exc:
 			logging.exception(exc)
 			return False
 
-		# Verify required keys are present
-		rewrite_required = False
-		
-		# Find missing elements
-		for key in self.required_keys:
-			if not key in self.config.keys():
+		self.config = compiled.config
+
+		# Add missing elements and rewrite configuration with them
+		if compiled.missing:
+			for key in compiled.missing:
 				self.config[key] = {}
-				rewrite_required = True
 				print(constants.CONFIG_MISSING_ELEMENT % key)
 
-		# Rewrite configuration with required elements
-		if rewrite_required:
 			print(constants.CONFIG_REWRITE_MESSAGE)
 			try:
 				with open(self.config_filepath, "w") as f:
@@ -74,60 +102,94 @@ class Client(object):
 				return False
 			return self.load_config()
 
-		self.configuration_url = self.config.get("configuration-url", None)
-		self.host_config = self.config["host-machine"]
+		self.compiled = compiled
+		self.configuration_url = compiled.configuration_url
+		self.host_config = compiled.host_config
+		self.pool.idle_timeout = compiled.idle_timeout
+		self.pool.index_ttl = self.config.get(
+			"device-cache-ttl", constants.POOL_INDEX_TTL
+		)
+
+		# Read host devices from sysfs when running on a host machine
+		local_config = compiled.hosts.get(compiled.local_host, {})
+		if self.is_host_machine() and local_config.get("sysfs", True) and \
+				SysfsInventory.available():
+			self.pool.inventory = self.pool.inventory or SysfsInventory()
+		else:
+			self.pool.inventory = None
 
 		# Set machine by hostname if not specified
 		if not self.machine_name and not self.is_host_machine():
-			hostname = gethostname()
-			for key, value in self.config["virtual-machines"].items():
-				if "hostname" in value and value["hostname"] == hostname:
-					self.machine_name = key
+			self.machine_name = compiled.hostnames.get(gethostname())
 
 		# Get useful info from config
-		self.usb_devices_full = {
-			k: v for k, v in self.config["usb-devices"].items()
-				if v.get("action") not in self.actions["ignore"]
-		}
-
-		# VM
-		self.vm_config = self.config["virtual-machines"].get(self.machine_name)
-		self.vm_names = list(self.config["virtual-machines"].keys())
-		self.usb_devices = list(self.usb_devices_full.values())
-
-		# No machine config? No monitor inside machine config? Goodbye.
-		if not (self.vm_config and "monitor" in self.vm_config):
-			return True
-
-		# Host name for monitor
-		monitor_host = self.vm_config["monitor"]
-
-		# If monitor_host starts with a colon, we should guess which IP to use
-		# when it's not, Monitor IP:Port is probably specified by user
-		if monitor_host[0] != ":":
-			self.monitor = Monitor(monitor_host)
-			return True
-
-		# Did user define their own monitor host?
-		# User can set 'ip-address' to '-' to automatically determine ip address
-		default_ip = None
-		if self.host_config.get("ip-address", "-") == "-":
-			# Are we the host machine?
-			if self.is_host_machine():
-				default_ip = "127.0.0.1"
-
-			# Or are we the virtual machine?
-			else:
-				default_ip = get_gateway()
-		
-		# Remember that "monitor_host" is just a port prefixed with a colon
-		host = self.host_config.get("ip-address", default_ip) + monitor_host
-
-		# Create monitor
-		self.monitor = Monitor(host)
+		self.usb_devices_full = compiled.usb_devices_full
+		self.usb_devices = compiled.usb_devices
+		self.vm_names = compiled.vm_names
+		self.set_machine(self.machine_name)
 		return True
 
 
+	def set_machine(self, name):
+		"""
+		Make virtual machine the active one.
+
+		Args:
+			name (str): Virtual machine name
+
+		Returns:
+			bool, False if there is no such virtual machine
+		"""
+		self.machine_name = name
+		self.vm_config = self.config["virtual-machines"].get(name)
+
+		# Create monitor, or reuse its pooled connection
+		if self.vm_config and "monitor" in self.vm_config:
+			self.monitor = self.pool.get(self.endpoint(name), self.is_local(name))
+
+		return bool(self.vm_config)
+
+
+	def endpoint(self, name, brokered=True):
+		"""
+		Monitor address of a virtual machine, compiled in advance when it
+		does not depend on the gateway. When a broker shares the machine's
+		monitor on this computer, the broker is used instead.
+
+		Args:
+			name (str): Virtual machine name
+			brokered (bool, optional): Prefer a running broker
+
+		Returns:
+			str, None if the machine has no monitor configured
+		"""
+		if name in self.compiled.monitors:
+			if brokered:
+				path = broker_path(name)
+				if owned(path):
+					return constants.BROKER_PREFIX + path
+			return self.compiled.monitors[name] or self.monitor_address(
+				self.config["virtual-machines"][name], self.compiled.vm_hosts[name]
+			)
+		return None
+
+
+	def monitor_address(self, vm_config, host=constants.CONFIG_DEFAULT_HOST):
+		"""
+		Determine monitor address of a virtual machine.
+
+		Args:
+			vm_config (dict): Virtual machine configuration
+			host (str, optional): Host of the virtual machine, key of 'hosts'
+
+		Returns:
+			str, IP address and Port of monitor, prefixed with "qmp:" for QMP
+		"""
+		# The gateway is only looked up when running inside a virtual machine
+		return self.compiled.monitor_address(vm_config, host) or \
+			self.compiled.monitor_address(vm_config, host, get_gateway())
+
+
 	def is_host_machine(self):
 		"""
 		Determine if current machine is the host.
@@ -135,25 +197,92 @@ class Client(object):
 		Returns:
 			bool
 		"""
-		return self.host_config.get("hostname", "") == gethostname()
+		return self.compiled.is_host_machine
+
+
+	def is_local(self, name):
+		"""
+		Determine if a virtual machine runs on this computer.
+
+		Args:
+			name (str): Virtual machine name
+
+		Returns:
+			bool
+		"""
+		local_host = self.compiled.local_host
+		return local_host is not None and self.compiled.vm_hosts.get(name) == local_host
 
 
 	def monitor_command(self, func):
 		"""
-		The monitor command process: Connect, run, disconnect.
+		The monitor command process: Acquire pooled connection, run, release.
+		The connection stays open for following commands until it idles out.
 		
 		Args:
 			func (function): Callback function
 		"""
-		if not self.monitor.connect():
-			print(constants.MONITOR_CANNOT_CONNECT)
+		acquired = self.pool.acquire(self.monitor)
+
+		# Socket of a broker that died, talk to the monitor directly
+		if not acquired and self.monitor.last_error == constants.BROKER_NOT_RUNNING:
+			self.monitor = self.pool.get(
+				self.endpoint(self.machine_name, False), self.is_local(self.machine_name)
+			)
+			acquired = self.pool.acquire(self.monitor)
+
+		if not acquired:
+			print(constants.MONITOR_CANNOT_CONNECT % self.monitor.last_error)
 			return
-		result = func(self.monitor)
-		self.monitor.disconnect()
-		return result
+		try:
+			return func(self.monitor)
+		finally:
+			self.pool.release(self.monitor)
+
 
+	def device_index(self):
+		"""
+		Device state of the active virtual machine. A state younger than
+		'device-cache-ttl' seconds is reused without touching the monitor, so
+		polling 'list' does not query it every time.
 
-	def device_names_to_ids(self, devices):
+		Returns:
+			DeviceIndex, None if the monitor cannot be reached
+		"""
+		index = self.monitor.cached_index(self.pool.index_ttl)
+		if index is not None:
+			return index
+		return self.monitor_command(lambda m: m.device_index(self.pool.index_ttl))
+
+
+	def monitor_for(self, name):
+		"""
+		Pooled monitor of a virtual machine.
+
+		Args:
+			name (str): Virtual machine name
+
+		Returns:
+			Monitor, None if the machine has no monitor configured
+		"""
+		address = self.endpoint(name)
+		return self.pool.get(address, self.is_local(name)) if address else None
+
+
+	def device_list(self, exclude):
+		"""
+		IDs of all configured devices.
+
+		Args:
+			exclude (str): Skip devices with this action, key of 'actions'
+
+		Returns:
+			list
+		"""
+		return list(self.compiled.device_lists[exclude])
+
+
+	def device_names_to_ids(self, devices, host_devices=None):
 		"""
 		Create list of devices by looping through 'devices' values and trying to
 		find the keys in 'usb_devices_full'.
@@ -162,16 +291,20 @@ class Client(object):
 		
 		Args:
 			devices (list): List of devices
+			host_devices (list, optional): Devices from 'host_usb_devices',
+				queried when not given
 		"""
 		result = []
-		host_devices = self.monitor_command(lambda m: m.host_usb_devices())
-		host_ids = [device["id"] for device in host_devices]
+		if host_devices is None and self.monitor.inventory:
+			host_devices = self.monitor.inventory.devices()
+		elif host_devices is None:
+			host_devices = self.monitor_command(lambda m: m.host_usb_devices())
+		host_ids = set(device.id for device in host_devices or [])
 
 		for device in devices:
 			# named device
-			name = self.usb_devices_full.get(device)
-			if name:
-				id = name.get("id")
+			if device in self.compiled.device_ids:
+				id = self.compiled.device_ids[device]
 
 			# vendor and product id
 			else:
@@ -193,9 +326,12 @@ class Client(object):
 		
 		Args:
 			text (str): Command
+
+		Returns:
+			tuple: (command name, list of arguments or None)
 		"""
-		text = text.split(" ", 1)
-		return (text[0], text[1].split(" ") if len(text) > 1 else None)
+		words = text.split()
+		return (words[0] if words else "", words[1:] or None)
 
 
 	def run_command(self, text):
@@ -206,62 +342,71 @@ class Client(object):
 			text (str): Command
 		"""
 		command, args = self.parse_command(text)
+		if not command:
+			return
 
-		# List commands
-		if command == "help":
-			self.command_help(args)
+		with span("client." + command):
+			self.dispatch_command(command, args)
 
-		# Exit
-		elif command == "exit" or command == "quit":
-			exit(0)
 
-		# Version
-		elif command == "version":
-			self.command_version(args)
+	def dispatch_command(self, command, args):
+		"""
+		Run parsed command.
 
-		# Wait
-		elif command == "wait" or command == "sleep":
-			if args: sleep(float(args[0]))
+		Args:
+			command (str): Command name
+			args (list): List arguments
+		"""
+		entry = self.command_table.get(command)
+		if not entry:
+			print(constants.CLIENT_UNKNOWN_COMMAND)
 
-		# Reload configuration file
-		elif command == "reload":
-			self.command_reload(args)
+		# Commands that talk to the monitor require that one is set
+		elif self.needs_monitor(command, args) and not self.vm_config:
+			print(constants.CLIENT_NO_VM_SET)
 
-		# Update configuration file from 'configuration-url'
-		elif command == "update":
-			self.command_update(args)
-			self.command_reload([])
+		else:
+			getattr(self, entry[0])(args)
 
-		# Show monitor information
-		elif command == "monitor":
-			self.command_monitor(args)
 
-		# Set active machine
-		elif command == "set":
-			self.command_set(args)
+	def needs_monitor(self, command, args):
+		"""
+		Test if a command talks to the monitor of the active machine.
 
-		# ** All commands below require that monitor is set and online **
-		elif not self.vm_config:
-			print(constants.CLIENT_NO_VM_SET)
+		Args:
+			command (str): Command name
+			args (list): List arguments
 
-		# List USB devices
-		elif command == "list":
-			self.command_list(args)
+		Returns:
+			bool
+		"""
+		entry = self.command_table.get(command)
+		if not entry or not entry[1]:
+			return False
 
-		# List USB devices connected to host
-		elif command == "hostlist" or command == "listhost":
-			self.command_hostlist(args)
+		# Every host is asked through its own monitors
+		return not (entry[0] == "command_hostlist" and args and "--all" in args)
 
-		# Add USB device
-		elif command == "add":
-			self.command_add(args)
 
-		# Remove USB devices
-		elif command == "remove" or command == "rem" or command == "del":
-			self.command_remove(args)
+	def command_exit(self, args):
+		"""
+		Exit.
 
-		else:
-			print(constants.CLIENT_UNKNOWN_COMMAND)
+		Args:
+			args (list): List arguments
+		"""
+		exit(0)
+
+
+	def command_wait(self, args):
+		"""
+		Wait for an amount of seconds.
+
+		Args:
+			args (list): List arguments
+		"""
+		if args:
+			sleep(float(args[0]))
 
 
 	def command_info(self, args):
@@ -314,10 +459,33 @@ class Client(object):
 			return
 
 
+	def command_stats(self, args):
+		"""
+		Show latency of the spans recorded by this process, or forget them.
+
+		Args:
+			args (list): List arguments
+		"""
+		if args and args[0] == "reset":
+			stats.reset()
+			print(constants.CLIENT_STATS_RESET)
+			return
+
+		summary = stats.summary()
+		if not summary:
+			print(constants.CLIENT_STATS_EMPTY)
+			return
+
+		print(constants.CLIENT_STATS_HEADER)
+		for row in summary:
+			print(constants.CLIENT_STATS_ROW % row)
+
+
 	def command_update(self, args):
 		"""
 		Download url set in 'configuration-url' and attempt to parse with YAML.
-		If the new config is valid YAML then replace current config.
+		If the new config is valid YAML then replace current config. The
+		configuration is reloaded either way.
 		
 		Args:
 			args (list): List arguments
@@ -329,6 +497,7 @@ class Client(object):
 
 		if not self.configuration_url:
 			print(constants.CONFIG_URL_NOT_SET)
+			self.command_reload([])
 			return
 
 		try:
@@ -354,6 +523,8 @@ class Client(object):
 			print(constants.CONFIG_CANNOT_LOAD_NEW)
 			logging.exception(exc)
 
+		self.command_reload([])
+
 
 	def command_reload(self, args):
 		"""
@@ -379,21 +550,17 @@ class Client(object):
 			args (list): List arguments
 		"""
 		if args:
-			# Backup old name, and reload new one
+			# Pick up changes to the file, only a stat when there are none
 			old_name = self.machine_name
-			self.machine_name = args[0]
 			self.load_config()
 
-			if not self.vm_config:
-				print(constants.CLIENT_INVALID_VM)
-
-				# Reload old config
-				self.machine_name = old_name
-				self.load_config()
-			else:
+			if self.set_machine(args[0]):
 				print(constants.CLIENT_SET_ACTIVE % self.machine_name)
 				return  # Return to not show available virtual machines
 
+			print(constants.CLIENT_INVALID_VM)
+			self.set_machine(old_name)
+
 		# Show available virtual machines
 		print(constants.CLIENT_CURRENT_VM % self.machine_name)
 		print(constants.CLIENT_VMS)
@@ -408,18 +575,15 @@ class Client(object):
 		Args:
 			args (list): List arguments
 		"""
-		if not self.monitor.connect():
-			print(constants.MONITOR_CANNOT_CONNECT)
+		index = self.device_index()
+		if index is None:
 			return
 
-		for device in self.monitor.usb_devices_more():
+		for device in index.connected():
 			print(constants.CLIENT_VM_DEVICE % (
-				device.get("id", "Unknown  "),
-				device["device"], device["product"]
+				device.id or "Unknown  ", device.device, device.product
 			))
 
-		self.monitor.disconnect()
-
 
 	def command_hostlist(self, args):
 		"""
@@ -428,18 +592,31 @@ class Client(object):
 		Args:
 			args (list): List arguments
 		"""
-		if not self.monitor.connect():
-			print(constants.MONITOR_CANNOT_CONNECT)
+		if args and "--all" in args:
+			self.command_hostlist_all(args)
+			return
+
+		index = self.device_index()
+		if index is None:
 			return
 
 		# Display host usb devices
-		for device in self.monitor.host_usb_devices_more():
+		for device in index.devices:
 			print(constants.CLIENT_HOST_DEVICE % (
-				device.get("id", "Unknown"), device.get("product", "Unknown"),
-				constants.CLIENT_DEVICE_CONNECTED if "device" in device else ""
+				device.id or "Unknown", device.product or "Unknown",
+				constants.CLIENT_DEVICE_CONNECTED if device.connected else ""
 			))
 
-		self.monitor.disconnect()
+
+	def command_hostlist_all(self, args):
+		"""
+		List USB devices of every host, querying the hosts concurrently.
+
+		Args:
+			args (list): List arguments
+		"""
+		from .fanout import HostInventory  # Thread pool only when needed
+		HostInventory(self).run()
 
 
 	def command_add(self, args):
@@ -449,20 +626,40 @@ class Client(object):
 		Args:
 			args (list): List arguments
 		"""
-		# Add all USB devices
+		self.add_devices(self.add_targets(args))
+
+
+	def add_targets(self, args, host_devices=None):
+		"""
+		Devices an 'add' command refers to.
+
+		Args:
+			args (list): List arguments
+			host_devices (list, optional): Devices from 'host_usb_devices',
+				queried when not given
+
+		Returns:
+			list of device IDs
+		"""
+		# Add all USB devices, except those with the action of "remove only"
 		if not args:
-			args = [  # Only add devices without the action of "remove only"
-				device["id"] for device in self.usb_devices
-					if device.get("action") not in self.actions["remove only"]
-			]
-		else:
-			args = self.device_names_to_ids(args)
-		
-		# Add USB device
-		if self.monitor_command(lambda m: m.add_usb(args)):
-			print(constants.CLIENT_ADDED % args)
-		else:
-			print(constants.CLIENT_CANNOT_ADD % args)
+			return self.device_list("remove only")
+		return self.device_names_to_ids(args, host_devices)
+
+
+	def add_devices(self, devices, snapshot=None):
+		"""
+		Add USB devices and print the outcome.
+
+		Args:
+			devices (list): Device IDs
+			snapshot (DeviceIndex, optional): Device state, queried when not
+				given, updated on success
+		"""
+		results = self.monitor_command(lambda m: m.add_usb_results(devices, snapshot))
+		self.print_results(
+			devices, results, constants.CLIENT_ADDED, constants.CLIENT_CANNOT_ADD
+		)
 
 
 	def command_remove(self, args):
@@ -472,17 +669,176 @@ class Client(object):
 		Args:
 			args (list): List arguments
 		"""
-		# Remove all USB devices
+		self.remove_devices(self.remove_targets(args))
+
+
+	def remove_targets(self, args, host_devices=None):
+		"""
+		Devices a 'remove' command refers to.
+
+		Args:
+			args (list): List arguments
+			host_devices (list, optional): Devices from 'host_usb_devices',
+				queried when not given
+
+		Returns:
+			list of device IDs
+		"""
+		# Remove all USB devices, except those with the action of "add only"
 		if not args:
-			args = [  # Only add devices without the action of "add only"
-				device["id"] for device in self.usb_devices
-					if device.get("action") not in self.actions["add only"]
-			]
-		else:
-			args = self.device_names_to_ids(args)
+			return self.device_list("add only")
+		return self.device_names_to_ids(args, host_devices)
 
-		# Remove USB device
-		if self.monitor_command(lambda m: m.remove_usb(args)):
-			print(constants.CLIENT_REMOVED % args)
+
+	def remove_devices(self, devices, snapshot=None):
+		"""
+		Remove USB devices and print the outcome.
+
+		Args:
+			devices (list): Device IDs
+			snapshot (DeviceIndex, optional): Device state, queried when not
+				given, updated on success
+		"""
+		# Remove USB device, by default only done once the guest let go of it
+		confirm = self.config.get("confirm-removal", True)
+		results = self.monitor_command(
+			lambda m: m.remove_usb_results(devices, snapshot, confirm=confirm)
+		)
+		self.print_results(
+			devices, results, constants.CLIENT_REMOVED, constants.CLIENT_CANNOT_REMOVE
+		)
+
+
+	def print_results(self, devices, results, success, failure):
+		"""
+		Print which devices succeeded, and the error of every other device.
+
+		Args:
+			devices (list): Device IDs
+			results (dict): Device ID -> error text, None if the monitor was
+				unavailable
+			success (str): Message for devices without error
+			failure (str): Message for devices with error
+		"""
+		if results is None:
+			print(failure % devices)
+			return
+
+		failed = [device for device in results if results[device]]
+		succeeded = [device for device in results if not results[device]]
+		if succeeded or not failed:
+			print(success % succeeded)
+
+		if failed:
+			print(failure % failed)
+			for device in failed:
+				print(constants.CLIENT_DEVICE_ERROR % (device, results[device]))
+
+
+	def command_apply(self, args):
+		"""
+		Apply a profile, or show available profiles.
+
+		Args:
+			args (list): List arguments
+		"""
+		if args:
+			self.load_config()  # Pick up changes to the profiles
+			from .fanout import Reconciler
+			Reconciler(self).run(args[0])
+			return
+
+		print(constants.PROFILES)
+		for name in self.compiled.profiles:
+			print("-", name)
+
+
+	def command_switch(self, args):
+		"""
+		Move USB devices from one virtual machine to another. Both monitors
+		are connected before anything is removed, every removal is requested at
+		once and the released devices are added to the target together, after
+		one shared wait for the source to let go of them.
+
+		Args:
+			args (list): List arguments
+		"""
+		if not args or len(args) < 2:
+			print(constants.CLIENT_SWITCH_USAGE)
+			return
+
+		source_name, target_name, args = args[0], args[1], args[2:]
+		source, target = self.monitor_for(source_name), self.monitor_for(target_name)
+		if not (source and target) or source is target:
+			print(constants.CLIENT_INVALID_VM)
+			return
+
+		if not self.pool.acquire(source):
+			print(constants.MONITOR_CANNOT_CONNECT % source.last_error)
+			return
+
+		try:
+			if not self.pool.acquire(target):
+				print(constants.MONITOR_CANNOT_CONNECT % target.last_error)
+				return
+
+			try:
+				self.switch(source, target, source_name, target_name, args)
+			finally:
+				self.pool.release(target)
+		finally:
+			self.pool.release(source)
+
+
+	def switch(self, source, target, source_name, target_name, args):
+		"""
+		Move devices between two acquired monitors and report latencies.
+
+		Args:
+			source (Monitor): Monitor to remove devices from
+			target (Monitor): Monitor to add devices to
+			source_name (str): Name of source virtual machine
+			target_name (str): Name of target virtual machine
+			args (list): Device names or ids, all devices when empty
+		"""
+		if args:
+			ids = self.device_names_to_ids(args, source.host_usb_devices())
 		else:
-			print(constants.CLIENT_CANNOT_REMOVE % args)
\ No newline at end of file
+			ids = self.device_list("add only")
+
+		start = monotonic()
+		source_snapshot = source.device_index()
+		target_snapshot = target.device_index()
+
+		# Without names, only the configured devices the source holds
+		if not args:
+			ids = [id for id in ids if source_snapshot.is_connected(id)]
+
+		# Request every removal in one write, the guest releases devices in
+		# parallel
+		userids = []
+		for id in ids:
+			userid = source.device_to_userid(id, source_snapshot)
+			userids.append(userid or source.device_ids(id)[2])
+		removed_at = monotonic()
+		errors = source.device_del_batch(userids)
+
+		# Wait for every release with one deadline, then add the released
+		# devices in one write
+		accepted = [(id, userid) for id, userid, error in zip(ids, userids, errors) if not error]
+		released = source.wait_removed_batch([userid for id, userid in accepted])
+		moved = [id for (id, userid), done in zip(accepted, released) if done]
+		results = target.add_usb_results(moved, target_snapshot)
+		elapsed = (monotonic() - removed_at) * 1000
+
+		switched = 0
+		for id in ids:
+			if id in results and not results[id]:
+				switched += 1
+				print(constants.CLIENT_SWITCHED % (id, source_name, target_name, elapsed))
+			else:
+				print(constants.CLIENT_CANNOT_SWITCH % (id, source_name, target_name))
+
+		print(constants.CLIENT_SWITCH_TOTAL % (
+			switched, len(ids), (monotonic() - start) * 1000
+		))
@@ -0,0 +1,283 @@
+import os
+import json
+import logging
+import yaml
+from socket import gethostname
+from . import constants
+
+
+# libyaml parses several times faster, same rules as FullLoader
+Loader = getattr(yaml, "CFullLoader", yaml.FullLoader)
+
+# Compiled configurations of this process, path -> (key, CompiledConfig)
+compiled = {}
+
+
+
+class CompiledConfig(object):
+	"""
+	Configuration file with everything the client looks up derived once:
+	device lists per action, device name to id index, hostname to virtual
+	machine map, the host of every virtual machine, monitor addresses that
+	do not depend on the network and the device IDs of every profile.
+	"""
+
+	def __init__(self, config, actions, hostname):
+		"""
+		Initialize CompiledConfig class.
+
+		Args:
+			config (dict): Parsed configuration file
+			actions (dict): Action names, see 'Client.actions'
+			hostname (str): Name of this machine
+		"""
+		self.config = config
+		self.warnings = []  # Logged by 'load', also when the cache is used
+		self.missing = [key for key in constants.CONFIG_REQUIRED_KEYS if key not in config]
+		if self.missing:
+			return
+
+		self.configuration_url = config.get("configuration-url", None)
+		self.host_config = config["host-machine"]
+		self.idle_timeout = config.get(
+			"monitor-idle-timeout", constants.POOL_IDLE_TIMEOUT
+		)
+
+		# Hypervisors, 'host-machine' is the host of machines without 'host'
+		self.hosts = {constants.CONFIG_DEFAULT_HOST: self.host_config}
+		self.hosts.update(
+			(name, host or {}) for name, host in (config.get("hosts") or {}).items()
+		)
+		self.local_host = next((
+			name for name, host in self.hosts.items()
+				if host.get("hostname", "") == hostname
+		), None)
+		self.is_host_machine = self.local_host is not None
+
+		# Devices
+		self.usb_devices_full = {
+			k: v for k, v in config["usb-devices"].items()
+				if v.get("action") not in actions["ignore"]
+		}
+		self.usb_devices = list(self.usb_devices_full.values())
+		self.device_ids = {k: v.get("id") for k, v in self.usb_devices_full.items()}
+		self.device_lists = {
+			action: [
+				device["id"] for device in self.usb_devices
+					if device.get("action") not in names
+			] for action, names in actions.items()
+		}
+
+		# Virtual machines, the last one with a matching hostname wins
+		self.vm_names = list(config["virtual-machines"].keys())
+		self.vm_hosts = {}
+		for key, value in config["virtual-machines"].items():
+			host = value.get("host", constants.CONFIG_DEFAULT_HOST)
+			if host not in self.hosts:
+				self.warnings.append(constants.CONFIG_UNKNOWN_HOST % (key, host))
+				host = constants.CONFIG_DEFAULT_HOST
+			self.vm_hosts[key] = host
+
+		self.hostnames = {
+			value["hostname"]: key
+				for key, value in config["virtual-machines"].items()
+					if "hostname" in value
+		}
+		self.monitors = {
+			key: self.monitor_address(value, self.vm_hosts[key])
+				for key, value in config["virtual-machines"].items()
+					if "monitor" in value
+		}
+
+		# Profiles, name -> virtual machine -> device IDs it should have
+		self.profiles = {}
+		for name, machines in (config.get("profiles") or {}).items():
+			self.profiles[name] = {}
+			for machine, devices in (machines or {}).items():
+				if machine not in self.vm_hosts:
+					self.warnings.append(constants.CONFIG_UNKNOWN_PROFILE_VM % (name, machine))
+					continue
+
+				ids = []
+				for device in devices or []:
+					id = self.device_ids.get(device) or (device if ":" in str(device) else None)
+					if id is None:
+						self.warnings.append(constants.CONFIG_UNKNOWN_PROFILE_DEVICE % (name, device))
+					elif id not in ids:
+						ids.append(id)
+				self.profiles[name][machine] = ids
+
+
+	def vms_on(self, host):
+		"""
+		Virtual machines of a host that have a monitor.
+
+		Args:
+			host (str): Host name, key of 'hosts'
+
+		Returns:
+			list
+		"""
+		return [
+			name for name in self.vm_names
+				if self.vm_hosts[name] == host and name in self.monitors
+		]
+
+
+	def monitor_address(self, vm_config, host, gateway=None):
+		"""
+		Monitor address of a virtual machine.
+
+		Args:
+			vm_config (dict): Virtual machine configuration
+			host (str): Host of the virtual machine, key of 'hosts'
+			gateway (str, optional): IP address of the gateway, used when
+				running inside a virtual machine of that host
+
+		Returns:
+			str, IP address and Port of monitor, prefixed with "qmp:" for QMP,
+			None if the gateway has to be looked up at runtime
+		"""
+		# Host name for monitor, QMP monitors are prefixed with "qmp:"
+		monitor_host = vm_config["monitor"]
+		scheme = ""
+		if monitor_host.startswith(constants.QMP_PREFIX):
+			scheme = constants.QMP_PREFIX
+			monitor_host = monitor_host[len(scheme):]
+
+		# If monitor_host starts with a colon, we should guess which IP to use
+		# when it's not, Monitor IP:Port is probably specified by user
+		if monitor_host[0] != ":":
+			return scheme + monitor_host
+
+		# User can set 'ip-address' to '-' to automatically determine ip address
+		ip_address = self.hosts[host].get("ip-address", "-")
+		if ip_address == "-":
+			if host == self.local_host:
+				ip_address = "127.0.0.1"  # We are the host machine
+			elif gateway:
+				ip_address = gateway  # We are the virtual machine
+			else:
+				return None
+
+		# Remember that "monitor_host" is just a port prefixed with a colon
+		return scheme + ip_address + monitor_host
+
+
+
+def cache_path(path):
+	"""
+	Location of the compiled configuration, next to the configuration file.
+
+	Args:
+		path (str): Configuration file path
+
+	Returns:
+		str
+	"""
+	directory, filename = os.path.split(os.path.abspath(path))
+	return os.path.join(directory, "." + filename + constants.CONFIG_CACHE_SUFFIX)
+
+
+def load(path, actions):
+	"""
+	Compiled configuration of a file. Parsed only when the file's path,
+	modification time or size changed since it was last compiled, either by
+	this process or by an earlier one through the cache file.
+
+	Args:
+		path (str): Configuration file path
+		actions (dict): Action names, see 'Client.actions'
+
+	Returns:
+		CompiledConfig
+
+	Raises:
+		OSError: File cannot be read
+		yaml.YAMLError: File is not valid YAML
+	"""
+	path = os.path.abspath(path)
+	stat = os.stat(path)
+	key = (
+		constants.VERSION, constants.CONFIG_CACHE_FORMAT, path, stat.st_mtime_ns,
+		stat.st_size, gethostname(), actions
+	)
+
+	# Unchanged since this process compiled it
+	entry = compiled.get(path)
+	if entry and entry[0] == key:
+		return entry[1]
+
+	# Unchanged since another process compiled it
+	try:
+		with open(cache_path(path)) as f:
+			cached_key, state = json.load(f)
+		if cached_key == plain(key):
+			config = CompiledConfig.__new__(CompiledConfig)
+			config.__dict__.update(state)
+			compiled[path] = (key, config)
+			log_warnings(config)
+			return config
+	except Exception:
+		pass  # Missing, stale or unreadable cache
+
+	with open(path) as f:
+		config = CompiledConfig(yaml.load(f, Loader=Loader) or {}, actions, key[5])
+
+	compiled[path] = (key, config)
+	log_warnings(config)
+	if not config.missing:
+		save(cache_path(path), key, config)
+	return config
+
+
+def log_warnings(config):
+	"""
+	Log what was wrong with a configuration when it was compiled.
+
+	Args:
+		config (CompiledConfig): Compiled configuration
+	"""
+	for warning in config.warnings:
+		logging.warning(warning)
+
+
+def plain(value):
+	"""
+	Value as it comes back from JSON, e.g. tuples become lists.
+
+	Args:
+		value: Anything JSON can hold
+
+	Returns:
+		same value made of dicts, lists, strings, numbers and None
+
+	Raises:
+		TypeError: Value cannot be stored as JSON
+	"""
+	return json.loads(json.dumps(value))
+
+
+def save(path, key, config):
+	"""
+	Write compiled configuration to the cache file as JSON, so reading it
+	can never run code. Failing is not an error, the configuration will just
+	be parsed again next time, also when it holds values JSON would change,
+	such as dates or keys that are not strings.
+
+	Args:
+		path (str): Cache file path
+		key (tuple): Cache key from 'load'
+		config (CompiledConfig): Compiled configuration
+	"""
+	try:
+		state = vars(config)
+		if plain(state) != state:
+			return
+
+		temporary = path + ".%d" % os.getpid()
+		with open(temporary, "w") as f:
+			json.dump((key, state), f)
+		os.replace(temporary, path)
+	except (OSError, TypeError, ValueError) as exc:
+		logging.debug(exc)
@@ -3,9 +3,52 @@ CONFIG_NAME_SHORT = "config"
 CONFIG_NAME_LONG = "qemu_usb_dm_config"
 
 # Monitor
+MONITOR_PROMPT = b"(qemu) "
+MONITOR_TIMEOUT = 2.0  # Seconds to wait for the prompt after a command
+MONITOR_CONNECT_DEADLINE = 2.0  # Seconds before giving up on a busy monitor
+MONITOR_BACKOFF_INITIAL = 0.02  # First retry step when the monitor hung up
+MONITOR_BACKOFF_MAX = 0.4
+MONITOR_RELEASE_TIMEOUT = 2.0  # Seconds to wait for a removed device's release
+MONITOR_POLL_INTERVAL = 0.005  # First interval when polling for a release
+MONITOR_POLL_MAX_INTERVAL = 0.05
+POOL_IDLE_TIMEOUT = 0.5  # Seconds before an unused connection is closed, below MONITOR_CONNECT_DEADLINE
+POOL_INDEX_TTL = 2.0  # Seconds 'list' and 'hostlist' reuse the device state
+STATS_SAMPLES = 1000  # Recent durations kept per span for percentiles
 MONITOR_NOT_SET = "No monitor set."
-MONITOR_IN_USE = "Monitor is already in use."
-MONITOR_CANNOT_CONNECT = "Could not connect to monitor."
+MONITOR_IN_USE = "monitor is in use by another client"
+MONITOR_CONNECT_TIMEOUT = "timed out"  # Same as the socket error of the telnet monitor
+MONITOR_CANNOT_CONNECT = "Could not connect to monitor (%s)."
+MONITOR_REFUSED = "connection refused, is the virtual machine running?"
+MONITOR_NO_GREETING = "monitor closed the connection without greeting"
+MONITOR_READ_TIMEOUT = "Monitor did not return a prompt within %s seconds."
+MONITOR_NO_REPLY = "No reply from monitor."
+MONITOR_ALREADY_ADDED = "Device is already added."
+MONITOR_NOT_RELEASED = "Device was not released within %s seconds."
+
+# QMP
+QMP_PREFIX = "qmp:"
+QMP_UNIX_PREFIX = "unix:"
+QMP_EVENTS_KEPT = 64  # Events kept for 'wait_event', older ones are dropped
+QMP_NEGOTIATION_FAILED = "QMP capabilities negotiation failed."
+ASYNC_QMP_UNSUPPORTED = "'%s' uses a QMP monitor, which AsyncClient does not support."
+ASYNC_BROKER_UNSUPPORTED = "'%s' is served by a monitor broker, which AsyncClient does not support."
+
+
+# Broker
+BROKER_PREFIX = "broker:"
+BROKER_SOCKET_NAME = "qemu_usb_dm-%s.monitor.sock"  # Per virtual machine
+BROKER_LISTENING = "Sharing monitor %s on %s"
+BROKER_ALREADY_RUNNING = "A broker is already listening on %s"
+BROKER_NOT_OWNED = "%s belongs to another user"
+BROKER_NOT_RUNNING = "monitor broker is not running"
+
+
+# Hotplug
+SYSFS_USB_DEVICES = "/sys/bus/usb/devices"
+HOTPLUG_DEBOUNCE = 0.5  # Seconds a device has to stay plugged in before attaching
+HOTPLUG_POLL_INTERVAL = 0.25  # Seconds between sysfs polls without netlink
+HOTPLUG_WATCHING = "Watching for USB devices (%s)."
+HOTPLUG_NOT_HOST = "Hotplug watching only works on the host machine."
 
 
 # Client
@@ -17,11 +60,26 @@ CLIENT_VMS = "Virtual Machines: "
 CLIENT_VM_DEVICE = "- ID: %s / Device: %s / %s"
 CLIENT_HOST_DEVICE = "- ID: %s / %s %s"
 CLIENT_DEVICE_CONNECTED = "[Connected]"
+CLIENT_DEVICE_ATTACHED = "[%s]"
+CLIENT_HOSTLIST_TOTAL = "Listed %d host(s) in %.1f ms"
+CLIENT_NO_HOST_MONITOR = "no virtual machine with a monitor on this host"
 CLIENT_UNKNOWN_COMMAND = "Unknown command. Type 'help' for a list of commands."
 CLIENT_ADDED = "Added device(s): %s"
 CLIENT_REMOVED = "Removed device(s): %s"
 CLIENT_CANNOT_ADD = "Could not add device(s): %s"
 CLIENT_CANNOT_REMOVE = "Could not remove device(s): %s"
+CLIENT_DEVICE_ERROR = "- %s: %s"
+CLIENT_SWITCH_USAGE = "Usage: switch [from] [to] [devices]"
+CLIENT_SWITCHED = "Switched %s from '%s' to '%s' in %.1f ms"
+CLIENT_CANNOT_SWITCH = "Could not switch %s from '%s' to '%s'"
+CLIENT_SWITCH_TOTAL = "Switched %d of %d device(s) in %.1f ms"
+CLIENT_STATS_HEADER = "%-32s %8s %10s %9s %9s %9s %9s" % (
+	"span", "count", "total ms", "mean ms", "p50 ms", "p99 ms", "max ms"
+)
+CLIENT_STATS_ROW = "%-32s %8d %10.2f %9.2f %9.2f %9.2f %9.2f"
+CLIENT_STATS_EMPTY = "No timings recorded yet."
+CLIENT_STATS_RESET = "Timings reset."
+CLIENT_TIMINGS_NO_LOG = "--timings writes to the log file, which is given with --log."
 CLIENT_WELCOME = \
 """
 Limited QEMU Monitor Wrapper for USB management
@@ -38,6 +96,7 @@ CLIENT_HELP = \
 - monitor | Show monitor information
 - list | List USB devices connected to virtual machine
 - hostlist | List USB devices connected to host machine
+- hostlist --all | List USB devices of every host and where they are attached
 - set | Show available virtual machines
 - set [name] | Set active machine by name
 - add | Add all USB devices
@@ -46,6 +105,12 @@ CLIENT_HELP = \
 - remove | Remove all USB devices
 - remove [id] | Remove USB device by id
 - remove [name] | Remove USB device by specified name
+- switch [from] [to] | Move all USB devices from one machine to another
+- switch [from] [to] [names] | Move USB devices by id or name
+- apply | Show available profiles
+- apply [profile] | Give every virtual machine of a profile exactly its devices
+- stats | Show latency of monitor commands, parsing and client commands
+- stats reset | Forget recorded latencies
 """.strip()
 CLIENT_INFO = \
 """
@@ -57,7 +122,46 @@ BASE_DIR: %(BASE_DIR)s
 """.strip()
 
 
+# Daemon
+DAEMON_SOCKET_NAME = "qemu_usb_dm.sock"
+DAEMON_FALLBACK_NAME = "%d-%s"  # User ID and socket name, in /tmp without XDG_RUNTIME_DIR
+DAEMON_NOT_OWNED = "%s belongs to another user"
+DAEMON_LISTENING = "Listening on %s"
+DAEMON_ALREADY_RUNNING = "A daemon is already listening on %s"
+
+
+# Fan-out
+FANOUT_WORKERS = 8  # Virtual machines handled at the same time
+FANOUT_UNKNOWN_VMS = "Unknown virtual machine(s): %s"
+FANOUT_NO_MONITOR = "Virtual machine(s) without a monitor: %s"
+FANOUT_HEADER = "== %s (%.1f ms) =="
+FANOUT_TOTAL = "Ran %d command(s) on %d virtual machine(s) in %.1f ms, slowest was '%s' (%.1f ms)"
+
+
+# Profiles
+PROFILES = "Profiles: "
+PROFILE_UNKNOWN = "Unknown profile '%s'. Type 'apply' for a list of profiles."
+PROFILE_MACHINE_ERROR = "%s: %s"
+PROFILE_NOT_PLUGGED_IN = "%s is not plugged in."
+PROFILE_STILL_ATTACHED = "Still attached to another virtual machine."
+PROFILE_UNCHANGED = "Profile '%s' is already applied."
+PROFILE_APPLIED = "Applied profile '%s': %d added, %d removed on %d virtual machine(s) in %.1f ms"
+
+
+# Script
+SCRIPT_CANNOT_READ = "Cannot read script %s: %s"
+SCRIPT_UNKNOWN_COMMAND = "Unknown command on line %d, nothing was run: %s"
+SCRIPT_COMMAND_FAILED = "Command failed: %s"
+
+
 # Config
+CONFIG_REQUIRED_KEYS = ("usb-devices", "host-machine", "virtual-machines")
+CONFIG_CACHE_SUFFIX = ".cache"  # Compiled configuration, next to the file
+CONFIG_CACHE_FORMAT = 5  # Increase when CompiledConfig changes
+CONFIG_DEFAULT_HOST = "host-machine"  # Host of machines without 'host'
+CONFIG_UNKNOWN_HOST = "Virtual machine '%s' refers to unknown host '%s', using 'host-machine'."
+CONFIG_UNKNOWN_PROFILE_VM = "Profile '%s' refers to unknown virtual machine '%s', skipped."
+CONFIG_UNKNOWN_PROFILE_DEVICE = "Profile '%s' refers to unknown device '%s', skipped."
 CONFIG_DOES_NOT_EXIST = "Configuration file (%s) does not exist."
 CONFIG_CANNOT_LOAD = "Cannot load configuration.\n%s"
 CONFIG_LOOKED_FOR = "Looked for '%s' in these directories:"
@@ -0,0 +1,104 @@
+import os
+import json
+import socket
+from . import constants
+
+
+def runtime_path(name):
+	"""
+	Location of a socket in the user's runtime directory. Without
+	XDG_RUNTIME_DIR the shared /tmp is used and the name starts with the user
+	ID, so users do not find each other's sockets.
+
+	Args:
+		name (str): Socket file name
+
+	Returns:
+		str
+	"""
+	directory = os.environ.get("XDG_RUNTIME_DIR")
+	if directory:
+		return os.path.join(directory, name)
+	if hasattr(os, "getuid"):
+		name = constants.DAEMON_FALLBACK_NAME % (os.getuid(), name)
+	return os.path.join("/tmp", name)
+
+
+def owned(path):
+	"""
+	Test if a socket exists and belongs to the current user, anyone can
+	create files in /tmp.
+
+	Args:
+		path (str): Socket path
+
+	Returns:
+		bool
+	"""
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return False
+	return not hasattr(os, "getuid") or stat.st_uid == os.getuid()
+
+
+def socket_path():
+	"""
+	Default location of the daemon's control socket.
+
+	Returns:
+		str
+	"""
+	return os.environ.get(
+		"QEMU_USB_DEVICE_MANAGER_SOCKET",
+		runtime_path(constants.DAEMON_SOCKET_NAME)
+	)
+
+
+def broker_path(name):
+	"""
+	Location of the monitor broker socket of a virtual machine, next to the
+	daemon's control socket.
+
+	Args:
+		name (str): Virtual machine name
+
+	Returns:
+		str
+	"""
+	return runtime_path(constants.BROKER_SOCKET_NAME % name.replace(os.sep, "_"))
+
+
+def forward(path, name, commands):
+	"""
+	Send commands to a running daemon.
+
+	Args:
+		path (str): Control socket path
+		name (str): Virtual machine name, None for the daemon's default
+		commands (list): Commands to run
+
+	Returns:
+		str, output of the commands or None if no daemon is listening
+	"""
+	if not owned(path):
+		return None
+
+	try:
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.connect(path)
+	except OSError:
+		return None
+
+	with sock:
+		request = {"name": name, "commands": commands}
+		sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+		chunks = []
+		while True:
+			data = sock.recv(65536)
+			if not data:
+				break
+			chunks.append(data)
+
+	return b"".join(chunks).decode("utf-8")
@@ -0,0 +1,110 @@
+import os
+import json
+from io import StringIO
+from contextlib import redirect_stdout
+from socketserver import UnixStreamServer, StreamRequestHandler
+from . import constants
+from .control import forward, owned
+from .script import machine_client, run_commands
+
+
+
+class DaemonHandler(StreamRequestHandler):
+	"""
+	Runs one request of commands and replies with their output.
+	"""
+
+	def handle(self):
+		try:
+			request = json.loads(self.rfile.readline().decode("utf-8"))
+		except ValueError:
+			return
+
+		output = StringIO()
+		with redirect_stdout(output):
+			self.server.daemon.run(request.get("name"), request.get("commands", []))
+		self.wfile.write(output.getvalue().encode("utf-8"))
+
+
+
+class Daemon(object):
+	"""
+	Resident process that keeps the parsed configuration, monitor connections
+	and device state in memory. Commands arrive over a UNIX domain socket so a
+	hotkey only pays for a small client instead of a full start up.
+	"""
+
+	def __init__(self, client, path):
+		"""
+		Initialize Daemon class.
+
+		Args:
+			client (Client): Client for the default virtual machine
+			path (str): Control socket path
+		"""
+		self.client = client
+		self.path = path
+		self.clients = {client.machine_name: client}
+
+
+	def client_for(self, name):
+		"""
+		Client for a virtual machine, sharing the default client's monitor
+		connections.
+
+		Args:
+			name (str): Virtual machine name, None for the default
+
+		Returns:
+			Client
+		"""
+		if not name:
+			return self.client
+
+		if name not in self.clients:
+			self.clients[name] = machine_client(self.client, name)
+		return self.clients[name]
+
+
+	def run(self, name, commands):
+		"""
+		Run commands like 'main' does for '-c'.
+
+		Args:
+			name (str): Virtual machine name, None for the default
+			commands (list): Commands to run
+		"""
+		run_commands(self.client_for(name), commands)
+
+
+	def serve_forever(self):
+		"""
+		Listen on the control socket until interrupted.
+
+		Returns:
+			bool, False if the socket is taken by another daemon
+		"""
+		if os.path.exists(self.path):
+			if not owned(self.path):
+				print(constants.DAEMON_NOT_OWNED % self.path)
+				return False
+			if forward(self.path, None, []) is not None:
+				print(constants.DAEMON_ALREADY_RUNNING % self.path)
+				return False
+			os.unlink(self.path)  # Left over from a daemon that died
+
+		server = UnixStreamServer(self.path, DaemonHandler)
+		server.daemon = self
+		os.chmod(self.path, 0o600)
+		print(constants.DAEMON_LISTENING % self.path)
+
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			server.server_close()
+			os.unlink(self.path)
+			self.client.pool.close()
+
+		return True
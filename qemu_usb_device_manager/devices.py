@@ -0,0 +1,292 @@
+import re
+
+
+
+class UsbDevice(object):
+	"""
+	USB device as reported by the monitor. Host devices carry bus details,
+	devices attached to the virtual machine carry the guest 'device' address
+	and user ID. A joined device carries both.
+	"""
+	__slots__ = (
+		"bus", "addr", "port", "speed", "device_class", "vendor_id",
+		"product_id", "product", "device", "userid"
+	)
+
+
+	def __init__(self, bus=None, addr=None, port=None, speed=None,
+			device_class=None, vendor_id=None, product_id=None, product=None,
+			device=None, userid=None):
+		"""
+		Initialize UsbDevice class.
+
+		Args:
+			bus (int, optional): Host bus number
+			addr (int, optional): Host address on the bus
+			port (str, optional): Port path, e.g. "1.2"
+			speed (float, optional): Speed in Mb/s, None when unknown
+			device_class (int, optional): USB class code
+			vendor_id (int, optional): Vendor ID
+			product_id (int, optional): Product ID
+			product (str, optional): Product name
+			device (str, optional): Guest address, set when attached to the VM
+			userid (str, optional): ID of the device inside QEMU
+		"""
+		self.bus = bus
+		self.addr = addr
+		self.port = port
+		self.speed = speed
+		self.device_class = device_class
+		self.vendor_id = vendor_id
+		self.product_id = product_id
+		self.product = product
+		self.device = device
+		self.userid = userid
+
+
+	def __repr__(self):
+		return "UsbDevice(%s)" % ", ".join(
+			"%s=%r" % (k, getattr(self, k)) for k in self.__slots__
+				if getattr(self, k) is not None
+		)
+
+
+	@property
+	def id(self):
+		"""
+		Vendor:product id, e.g. "046d:c52b", None when unknown.
+		"""
+		if self.vendor_id is None:
+			return None
+		return "%04x:%04x" % (self.vendor_id, self.product_id)
+
+
+	@property
+	def connected(self):
+		"""
+		Device is attached to the virtual machine.
+		"""
+		return self.device is not None
+
+
+
+class DeviceIndex(object):
+	"""
+	Host USB devices joined with the devices attached to a virtual machine.
+
+	Host devices are keyed by their bus location, with vendor:product id as
+	secondary key. A virtual machine device is joined to one host device only:
+	by the vendor:product id in its user ID when it was added by this program,
+	otherwise by product name. Identical devices are therefore never merged
+	twice. Build once per snapshot, every lookup is a dictionary access.
+	"""
+	userid_pattern = re.compile(r"^device-([0-9a-f]{4})-([0-9a-f]{4})$", re.I)
+
+
+	def __init__(self, host_devices, vm_devices=()):
+		"""
+		Initialize DeviceIndex class.
+
+		Args:
+			host_devices (list): Devices from 'Monitor.host_usb_devices'
+			vm_devices (list, optional): Devices from 'Monitor.usb_devices'
+		"""
+		self.devices = []  # Host devices in bus order, connected ones merged
+		self.unmatched = []  # Virtual machine devices without host device
+		self.locations = {}  # (bus, addr) and (bus, port) -> device
+		self.ids = {}  # vendor:product -> [device, ...]
+		self.products = {}  # product name -> [device, ...]
+		self.buses = {}  # bus -> [device, ...]
+		self.userids = {}  # user ID -> device
+
+		for device in host_devices:
+			self.devices.append(device)
+			self.locations[(device.bus, device.addr)] = device
+			self.locations[(device.bus, device.port)] = device
+			self.buses.setdefault(device.bus, []).append(device)
+			self.ids.setdefault(device.id, []).append(device)
+			self.products.setdefault(device.product, []).append(device)
+
+		for device in vm_devices:
+			self.attach(device)
+
+
+	@staticmethod
+	def normalize(value):
+		"""
+		Strip "host:" prefix from vendor:product id.
+
+		Args:
+			value (str): Vendor:Product ID
+
+		Returns:
+			str
+		"""
+		return value[5:].lower() if value.startswith("host:") else value.lower()
+
+
+	def userid_to_id(self, userid):
+		"""
+		Vendor and product id encoded in a user ID given by this program.
+
+		Args:
+			userid (str): User ID, e.g. "device-046d-c52b"
+
+		Returns:
+			tuple: (vendor id, product id) as int, None if the user ID was
+			chosen by someone else
+		"""
+		match = self.userid_pattern.match(userid or "")
+		if not match:
+			return None
+		return (int(match.group(1), 16), int(match.group(2), 16))
+
+
+	def attach(self, vm_device):
+		"""
+		Join virtual machine device to its host device.
+
+		Args:
+			vm_device (UsbDevice): Device from 'Monitor.usb_devices'
+
+		Returns:
+			UsbDevice, merged host device or the virtual machine device if
+			there is no free host device for it
+		"""
+		ids = self.userid_to_id(vm_device.userid)
+		if ids:
+			vm_device.vendor_id, vm_device.product_id = ids
+
+		# Product name only joins devices that have one
+		candidates = self.ids.get(vm_device.id, [])
+		if vm_device.product:
+			candidates = candidates + self.products.get(vm_device.product, [])
+		host_device = next((d for d in candidates if not d.connected), None)
+
+		if host_device is None:
+			self.unmatched.append(vm_device)
+			device = vm_device
+		else:
+			# Host details win, the virtual machine adds its own
+			host_device.device = vm_device.device or ""
+			host_device.userid = vm_device.userid
+			device = host_device
+
+		if vm_device.userid:
+			self.userids[vm_device.userid] = device
+		return device
+
+
+	def detach(self, userid):
+		"""
+		Forget that a device is attached to the virtual machine.
+
+		Args:
+			userid (str): User ID of the device
+		"""
+		device = self.userids.pop(userid, None)
+		if device is None:
+			return
+
+		if device in self.unmatched:
+			self.unmatched.remove(device)
+		else:
+			device.device = device.userid = None
+
+
+	def connected(self):
+		"""
+		Devices attached to the virtual machine.
+
+		Returns:
+			list
+		"""
+		return [device for device in self.devices if device.connected]
+
+
+	def find_id(self, value):
+		"""
+		Host devices by vendor:product id.
+
+		Args:
+			value (str): Vendor:Product ID
+
+		Returns:
+			list
+		"""
+		return self.ids.get(self.normalize(value), [])
+
+
+	def find_userid(self, userid):
+		"""
+		Attached device by user ID.
+
+		Args:
+			userid (str): User ID
+
+		Returns:
+			UsbDevice, None if not attached
+		"""
+		return self.userids.get(userid)
+
+
+	def find_product(self, product):
+		"""
+		Host devices by product name.
+
+		Args:
+			product (str): Product name
+
+		Returns:
+			list
+		"""
+		return self.products.get(product, [])
+
+
+	def find_bus(self, bus, location=None):
+		"""
+		Host devices on a bus.
+
+		Args:
+			bus (int): Bus number
+			location (Union[int, str], optional): Address (int) or port (str)
+
+		Returns:
+			list
+		"""
+		if location is None:
+			return self.buses.get(bus, [])
+		device = self.locations.get((bus, location))
+		return [device] if device else []
+
+
+	def is_connected(self, value):
+		"""
+		Test if a device with the vendor:product id is attached.
+
+		Args:
+			value (str): Vendor:Product ID
+
+		Returns:
+			bool
+		"""
+		value = self.normalize(value)
+		return any(d.connected for d in self.ids.get(value, [])) or any(
+			d.id == value for d in self.unmatched
+		)
+
+
+	def userid(self, value):
+		"""
+		User ID of an attached device.
+
+		Args:
+			value (str): Vendor:Product ID
+
+		Returns:
+			str, None if not attached
+		"""
+		value = self.normalize(value)
+		for device in self.ids.get(value, []) + self.unmatched:
+			if device.id == value and device.userid:
+				return device.userid
@@ -0,0 +1,531 @@
+import sys
+from io import StringIO
+from threading import local
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+from . import constants
+from .devices import DeviceIndex
+from .script import machine_client, run_commands
+
+
+
+class ThreadOutput(object):
+	"""
+	Replacement for sys.stdout that sends every thread's prints to its own
+	buffer while capturing, and to the original stream otherwise.
+	"""
+
+	def __init__(self, stream):
+		"""
+		Initialize ThreadOutput class.
+
+		Args:
+			stream (file): Original stream
+		"""
+		self.stream = stream
+		self.local = local()
+
+
+	def write(self, text):
+		return (getattr(self.local, "buffer", None) or self.stream).write(text)
+
+
+	def flush(self):
+		(getattr(self.local, "buffer", None) or self.stream).flush()
+
+
+	def capture(self, func, *args):
+		"""
+		Run function and collect what it prints in this thread.
+
+		Args:
+			func (function): Function to run
+			*args: Arguments of the function
+
+		Returns:
+			str, everything printed
+		"""
+		self.local.buffer = StringIO()
+		try:
+			func(*args)
+			return self.local.buffer.getvalue()
+		finally:
+			self.local.buffer = None
+
+
+
+class FanOut(object):
+	"""
+	Runs the same commands against many virtual machines at once. Every
+	machine gets its own Client and Monitor, connections are shared through
+	the client's pool. Workers are bounded, so the total time follows the
+	slowest machine as long as there are no more machines than workers.
+	"""
+
+	def __init__(self, client, workers=constants.FANOUT_WORKERS):
+		"""
+		Initialize FanOut class.
+
+		Args:
+			client (Client): Client whose configuration and pool are used
+			workers (int, optional): Machines handled at the same time
+		"""
+		self.client = client
+		self.workers = workers
+
+
+	def run_one(self, output, client, commands):
+		"""
+		Run commands against one virtual machine, inside a worker.
+
+		Args:
+			output (ThreadOutput): Installed as sys.stdout
+			client (Client): Client of the virtual machine
+			commands (list): Commands to run
+
+		Returns:
+			tuple: (output, seconds)
+		"""
+		start = monotonic()
+		text = output.capture(run_commands, client, commands)
+		return (text, monotonic() - start)
+
+
+	def run(self, names, commands):
+		"""
+		Run commands against every virtual machine and print the output of
+		each machine once it is done, in the order of 'names'.
+
+		Args:
+			names (list): Virtual machine names
+			commands (list): Commands to run
+
+		Returns:
+			bool, False if a name is not a virtual machine with a monitor
+		"""
+		if not names:
+			print(constants.CLIENT_INVALID_VM)
+			return False
+
+		unknown = [name for name in names if name not in self.client.vm_names]
+		if unknown:
+			print(constants.FANOUT_UNKNOWN_VMS % ", ".join(unknown))
+			return False
+
+		unmonitored = [name for name in names if name not in self.client.compiled.monitors]
+		if unmonitored:
+			print(constants.FANOUT_NO_MONITOR % ", ".join(unmonitored))
+			return False
+
+		clients = [machine_client(self.client, name) for name in names]
+		output = ThreadOutput(sys.stdout)
+		start = monotonic()
+		slowest = (None, 0.0)
+
+		sys.stdout = output
+		try:
+			with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+				futures = [
+					executor.submit(self.run_one, output, client, commands)
+						for client in clients
+				]
+				for name, future in zip(names, futures):
+					text, seconds = future.result()
+					print(constants.FANOUT_HEADER % (name, seconds * 1000))
+					print(text, end="")
+					if seconds >= slowest[1]:
+						slowest = (name, seconds)
+		finally:
+			sys.stdout = output.stream
+
+		print(constants.FANOUT_TOTAL % (
+			len(commands), len(names), (monotonic() - start) * 1000,
+			slowest[0], slowest[1] * 1000
+		))
+		return True
+
+
+
+class HostInventory(object):
+	"""
+	Host USB devices of every hypervisor in the configuration, queried at
+	the same time. A host is asked through the monitor of the first of its
+	virtual machines that can be reached, or read from sysfs when it is this
+	computer. Devices attached to any of its virtual machines are joined to
+	the host devices.
+	"""
+
+	def __init__(self, client, workers=constants.FANOUT_WORKERS):
+		"""
+		Initialize HostInventory class.
+
+		Args:
+			client (Client): Client whose configuration and pool are used
+			workers (int, optional): Hosts queried at the same time
+		"""
+		self.client = client
+		self.workers = workers
+
+
+	def query(self, host):
+		"""
+		Devices of one host and the virtual machines holding them.
+
+		Args:
+			host (str): Host name, key of 'hosts'
+
+		Returns:
+			tuple: (DeviceIndex or None if no monitor could be reached,
+			dict of device -> virtual machine name, last connection error,
+			seconds)
+		"""
+		start = monotonic()
+		client, compiled = self.client, self.client.compiled
+		index, owners, error = None, {}, constants.CLIENT_NO_HOST_MONITOR
+
+		if host == compiled.local_host and client.pool.inventory:
+			index = DeviceIndex(client.pool.inventory.devices())
+
+		for name in compiled.vms_on(host):
+			monitor = client.monitor_for(name)
+			if not client.pool.acquire(monitor):
+				error = monitor.last_error
+				continue
+
+			try:
+				if index is None:
+					index = DeviceIndex(monitor.host_usb_devices())
+				for device in monitor.usb_devices():
+					owners[index.attach(device)] = name
+			finally:
+				client.pool.release(monitor)
+
+		return (index, owners, error, monotonic() - start)
+
+
+	def run(self):
+		"""
+		Query every host and print its devices, in configuration order.
+
+		Returns:
+			bool, False if a host could not be queried
+		"""
+		hosts = list(self.client.compiled.hosts)
+		start = monotonic()
+
+		with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+			results = list(executor.map(self.query, hosts))
+
+		success = True
+		for host, (index, owners, error, seconds) in zip(hosts, results):
+			print(constants.FANOUT_HEADER % (host, seconds * 1000))
+			if index is None:
+				print(constants.MONITOR_CANNOT_CONNECT % error)
+				success = False
+				continue
+
+			for device in index.devices:
+				print(constants.CLIENT_HOST_DEVICE % (
+					device.id or "Unknown", device.product or "Unknown",
+					constants.CLIENT_DEVICE_ATTACHED % owners[device]
+						if device in owners else ""
+				))
+
+		print(constants.CLIENT_HOSTLIST_TOTAL % (
+			len(hosts), (monotonic() - start) * 1000
+		))
+		return success
+
+
+
+class Reconciler(object):
+	"""
+	Gives every virtual machine of a profile exactly the devices the profile
+	lists. Every monitor on the hosts of those machines is queried once, at
+	the same time, and only the differences are sent: devices held by the
+	wrong machine are removed on all machines at once, then the missing ones
+	are added. Nothing is sent when the state already matches.
+	"""
+
+	def __init__(self, client, workers=constants.FANOUT_WORKERS):
+		"""
+		Initialize Reconciler class.
+
+		Args:
+			client (Client): Client whose configuration and pool are used
+			workers (int, optional): Machines handled at the same time
+		"""
+		self.client = client
+		self.workers = workers
+
+
+	def snapshot(self, name):
+		"""
+		Device state of one virtual machine.
+
+		Args:
+			name (str): Virtual machine name
+
+		Returns:
+			tuple: (Monitor, DeviceIndex or None if the monitor could not be
+			reached, error message)
+		"""
+		monitor = self.client.monitor_for(name)
+		if monitor is None:
+			return (None, None, constants.MONITOR_NOT_SET)
+
+		if not self.client.pool.acquire(monitor):
+			return (monitor, None, constants.MONITOR_CANNOT_CONNECT % monitor.last_error)
+		try:
+			return (monitor, monitor.device_index(), None)
+		finally:
+			self.client.pool.release(monitor)
+
+
+	def plan(self, profile, snapshots):
+		"""
+		Differences between a profile and the device state. Devices another
+		machine of the same host should have are always removed, other
+		devices only from machines of the profile and not when they are
+		"add only", like a bulk 'remove' does.
+
+		Args:
+			profile (dict): Virtual machine -> device IDs, see
+				'CompiledConfig.profiles'
+			snapshots (dict): Virtual machine -> DeviceIndex, of every
+				reachable machine
+
+		Returns:
+			tuple: (dict of virtual machine -> device IDs to remove, dict of
+			virtual machine -> device IDs to add, list of (virtual machine,
+			device ID) that are not plugged in)
+		"""
+		compiled = self.client.compiled
+		removable = set(compiled.device_lists["add only"])
+		managed = list(compiled.device_lists["ignore"])
+		for devices in profile.values():
+			managed.extend(id for id in devices if id not in managed)
+
+		removals, additions, missing = {}, {}, []
+		for name, index in snapshots.items():
+			host, wanted = compiled.vm_hosts[name], profile.get(name)
+			elsewhere = set(
+				id for machine, devices in profile.items()
+					if machine != name and compiled.vm_hosts[machine] == host
+						for id in devices
+			)
+
+			remove = [
+				id for id in managed
+					if id not in (wanted or ()) and index.is_connected(id) and
+						(id in elsewhere or (wanted is not None and id in removable))
+			]
+			if remove:
+				removals[name] = remove
+
+			add = []
+			for id in wanted or ():
+				if index.is_connected(id):
+					continue
+				if index.find_id(id):
+					add.append(id)
+				else:
+					missing.append((name, id))
+			if add:
+				additions[name] = add
+
+		return (removals, additions, missing)
+
+
+	def remove(self, name, devices, monitor, snapshot):
+		"""
+		Remove devices from one virtual machine and wait until they are
+		released, so another machine can take them.
+
+		Args:
+			name (str): Virtual machine name
+			devices (list): Device IDs
+			monitor (Monitor): Monitor of the machine
+			snapshot (DeviceIndex): Device state from 'snapshot'
+
+		Returns:
+			tuple: (dict of device ID -> error text or None if the monitor was
+			unavailable, seconds)
+		"""
+		start = monotonic()
+		if not self.client.pool.acquire(monitor):
+			return (None, monotonic() - start)
+		try:
+			results = monitor.remove_usb_results(devices, snapshot, confirm=True)
+		finally:
+			self.client.pool.release(monitor)
+		return (results, monotonic() - start)
+
+
+	def add(self, name, devices, monitor, snapshot):
+		"""
+		Add devices to one virtual machine.
+
+		Args:
+			name (str): Virtual machine name
+			devices (list): Device IDs
+			monitor (Monitor): Monitor of the machine
+			snapshot (DeviceIndex): Device state from 'snapshot'
+
+		Returns:
+			tuple: (dict of device ID -> error text or None if the monitor was
+			unavailable, seconds)
+		"""
+		start = monotonic()
+		if not self.client.pool.acquire(monitor):
+			return (None, monotonic() - start)
+		try:
+			results = monitor.add_usb_results(devices, snapshot)
+		finally:
+			self.client.pool.release(monitor)
+		return (results, monotonic() - start)
+
+
+	def run(self, name):
+		"""
+		Apply a profile and print what changed on every machine, in
+		configuration order.
+
+		Args:
+			name (str): Profile name, key of 'profiles'
+
+		Returns:
+			bool, False if the profile is unknown or not fully applied
+		"""
+		compiled = self.client.compiled
+		profile = compiled.profiles.get(name)
+		if profile is None:
+			print(constants.PROFILE_UNKNOWN % name)
+			return False
+
+		hosts = set(compiled.vm_hosts[machine] for machine in profile)
+		machines = [
+			machine for machine in compiled.vm_names
+				if compiled.vm_hosts[machine] in hosts and machine in compiled.monitors
+		]
+		start = monotonic()
+		success = True
+
+		for machine in profile:
+			if machine not in compiled.monitors:
+				print(constants.PROFILE_MACHINE_ERROR % (machine, constants.MONITOR_NOT_SET))
+				success = False
+
+		with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+			states = dict(zip(machines, executor.map(self.snapshot, machines)))
+
+			snapshots = {}
+			for machine, (monitor, index, error) in states.items():
+				if index is not None:
+					snapshots[machine] = index
+				elif machine in profile:
+					print(constants.PROFILE_MACHINE_ERROR % (machine, error))
+					success = False
+
+			removals, additions, missing = self.plan(profile, snapshots)
+			for machine, id in missing:
+				print(constants.PROFILE_MACHINE_ERROR % (
+					machine, constants.PROFILE_NOT_PLUGGED_IN % id
+				))
+				success = False
+
+			if not removals and not additions:
+				print(constants.PROFILE_UNCHANGED % name)
+				return success
+
+			# Removals first, a device can only be added once it was released
+			removed = self.each(executor, self.remove, removals, states, snapshots)
+			held = set(
+				id for machine, (results, seconds) in removed.items()
+					for id in removals[machine] if results is None or results.get(id)
+			)
+			pending = {
+				machine: [id for id in devices if id not in held]
+					for machine, devices in additions.items()
+			}
+			added = self.each(executor, self.add, pending, states, snapshots)
+
+		changed = {"removed": 0, "added": 0}
+		for machine in machines:
+			if machine not in removals and machine not in additions:
+				continue
+
+			seconds = sum(done[machine][1] for done in (removed, added) if machine in done)
+			print(constants.FANOUT_HEADER % (machine, seconds * 1000))
+
+			if machine in removals:
+				count, ok = self.report(
+					removals[machine], removed[machine][0],
+					constants.CLIENT_REMOVED, constants.CLIENT_CANNOT_REMOVE
+				)
+				changed["removed"] += count
+				success = success and ok
+
+			if machine in additions:
+				results = added[machine][0] if machine in added else {}
+				if results is not None:
+					results.update(
+						(id, constants.PROFILE_STILL_ATTACHED)
+							for id in additions[machine] if id in held
+					)
+				count, ok = self.report(
+					additions[machine], results,
+					constants.CLIENT_ADDED, constants.CLIENT_CANNOT_ADD
+				)
+				changed["added"] += count
+				success = success and ok
+
+		print(constants.PROFILE_APPLIED % (
+			name, changed["added"], changed["removed"],
+			len(set(removals) | set(additions)), (monotonic() - start) * 1000
+		))
+		return success
+
+
+	def report(self, devices, results, success, failure):
+		"""
+		Print the outcome of removals or additions on one machine.
+
+		Args:
+			devices (list): Device IDs
+			results (dict): Device ID -> error text, None if the monitor was
+				unavailable
+			success (str): Message for devices without error
+			failure (str): Message for devices with error
+
+		Returns:
+			tuple: (devices changed, every device succeeded)
+		"""
+		self.client.print_results(devices, results, success, failure)
+		if results is None:
+			return (0, False)
+		return (
+			len([id for id in results if not results[id]]), not any(results.values())
+		)
+
+
+	def each(self, executor, func, changes, states, snapshots):
+		"""
+		Run removals or additions on every machine at once.
+
+		Args:
+			executor (ThreadPoolExecutor): Workers
+			func (function): 'remove' or 'add'
+			changes (dict): Virtual machine -> device IDs
+			states (dict): Virtual machine -> result of 'snapshot'
+			snapshots (dict): Virtual machine -> DeviceIndex
+
+		Returns:
+			dict: virtual machine -> result of 'func'
+		"""
+		futures = {
+			machine: executor.submit(
+				func, machine, devices, states[machine][0], snapshots[machine]
+			) for machine, devices in changes.items() if devices
+		}
+		return {machine: future.result() for machine, future in futures.items()}
@@ -0,0 +1,270 @@
+import os
+import socket
+import logging
+from select import select
+from threading import Thread
+from time import sleep, monotonic
+from . import constants
+from .devices import DeviceIndex
+
+
+NETLINK_KOBJECT_UEVENT = 15  # Not exported by the socket module
+UEVENT_KERNEL_GROUP = 1
+
+
+
+class HotplugWatcher(object):
+	"""
+	Watches the host for USB devices being plugged in and attaches the ones
+	listed under 'usb-devices' to the client's active virtual machine.
+
+	Kernel uevents are read from a netlink socket, which already carries the
+	vendor and product id, so nothing is read from disk per event. Without
+	netlink the sysfs device directory is polled: only its listing is compared
+	and only new entries are read. Devices are attached once they have been
+	present for 'debounce' seconds, so rapid re-enumeration results in a
+	single attach.
+	"""
+
+	def __init__(self, client, root=constants.SYSFS_USB_DEVICES,
+			debounce=constants.HOTPLUG_DEBOUNCE,
+			interval=constants.HOTPLUG_POLL_INTERVAL):
+		"""
+		Initialize HotplugWatcher class.
+
+		Args:
+			client (Client): Client whose active virtual machine receives the
+				devices
+			root (str, optional): sysfs USB device directory
+			debounce (float, optional): Seconds a device has to stay plugged in
+			interval (float, optional): Seconds between polls without netlink
+		"""
+		self.client = client
+		self.root = root
+		self.debounce = debounce
+		self.interval = interval
+		self.pending = {}  # vendor:product id -> attach deadline
+		self.known = {}  # sysfs entry -> vendor:product id, when polling
+		self.sock = None
+		self.thread = None
+		self.running = False
+
+
+	@staticmethod
+	def netlink_socket():
+		"""
+		Socket receiving kernel uevents.
+
+		Returns:
+			socket.socket, None if netlink is unavailable
+		"""
+		try:
+			sock = socket.socket(
+				socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT
+			)
+			sock.bind((0, UEVENT_KERNEL_GROUP))
+		except (AttributeError, OSError):
+			return None
+		return sock
+
+
+	@staticmethod
+	def parse_uevent(data):
+		"""
+		Parse kernel uevent of a USB device.
+
+		Args:
+			data (bytes): Datagram, e.g. b"add@/devices/...\\0ACTION=add\\0..."
+
+		Returns:
+			tuple: (action, vendor:product id), None for other uevents
+		"""
+		env = {}
+		for field in data.split(b"\0")[1:]:
+			key, _, value = field.partition(b"=")
+			env[key] = value
+
+		if env.get(b"SUBSYSTEM") != b"usb" or env.get(b"DEVTYPE") != b"usb_device":
+			return None
+
+		# PRODUCT is "vendor/product/bcdDevice" in unpadded hex
+		product = env.get(b"PRODUCT", b"").split(b"/")
+		try:
+			id = "%04x:%04x" % (int(product[0], 16), int(product[1], 16))
+		except (IndexError, ValueError):
+			return None
+		return (env.get(b"ACTION", b"").decode("utf-8"), id)
+
+
+	def read_id(self, name):
+		"""
+		Vendor:product id of a sysfs device entry.
+
+		Args:
+			name (str): Entry name, e.g. "1-1.2"
+
+		Returns:
+			str, None if the entry is not a device
+		"""
+		try:
+			with open(os.path.join(self.root, name, "idVendor")) as f:
+				vendor_id = f.read().strip()
+			with open(os.path.join(self.root, name, "idProduct")) as f:
+				product_id = f.read().strip()
+		except OSError:
+			return None
+		return "%s:%s" % (vendor_id.lower(), product_id.lower())
+
+
+	def scan(self):
+		"""
+		Compare the sysfs listing with the previous one.
+
+		Returns:
+			list of tuple: (action, vendor:product id)
+		"""
+		try:
+			# Interfaces ("1-1:1.0") are not devices
+			names = set(name for name in os.listdir(self.root) if ":" not in name)
+		except OSError:
+			return []
+
+		events = []
+		for name in names.difference(self.known):
+			id = self.known[name] = self.read_id(name)
+			if id:
+				events.append(("add", id))
+
+		for name in set(self.known).difference(names):
+			id = self.known.pop(name)
+			if id:
+				events.append(("remove", id))
+
+		return events
+
+
+	def handle(self, action, id):
+		"""
+		Schedule or cancel attaching a configured device.
+
+		Args:
+			action (str): uevent action, "add" or "remove"
+			id (str): Vendor:Product ID
+		"""
+		# Host devices changed, kept device states are outdated
+		if action in ("add", "remove"):
+			self.client.pool.invalidate()
+
+		wanted = self.client.device_list("remove only")
+		if id not in set(DeviceIndex.normalize(value) for value in wanted):
+			return
+
+		if action == "add":
+			self.pending[id] = monotonic() + self.debounce
+		elif action == "remove":
+			self.pending.pop(id, None)
+
+
+	def flush(self):
+		"""
+		Attach devices whose debounce period has passed.
+		"""
+		now = monotonic()
+		due = [id for id, deadline in self.pending.items() if deadline <= now]
+		for id in due:
+			del self.pending[id]
+
+		if due and self.client.vm_config:
+			self.attach(due)
+
+
+	def attach(self, ids):
+		"""
+		Attach devices that QEMU sees on the host and that are not attached yet.
+
+		Args:
+			ids (list): Vendor:Product IDs
+		"""
+		def add(monitor):
+			snapshot = monitor.device_index()
+			ids_ = [
+				id for id in ids
+					if snapshot.find_id(id) and not snapshot.is_connected(id)
+			]
+			return (ids_, monitor.add_usb(ids_, snapshot) if ids_ else True)
+
+		result = self.client.monitor_command(add)
+		if not result or not result[0]:
+			return
+
+		if result[1]:
+			print(constants.CLIENT_ADDED % result[0])
+		else:
+			print(constants.CLIENT_CANNOT_ADD % result[0])
+
+
+	def timeout(self):
+		"""
+		Seconds until the next pending device is due, at most 'interval'.
+
+		Returns:
+			float
+		"""
+		if not self.pending:
+			return self.interval
+		return max(0.0, min(self.interval, min(self.pending.values()) - monotonic()))
+
+
+	def watch_forever(self):
+		"""
+		Watch until 'stop' is called or interrupted.
+		"""
+		self.sock = self.netlink_socket()
+		if not self.sock:
+			self.scan()  # Devices present at start are left alone
+		self.running = True
+		print(constants.HOTPLUG_WATCHING % ("netlink" if self.sock else self.root))
+
+		try:
+			while self.running:
+				if self.sock:
+					if select([self.sock], [], [], self.timeout())[0]:
+						event = self.parse_uevent(self.sock.recv(65536))
+						if event:
+							self.handle(*event)
+				else:
+					sleep(self.timeout())
+					for event in self.scan():
+						self.handle(*event)
+
+				try:
+					self.flush()
+				except Exception as exc:
+					logging.exception(exc)
+		except KeyboardInterrupt:
+			pass
+		finally:
+			self.running = False
+			if self.sock:
+				self.sock.close()
+				self.sock = None
+
+
+	def start(self):
+		"""
+		Watch in a background thread.
+		"""
+		self.running = True
+		self.thread = Thread(target=self.watch_forever)
+		self.thread.daemon = True
+		self.thread.start()
+
+
+	def stop(self):
+		"""
+		Stop watching.
+		"""
+		self.running = False
+		if self.thread:
+			self.thread.join()
+			self.thread = None
@@ -1,26 +1,79 @@
 #!/usr/bin/env python3
 import os
 import sys
-from argparse import ArgumentParser
 from . import constants
-from .client import Client
-from .utils import directories, find_file
+from .control import broker_path, forward, socket_path
+
+
+def forward_only(argv):
+	"""
+	Hand '[-n name] -c command ...' to a running daemon before anything else
+	is imported. Hotkeys use this form and only pay for a socket round trip.
+
+	Args:
+		argv (list): Command line arguments
+
+	Returns:
+		bool, True if a daemon ran the commands
+	"""
+	name = None
+	if len(argv) > 2 and argv[0] in ("--name", "--set", "-n", "-s"):
+		name, argv = argv[1], argv[2:]
+
+	if len(argv) < 2 or argv[0] not in ("--command", "-c") or \
+			any(arg.startswith("-") for arg in argv[1:]):
+		return False  # Anything else goes through argparse
+
+	output = forward(socket_path(), name, argv[1:])
+	if output is None:
+		return False
+
+	print(output, end="")
+	return True
 
 
 def main():
 	"""
 	Run QEMU USB Device Manager.
 	"""
+	if forward_only(sys.argv[1:]):
+		return
+
+	# Imported here so that 'forward_only' stays fast, everything only some
+	# modes need is imported by them
+	from argparse import ArgumentParser
+	from .client import Client
+	from .utils import directories, find_file
+
 	directories_ = directories()
 
 	# Arguments
 	parser = ArgumentParser(description="Limited QEMU Monitor Wrapper for USB management")
 	parser.add_argument("--name", "--set", "-n", "-s", help="Name of virtual machine")
 	parser.add_argument("--command", "-c", help="Command", nargs="*")
+	parser.add_argument("--script", help="Run commands from this file, one per line, - for standard input")
 	parser.add_argument("--config", "--conf", help="YAML config file location", nargs="?")
 	parser.add_argument("--log", help="Log file location", nargs="?")
+	parser.add_argument("--daemon", "-d", help="Run resident daemon", action="store_true")
+	parser.add_argument("--socket", help="Daemon control socket location")
+	parser.add_argument("--broker", "-b", help="Share the virtual machine's monitor with other clients", action="store_true")
+	parser.add_argument("--watch", "-w", help="Attach configured USB devices when plugged in", action="store_true")
+	parser.add_argument("--all-vms", help="Run commands on every virtual machine at once", action="store_true")
+	parser.add_argument("--vms", help="Run commands on these virtual machines at once, e.g. a,b,c")
+	parser.add_argument("--jobs", "-j", type=int, default=constants.FANOUT_WORKERS, help="Virtual machines handled at the same time")
+	parser.add_argument("--timings", help="Also write span timings as JSON lines to the --log file", action="store_true")
 	args = parser.parse_args()
 
+	# Hand commands to a running daemon, unless a specific config is requested
+	# or a log of this process, which the daemon would not write
+	fan_out = args.all_vms or args.vms
+	local = args.daemon or args.broker or args.config or args.log or args.timings
+	if args.command and not (local or fan_out):
+		output = forward(args.socket or socket_path(), args.name, args.command)
+		if output is not None:
+			print(output, end="")
+			return
+
 	# Configuration File
 	config_filepath = None
 
@@ -70,15 +123,81 @@ def main():
 		log_filepath = log_env
 
 
+	# Timings of monitor round trips, parsing and commands
+	if args.timings:
+		if args.log:
+			from .stats import stats
+			stats.open(args.log)
+		else:
+			print(constants.CLIENT_TIMINGS_NO_LOG)
+
+
+	# Commands of a script are read before connecting to anything
+	commands = args.command
+	if args.script:
+		from .script import Script
+		commands = Script.read(args.script)
+		if commands is None:
+			sys.exit(1)
+
+
 	# Monitor Wrapper Client
 	client = Client(args.name, config_filepath, args.log)
 
 
-	# Loop over CLI commands when commands specified
-	if args.command:
-		for command in args.command:
-			print(">" + command)
-			client.run_command(command)
+	# Attach configured devices to the active machine as they are plugged in
+	watcher = None
+	if args.watch:
+		if client.is_host_machine():
+			from .hotplug import HotplugWatcher
+			watcher = HotplugWatcher(client)
+		else:
+			print(constants.HOTPLUG_NOT_HOST)
+
+
+	# Hold the monitor connection and let clients take turns on it
+	if args.broker:
+		from .broker import Broker
+		from .pool import MonitorPool
+		address = client.endpoint(client.machine_name, brokered=False)
+		if not address:
+			print(constants.CLIENT_NO_VM_SET)
+			sys.exit(1)
+		broker = Broker(MonitorPool(None), address, broker_path(client.machine_name))
+
+		# Stopping the service removes the socket like Ctrl+C does
+		import signal
+		signal.signal(signal.SIGTERM, signal.default_int_handler)
+		if not broker.serve_forever():
+			sys.exit(1)
+
+	# Keep client resident and serve commands over the control socket
+	elif args.daemon:
+		from .daemon import Daemon
+		if watcher:
+			watcher.start()
+		if not Daemon(client, args.socket or socket_path()).serve_forever():
+			sys.exit(1)
+
+	# Run CLI commands on several machines concurrently
+	elif commands and fan_out:
+		from .fanout import FanOut
+		if args.all_vms:  # Machines without a monitor cannot run commands
+			names = [name for name in client.vm_names if name in client.compiled.monitors]
+		else:
+			names = [name.strip() for name in args.vms.split(",") if name.strip()]
+		if not FanOut(client, args.jobs).run(names, commands):
+			sys.exit(1)
+
+	# Run CLI commands or script, monitor commands in one session
+	elif commands or args.script:
+		from .script import Script
+		if not Script(client).run(commands):
+			sys.exit(1)
+
+	# Only watch
+	elif watcher:
+		watcher.watch_forever()
 
 
 	# Otherwise, run forever
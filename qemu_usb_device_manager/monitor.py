@@ -1,7 +1,68 @@
-from time import sleep
+import re
+import logging
+from select import select
+from time import sleep, monotonic
 from sys import stderr
-from telnetlib import Telnet
+from threading import RLock
 from . import constants
+from .devices import DeviceIndex, UsbDevice
+from .stats import span
+from .utils import backoff
+
+
+
+class ReplyParser(object):
+	"""
+	Incremental parser of a monitor reply. Bytes are fed as they arrive and
+	every device is returned as soon as the lines describing it are
+	complete. The reply is over when the prompt shows up.
+	"""
+
+	def __init__(self, pattern, make, lines=1):
+		"""
+		Initialize ReplyParser class.
+
+		Args:
+			pattern (re.Pattern): Pattern of one device record
+			make (function): Creates a UsbDevice from a match
+			lines (int, optional): Lines per record
+		"""
+		self.pattern = pattern
+		self.make = make
+		self.lines = lines
+		self.window = []  # Last complete lines, a record may start in any
+		self.buffer = b""  # Incomplete line
+		self.done = False
+
+
+	def feed(self, data):
+		"""
+		Parse received bytes.
+
+		Args:
+			data (bytes): Next part of the reply
+
+		Returns:
+			list of UsbDevice, devices completed by this part
+		"""
+		devices = []
+		lines = (self.buffer + data).split(b"\n")
+		self.buffer = lines.pop()
+
+		for line in lines:
+			self.window.append(line.decode("utf-8", "replace"))
+			if len(self.window) < self.lines:
+				continue
+
+			match = self.pattern.match("\n".join(self.window[-self.lines:]))
+			if match:
+				devices.append(self.make(match))
+				self.window = []
+			else:
+				self.window = self.window[len(self.window) - self.lines + 1:]
+
+		self.done = self.buffer.endswith(constants.MONITOR_PROMPT)
+		return devices
 
 
 
@@ -10,60 +71,145 @@ class Monitor(object):
 	Monitor class is a very limited wrapper for the QEMU Monitor.
 	It connects through telnet to control the virtual machine's monitor.
 	"""
-
-	def __init__(self, host):
+	usb_pattern = re.compile(
+		r"^ +Device (\S+), Port (\S+), Speed (\S+) Mb/s"
+		r"(?:, Product (.*?))?(?:, ID: (\S+))?\r?$", re.M
+	)
+	usbhost_pattern = re.compile(
+		r"^ +Bus (\d+), Addr (\d+), Port (\S+), Speed (\S+) Mb/s\r?\n"
+		r" +Class ([0-9a-f]+): USB device ([0-9a-f]{4}):([0-9a-f]{4})"
+		r"(?:, (.*?))?\r?$", re.M
+	)
+
+	def __init__(self, host, timeout=constants.MONITOR_TIMEOUT):
 		"""
 		Initialize Monitor class.
 		
 		Args:
 			host (str): IP address and Port of Telnet monitor
+			timeout (float, optional): Deadline for each command's reply
+		"""
+		self.host = self.parse_address(host)
+		self.timeout = timeout
+		self.is_connected = False
+		self.last_used = monotonic()
+		self.lock = RLock()
+		self.inventory = None  # Local host device source, see 'SysfsInventory'
+		self.last_error = None  # Why the last 'connect' failed
+		self.cached = None  # (monotonic time, DeviceIndex), see 'device_index'
+
+
+	@staticmethod
+	def parse_address(host):
+		"""
+		Split monitor address into IP address and port.
+
+		Args:
+			host (str): IP address and Port of Telnet monitor
+
+		Returns:
+			tuple: (IP address, port)
 		"""
 		host = host.split(":")
 		port = int(host[1]) if host[1].isnumeric() else 23
+		return (host[0], port)
 
-		self.host = (host[0], port)
-		self.is_connected = False
 
-
-	def connect(self, retry=True, retry_wait=0.25, max_retries=5, _retries=0):
+	def connect(self, retry=True, retry_wait=constants.MONITOR_BACKOFF_INITIAL,
+			max_retries=None, deadline=constants.MONITOR_CONNECT_DEADLINE):
 		"""
-		Connect to Telnet monitor.
-		
+		Connect to Telnet monitor. The reason of a failure is kept in
+		'last_error'.
+
+		QEMU serves one client at a time and queues the others, so while the
+		monitor is busy the greeting is awaited until 'deadline'. A monitor
+		that hangs up is retried with exponential backoff and jitter. A
+		refused connection means nothing is listening and fails at once.
+
 		Args:
-			retry (bool, optional): Attempt retry if connection is not successful
-			retry_wait (float, optional): Amount of time to wait for retrying
-			max_retries (int, optional): Maximum amount of retries
+			retry (bool, optional): Retry when the monitor hangs up
+			retry_wait (float, optional): First backoff step in seconds
+			max_retries (int, optional): Maximum amount of retries, None
+				retries until the deadline
+			deadline (float, optional): Seconds until giving up
 		"""
 		if self.is_connected:
-			return
-
-		try:
-			self.telnet = Telnet(*self.host)
+			return True
+
+		# Removed in Python 3.13, only the telnet monitor needs it
+		from telnetlib import Telnet
+
+		end = monotonic() + deadline
+		delays = backoff(retry_wait, constants.MONITOR_BACKOFF_MAX)
+		retries = 0
+
+		while True:
+			try:
+				with span("monitor.connect"):
+					self.telnet = Telnet(*self.host, timeout=max(end - monotonic(), 0.001))
+					greeting = self.telnet.read_until(
+						constants.MONITOR_PROMPT, max(end - monotonic(), 0)
+					)
+
+				if b"QEMU" in greeting:
+					self.telnet.sock.settimeout(None)  # Reads have own deadlines
+					self.is_connected = True
+					self.last_error = None
+					return True
+
+				# Still queued behind another client when the deadline passed
+				self.telnet.close()
+				self.last_error = constants.MONITOR_IN_USE
+				return False
+			except ConnectionRefusedError:
+				self.last_error = constants.MONITOR_REFUSED
+				return False
+			except EOFError:
+				self.telnet.close()
+				self.last_error = constants.MONITOR_NO_GREETING
+			except OSError as exc:
+				self.last_error = str(exc) or type(exc).__name__
+				return False
 
-			if not "QEMU" in self.__read(True):
-				if not retry or _retries >= max_retries:
-					raise ConnectionAbortedError(constants.MONITOR_IN_USE)
-		
-				sleep(retry_wait)
-				return self.connect(retry, max_retries, _retries + 1)
-			else:
-				self.is_connected = True
-		except:
-			self.is_connected = False
+			wait = next(delays)
+			if not retry or (max_retries is not None and retries >= max_retries) \
+					or monotonic() + wait >= end:
+				return False
 
-		return self.is_connected
+			with span("monitor.connect_retry_wait"):
+				sleep(wait)
+			retries += 1
 
 
 	def disconnect(self):
 		"""
 		Close Telnet monitor socket.
 		"""
-		self.telnet.close()
+		if hasattr(self, "telnet"):
+			self.telnet.close()
 		self.is_connected = False
-		sleep(0.1)
 		return not self.is_connected
 
 
+	def check_connection(self):
+		"""
+		Verify that an open connection is still usable. Stray output left in
+		the buffer is discarded.
+
+		Returns:
+			bool, connection is usable or not
+		"""
+		if not self.is_connected:
+			return False
+
+		try:
+			self.telnet.read_very_eager()
+		except (EOFError, OSError):
+			self.disconnect()
+
+		return self.is_connected
+
+
 	def __write(self, value):
 		"""
 		Write string to monitor.
@@ -80,76 +226,369 @@ class Monitor(object):
 			self.is_connected = False
 
 
-	def __read(self, _force_read=False):
+	def __read(self, timeout=None):
 		"""
-		Read from monitor.
+		Read from monitor until the prompt comes back.
+
+		Args:
+			timeout (float, optional): Deadline in seconds, defaults to the
+				monitor's timeout
+
+		Returns:
+			str, everything received up to and including the prompt, the
+			connection is closed when the prompt did not come back
 		"""
-		if not self.is_connected and not _force_read:
+		if not self.is_connected:
 			return ""
 
-		sleep(0.05)  # Data has a delay
+		timeout = self.timeout if timeout is None else timeout
 		try:
-			return str(self.telnet.read_very_eager().decode("utf-8"))
-		except BrokenPipeError:
+			data = self.telnet.read_until(constants.MONITOR_PROMPT, timeout)
+		except (EOFError, OSError):
 			self.is_connected = False
+			return ""
+
+		# Deadline passed before the prompt, the rest of the reply would be
+		# taken for the next command's
+		if not data.endswith(constants.MONITOR_PROMPT):
+			logging.warning(constants.MONITOR_READ_TIMEOUT % timeout)
+			self.disconnect()
 
+		return data.decode("utf-8", "replace")
 
-	def add_usb(self, device):
+
+	def command(self, value, timeout=None):
+		"""
+		Write command to monitor and read its reply.
+
+		Args:
+			value (str): Command to run
+			timeout (float, optional): Deadline in seconds for the reply
+
+		Returns:
+			str, reply of the monitor
+		"""
+		name = value if value.startswith("info ") else value.split(" ", 1)[0]
+		with span("monitor." + name):
+			self.__write(value)
+			return self.__read(timeout=timeout)
+
+
+	def commands(self, values, timeout=None):
+		"""
+		Write several commands at once and read their replies, which costs a
+		single round trip. A reply that misses the deadline leaves the stream
+		unframed, so the connection is closed and the remaining replies are
+		empty.
+
+		Args:
+			values (list): Commands to run
+			timeout (float, optional): Deadline in seconds for each reply
+
+		Returns:
+			list of str, reply for each command
+		"""
+		prompt = constants.MONITOR_PROMPT.decode("utf-8")
+		replies = []
+
+		with span("monitor.batch"):
+			self.__write("\n".join(values))
+			for value in values:
+				reply = self.__read(timeout=timeout)
+				replies.append(reply)
+				if not reply.endswith(prompt):
+					self.disconnect()
+					break
+
+		return replies + ["" for value in values[len(replies):]]
+
+
+	@staticmethod
+	def reply_error(reply):
+		"""
+		Error text of a command that prints nothing when it succeeds, such as
+		'device_add' and 'device_del'.
+
+		Args:
+			reply (str): Reply from 'command' or 'commands', starting with the
+				echoed command line and ending with the prompt
+
+		Returns:
+			str, empty when the command succeeded
+		"""
+		prompt = constants.MONITOR_PROMPT.decode("utf-8")
+		if not reply.endswith(prompt):
+			return constants.MONITOR_NO_REPLY
+
+		# Skip the echoed command line
+		return reply[:-len(prompt)].partition("\n")[2].strip()
+
+
+	def add_usb(self, device, snapshot=None):
 		"""
 		Add USB device by vendor:product id.
 		Verify that device is not already added.
-		
+
 		Args:
 			device (Union[str, list]): Device ID
+			snapshot (DeviceIndex, optional): Device state from
+				'device_index', queried when not given
+
+		Returns:
+			bool, every device was added
+		"""
+		return not any(self.add_usb_results(device, snapshot).values())
+
+
+	def add_usb_results(self, device, snapshot=None):
 		"""
-		result = True
+		Add USB devices by vendor:product id. Device state is queried once and
+		every 'device_add' is sent in a single write.
 
-		# Single device
-		if type(device) is str:
-			if not self.id_is_connected(device):
-				args = "usb-host,vendorid=0x%s,productid=0x%s,id=%s" % (
-					self.device_ids(device)
-				)
-				self.__write("device_add " + args)
+		Args:
+			device (Union[str, list]): Device ID
+			snapshot (DeviceIndex, optional): Device state from
+				'device_index', queried when not given, updated on success
+
+		Returns:
+			dict: device id -> error text, empty when the device was added
+		"""
+		devices = [device] if type(device) is str else list(device)
+		if snapshot is None:
+			snapshot = self.device_index()
+		results, pending = {}, []
+
+		for device in devices:
+			if device in results:
+				continue
+			if self.id_is_connected(device, snapshot):
+				results[device] = constants.MONITOR_ALREADY_ADDED
 			else:
-				return False
+				results[device] = ""
+				pending.append((device, self.device_ids(device)))
+
+		errors = self.device_add_batch([ids for device, ids in pending])
+		for (device, ids), error in zip(pending, errors):
+			results[device] = error
 
-		# Multiple devices
-		elif type(device) is list:
-			devices = device
-			for device in devices:
-				if not self.add_usb(device):
-					result = False
+			# Snapshot no longer matches the monitor, record the change
+			if not error:
+				snapshot.attach(UsbDevice(device="", userid=ids[2]))
 
-		return (not "could not" in self.__read()) if result else result
+		return results
 
 
-	def remove_usb(self, device):
+	def remove_usb(self, device, snapshot=None, confirm=False,
+			timeout=constants.MONITOR_RELEASE_TIMEOUT):
 		"""
 		Remove USB device by vendor id.
-		
+
+		Args:
+			device (Union[str, list]): Device ID
+			snapshot (DeviceIndex, optional): Device state from
+				'device_index', queried when not given
+			confirm (bool, optional): Wait until the guest released them
+			timeout (float, optional): Deadline in seconds for 'confirm'
+
+		Returns:
+			bool, every removal was accepted, or confirmed with 'confirm'
+		"""
+		return not any(self.remove_usb_results(
+			device, snapshot, confirm, timeout
+		).values())
+
+
+	def remove_usb_results(self, device, snapshot=None, confirm=False,
+			timeout=constants.MONITOR_RELEASE_TIMEOUT):
+		"""
+		Remove USB devices by vendor:product id, preferring the user-supplied
+		ID. Device state is queried once and every 'device_del' is sent in a
+		single write. Devices that are not attached are skipped.
+
+		'device_del' only asks the guest to let go of a device. With 'confirm'
+		this returns once every accepted device is really gone, so it can be
+		added to another virtual machine right away.
+
 		Args:
 			device (Union[str, list]): Device ID
+			snapshot (DeviceIndex, optional): Device state from
+				'device_index', queried when not given, updated on success
+			confirm (bool, optional): Wait until the guest released them
+			timeout (float, optional): Deadline in seconds for 'confirm'
+
+		Returns:
+			dict: device id -> error text, empty when removal was requested,
+			or completed with 'confirm', without the skipped devices
 		"""
+		devices = [device] if type(device) is str else list(device)
+		if snapshot is None:
+			snapshot = self.device_index()
+		userids = {}
+
+		for device in devices:
+			if device in userids or not self.id_is_connected(device, snapshot):
+				continue
 
-		# Single device
-		if type(device) is str:
 			# Prefer removing by user-supplied ID
-			args = self.device_to_userid(device)
-			if args is None:
-				args = self.device_ids(device)[2]
-			self.__write("device_del " + args)
+			userid = self.device_to_userid(device, snapshot)
+			userids[device] = userid or self.device_ids(device)[2]
+
+		errors = self.device_del_batch(list(userids.values()))
+		results = {}
+		for (device, userid), error in zip(userids.items(), errors):
+			results[device] = error
+
+			# Snapshot no longer matches the monitor, record the change
+			if not error:
+				snapshot.detach(userid)
+
+		if confirm:
+			accepted = [device for device, error in results.items() if not error]
+			released = self.wait_removed_batch(
+				[userids[device] for device in accepted], timeout
+			)
+			for device, done in zip(accepted, released):
+				if not done:
+					results[device] = constants.MONITOR_NOT_RELEASED % timeout
+
+		return results
+
+
+	@staticmethod
+	def device_add_command(vendor_id, product_id, userid):
+		"""
+		HMP command attaching a host USB device.
+
+		Args:
+			vendor_id (str): Vendor ID in hex
+			product_id (str): Product ID in hex
+			userid (str): ID given to the device inside QEMU
+
+		Returns:
+			str
+		"""
+		return "device_add usb-host,vendorid=0x%s,productid=0x%s,id=%s" % (
+			vendor_id, product_id, userid
+		)
+
+
+	def device_add(self, vendor_id, product_id, userid):
+		"""
+		Attach host USB device to the virtual machine.
+
+		Args:
+			vendor_id (str): Vendor ID in hex
+			product_id (str): Product ID in hex
+			userid (str): ID given to the device inside QEMU
+
+		Returns:
+			bool, added or not
+		"""
+		return not self.device_add_batch([(vendor_id, product_id, userid)])[0]
 
-		# Multiple devices
-		elif type(device) is list:
-			devices = device
-			for device in devices:
-				self.remove_usb(device)
 
-		return not "could not" in self.__read()
+	def device_add_batch(self, devices):
+		"""
+		Attach several host USB devices with a single write.
+
+		Args:
+			devices (list of tuple): (vendor id, product id, user ID), as
+				returned by 'device_ids'
+
+		Returns:
+			list of str, error text for each device, empty when it was added
+		"""
+		if not devices:
+			return []
+		self.invalidate()
+		return [self.reply_error(reply) for reply in self.commands(
+			[self.device_add_command(*device) for device in devices]
+		)]
+
+
+	def device_del(self, userid):
+		"""
+		Detach USB device from the virtual machine.
+
+		Args:
+			userid (str): ID of the device inside QEMU
+
+		Returns:
+			bool, removal requested or not
+		"""
+		return not self.device_del_batch([userid])[0]
+
+
+	def device_del_batch(self, userids):
+		"""
+		Detach several USB devices with a single write.
+
+		Args:
+			userids (list): IDs of the devices inside QEMU
+
+		Returns:
+			list of str, error text for each device, empty when removal was
+			requested
+		"""
+		if not userids:
+			return []
+		self.invalidate()
+		return [self.reply_error(reply) for reply in self.commands(
+			["device_del " + userid for userid in userids]
+		)]
 
 
-	def device_ids(self, value):
+	def wait_removed(self, userid, timeout=constants.MONITOR_RELEASE_TIMEOUT):
+		"""
+		Wait until the virtual machine released a device after 'device_del'.
+
+		Args:
+			userid (str): ID of the device inside QEMU
+			timeout (float, optional): Deadline in seconds
+
+		Returns:
+			bool, released or not
+		"""
+		return self.wait_removed_batch([userid], timeout)[0]
+
+
+	def wait_removed_batch(self, userids,
+			timeout=constants.MONITOR_RELEASE_TIMEOUT):
+		"""
+		Wait until the virtual machine released devices after 'device_del'.
+		Polls 'info usb' once for all of them, with a short interval that
+		doubles on every attempt.
+
+		Args:
+			userids (list): IDs of the devices inside QEMU
+			timeout (float, optional): Deadline in seconds
+
+		Returns:
+			list of bool, released or not for each device
+		"""
+		deadline = monotonic() + timeout
+		interval = constants.MONITOR_POLL_INTERVAL
+		pending = set(userids)
+
+		with span("monitor.wait_removed"):
+			while pending:
+				devices = self.usb_devices()
+				if not self.is_connected:
+					break
+
+				pending.intersection_update(d.userid for d in devices)
+				remaining = deadline - monotonic()
+				if not pending or remaining <= 0:
+					break
+
+				sleep(min(interval, remaining))
+				interval = min(interval * 2, constants.MONITOR_POLL_MAX_INTERVAL)
+
+		return [userid not in pending for userid in userids]
+
+
+	@staticmethod
+	def device_ids(value):
 		"""
 		Split vendor id and product id.
 
@@ -164,141 +603,305 @@ class Monitor(object):
 		return (vendor_id, product_id, cosmetic_id)
 
 
-	def device_to_userid(self, value):
+	def device_to_userid(self, value, index=None):
 		"""
 		Find user-supplied ID (if any) from vendor and product id
 		
 		Args:
 			value (str): Vendor:Product ID
+			index (DeviceIndex, optional): Device state from 'device_index',
+				queried when not given
 		Returns:
 			User ID if found, otherwise it returns None
 		"""
-		data = self.usb_devices_more()
-
-		if value.startswith("host:"):
-			value = value[5:]
-
-		return next((d.get("userid", None) for d in data if d["id"] == value), None)
+		if index is None:
+			index = self.device_index()
+		return index.userid(value)
 
 
-	def id_is_connected(self, value):
+	def id_is_connected(self, value, index=None):
 		"""
 		Test if device is connected by vendor and product id.
 		
 		Args:
 			value (str): Vendor:Product ID
+			index (DeviceIndex, optional): Device state from 'device_index',
+				queried when not given
 
 		Returns:
 			bool, connected or not
 		"""
-		data = self.usb_devices_more()
+		if index is None:
+			index = self.device_index()
+		return index.is_connected(value)
+
+
+	def stream(self, value, parser, timeout=None):
+		"""
+		Write command and parse its reply while it arrives, stopping at the
+		prompt.
+
+		Args:
+			value (str): Command to run
+			parser (ReplyParser): Parser of the reply
+			timeout (float, optional): Deadline in seconds for the reply
+
+		Yields:
+			UsbDevice, as soon as its lines arrived
+		"""
+		timeout = self.timeout if timeout is None else timeout
+		deadline = monotonic() + timeout
+
+		with span("monitor." + value):
+			self.__write(value)
+			try:
+				while self.is_connected and not parser.done:
+					devices = self.__feed(parser, deadline, timeout)
+					if devices is None:
+						break
+					yield from devices
+			finally:
+				# Iteration stopped early, the rest of the reply must not be
+				# taken for the next command's
+				while self.is_connected and not parser.done:
+					if self.__feed(parser, deadline, timeout) is None:
+						break
+
+
+	def __feed(self, parser, deadline, timeout):
+		"""
+		Give the parser what arrived, waiting for more when nothing did.
+
+		Args:
+			parser (ReplyParser): Parser of the reply
+			deadline (float): 'monotonic' time to give up at
+			timeout (float): Deadline in seconds, for the warning
+
+		Returns:
+			list of UsbDevice, None when the deadline passed, which closes
+			the connection
+		"""
+		try:
+			data = self.telnet.read_very_eager()
+		except (EOFError, OSError):
+			self.is_connected = False
+			return []
+
+		if data:
+			return parser.feed(data)
 
-		if value.startswith("host:"):
-			value = value[5:]
+		# Rest of the reply would be taken for the next command's
+		remaining = deadline - monotonic()
+		if remaining <= 0:
+			logging.warning(constants.MONITOR_READ_TIMEOUT % timeout)
+			self.disconnect()
+			return None
 
-		return any(d["id"] == value for d in data)
+		select([self.telnet], [], [], remaining)
+		return []
 
 
 	def usb_devices(self):
 		"""
 		List USB devices from monitor.
 		"""
+		return list(self.iter_usb_devices())
+
+
+	def iter_usb_devices(self):
+		"""
+		USB devices of the virtual machine, parsed while 'info usb' arrives.
+
+		Yields:
+			UsbDevice
+		"""
 		if not self.is_connected:
-			return []
+			return
 
-		self.__write("info usb")
-		data = self.__read()
-		result = []
+		yield from self.stream(
+			"info usb", ReplyParser(self.usb_pattern, self.usb_device)
+		)
 
-		if not data:
-			return result
 
-		for line in data.splitlines():
-			if line[0] != " ":
-				continue
+	@staticmethod
+	def parse_speed(value):
+		"""
+		Speed of a device as printed by QEMU, which is "?" when unknown and
+		"5000+" for SuperSpeed Plus.
 
-			# Split line to harvest info
-			line = line.strip().replace(", ", ",").split(",")
-			device = {}
+		Args:
+			value (str): Speed in Mb/s
 
-			# Add info about device to dict
-			for element in line:
-				key = element.lower().split(" ")[0]
+		Returns:
+			float, None when unknown
+		"""
+		try:
+			return float(value.rstrip("+"))
+		except ValueError:
+			return None
 
-				# ID: means the device has user-supplied ID on the host
-				if key == "id:":
-					device["userid"] = element[4:]
-				else:
-					device[key] = element[len(key)+1:]
 
-			# Add device to the result
-			result.append(device)
+	@staticmethod
+	def usb_device(match):
+		"""
+		Device of an 'info usb' line.
+
+		Args:
+			match (re.Match): Match of 'usb_pattern'
 
-		return result
+		Returns:
+			UsbDevice
+		"""
+		return UsbDevice(
+			device=match.group(1), port=match.group(2),
+			speed=Monitor.parse_speed(match.group(3)), product=match.group(4),
+			userid=match.group(5)  # Device has user-supplied ID
+		)
+
+
+	@staticmethod
+	def parse_usb(data):
+		"""
+		Parse output of 'info usb'.
+
+		Args:
+			data (str): Monitor reply
+
+		Returns:
+			list of UsbDevice
+		"""
+		with span("parse.usb"):
+			return [
+				Monitor.usb_device(match)
+					for match in Monitor.usb_pattern.finditer(data or "")
+			]
 
 
 	def usb_devices_more(self):
 		"""
 		Show all USB device information from connected devices.
 		"""
-		return [
-			device for device in self.host_usb_devices_more()
-				if "device" in device
-		]
+		return self.device_index().connected()
 
 
 	def host_usb_devices(self):
 		"""
-		List USB devices connected to host.
+		List USB devices connected to host. Read locally instead of asking
+		the monitor when an inventory is set.
+		"""
+		if self.inventory:
+			return self.inventory.devices()
+
+		return list(self.iter_host_usb_devices())
+
+
+	def iter_host_usb_devices(self):
+		"""
+		USB devices of the host, parsed while 'info usbhost' arrives, so the
+		first ones are available before hosts with many devices finished
+		replying.
+
+		Yields:
+			UsbDevice
 		"""
 		if not self.is_connected:
-			return []
+			return
 
-		self.__write("info usbhost")
-		data = self.__read()
-		result = []
+		yield from self.stream("info usbhost", ReplyParser(
+			self.usbhost_pattern, self.usbhost_device, lines=2
+		))
 
-		if not data:
-			return result
 
-		for line in data.splitlines():
-			if line[0] != " ":
-				continue
+	@staticmethod
+	def usbhost_device(match):
+		"""
+		Device of an 'info usbhost' line pair.
 
-			line = line.strip().replace(", ", ",").split(",")
+		Args:
+			match (re.Match): Match of 'usbhost_pattern'
 
-			# First line of device info starts with "Bus"
-			if line[0][0] == "B":
-				# Split line to harvest info
-				device = {}
+		Returns:
+			UsbDevice
+		"""
+		return UsbDevice(
+			bus=int(match.group(1)), addr=int(match.group(2)),
+			port=match.group(3), speed=Monitor.parse_speed(match.group(4)),
+			device_class=int(match.group(5), 16),
+			vendor_id=int(match.group(6), 16),
+			product_id=int(match.group(7), 16), product=match.group(8)
+		)
 
-				# Add info about device to dict
-				for element in line:
-					key = element.lower().split(" ")[0]
-					device[key] = element[len(key)+1:]
 
-				# Add device to the result
-				result.append(device)
+	@staticmethod
+	def parse_usbhost(data):
+		"""
+		Parse output of 'info usbhost'. Every device spans two lines, the
+		first starts with "Bus" and the second with "Class".
 
-			# Second line of device info starts with "Class"
-			elif line[0][0] == "C":
-				result[-1]["product"] = line[1]
-				result[-1]["id"] = line[0][-9:]
+		Args:
+			data (str): Monitor reply
 
-		return result
+		Returns:
+			list of UsbDevice
+		"""
+		with span("parse.usbhost"):
+			return [
+				Monitor.usbhost_device(match)
+					for match in Monitor.usbhost_pattern.finditer(data or "")
+			]
 
 
 	def host_usb_devices_more(self):
 		"""
 		Show all USB device along with their details.
 		"""
+		return self.device_index().devices
+
+
+	def device_index(self, max_age=0):
+		"""
+		Query host and virtual machine devices and join them. The result is
+		kept for callers that accept a slightly older state.
+
+		Args:
+			max_age (float, optional): Reuse the kept result when it is at
+				most this many seconds old, 0 always queries
+
+		Returns:
+			DeviceIndex
+		"""
+		index = self.cached_index(max_age)
+		if index is not None:
+			return index
+
 		host_devices, vm_devices = self.host_usb_devices(), self.usb_devices()
+		with span("index.build"):
+			index = DeviceIndex(host_devices, vm_devices)
 
-		# Loop through both: host_device and vm_devices; compare product names
-		# and combine dictionaries
-		for host_device in host_devices:
-			for vm_device in vm_devices:
-				if vm_device.get("product", 0) == host_device.get("product", 1):
-					host_device.update(vm_device)
+		# Replies of a dropped connection are incomplete
+		if self.is_connected:
+			self.cached = (monotonic(), index)
+		return index
+
+
+	def cached_index(self, max_age):
+		"""
+		Last result of 'device_index', without asking the monitor.
 
-		return host_devices
\ No newline at end of file
+		Args:
+			max_age (float): Seconds the result may be old
+
+		Returns:
+			DeviceIndex, None if there is none or it is too old
+		"""
+		cached = self.cached
+		if max_age and cached and monotonic() - cached[0] <= max_age:
+			return cached[1]
+		return None
+
+
+	def invalidate(self):
+		"""
+		Forget the kept device state, after devices were added or removed.
+		"""
+		self.cached = None
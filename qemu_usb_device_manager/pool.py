@@ -0,0 +1,181 @@
+from threading import Condition, RLock, Thread, current_thread
+from time import monotonic
+from . import constants
+from .monitor import Monitor
+from .qmp import QMPMonitor
+from .stats import span
+
+
+
+class MonitorPool(object):
+	"""
+	Keeps one long-lived connection per monitor so consecutive commands do not
+	pay for a new Telnet session. Connections that have not been used for
+	'idle_timeout' seconds are closed by a single background thread to free
+	QEMU's single-client monitor.
+	"""
+
+	def __init__(self, idle_timeout=constants.POOL_IDLE_TIMEOUT):
+		"""
+		Initialize MonitorPool class.
+
+		Args:
+			idle_timeout (float, optional): Seconds before an unused connection
+				is closed, 0 or None keeps connections open
+		"""
+		self.idle_timeout = idle_timeout
+		self.monitors = {}
+		self.lock = RLock()
+		self.wakeup = Condition(self.lock)
+		self.reaper = None  # Thread running 'reap', started on first release
+		self.inventory = None  # Given to every monitor, see 'SysfsInventory'
+		self.index_ttl = constants.POOL_INDEX_TTL  # See 'Client.device_index'
+
+
+	def get(self, host, local=True):
+		"""
+		Get monitor for host, created on first use.
+
+		Args:
+			host (str): IP address and Port of Telnet monitor, QMP addresses
+				are prefixed with "qmp:" and broker sockets with "broker:"
+			local (bool, optional): Monitor belongs to a virtual machine of
+				this computer, which may use the pool's inventory
+
+		Returns:
+			Monitor
+		"""
+		with self.lock:
+			monitor = self.monitors.get(host)
+			if not monitor:
+				if host.startswith(constants.QMP_PREFIX):
+					monitor = QMPMonitor(host)
+				elif host.startswith(constants.BROKER_PREFIX):
+					from .broker import BrokerMonitor  # Server parts not needed
+					monitor = BrokerMonitor(host)
+				else:
+					monitor = Monitor(host)
+				self.monitors[host] = monitor
+			monitor.inventory = self.inventory if local else None
+			return monitor
+
+
+	def acquire(self, monitor):
+		"""
+		Lock monitor for use and make sure it is connected. Stale connections
+		are dropped and opened again.
+
+		Args:
+			monitor (Monitor): Monitor from 'get'
+
+		Returns:
+			bool, True when the monitor is connected and locked
+		"""
+		with span("pool.acquire"):
+			monitor.lock.acquire()
+			if monitor.is_connected and not monitor.check_connection():
+				monitor.disconnect()
+
+			if monitor.is_connected:
+				return True
+
+			# Devices may have changed while disconnected
+			if monitor.connect():
+				monitor.invalidate()
+				return True
+
+		monitor.lock.release()
+		return False
+
+
+	def release(self, monitor):
+		"""
+		Unlock monitor after use and schedule the idle check.
+
+		Args:
+			monitor (Monitor): Monitor from 'acquire'
+		"""
+		monitor.last_used = monotonic()
+		monitor.lock.release()
+		self.schedule()
+
+
+	def schedule(self):
+		"""
+		Wake the thread that closes idle connections, starting it on first
+		use.
+		"""
+		if not self.idle_timeout:
+			return
+
+		with self.lock:
+			if self.reaper is None:
+				self.reaper = Thread(target=self.reap)
+				self.reaper.daemon = True
+				self.reaper.start()
+			else:
+				self.wakeup.notify()
+
+
+	def reap(self):
+		"""
+		Close idle connections until the pool is closed, sleeping until the
+		next connection idles out or a monitor is released.
+		"""
+		with self.lock:
+			while self.reaper is current_thread():
+				self.wakeup.wait(self.close_idle())
+
+
+	def close_idle(self):
+		"""
+		Close connections that have been idle for longer than 'idle_timeout'.
+
+		Returns:
+			float, seconds until the next check, None when nothing is open
+		"""
+		now, next_check = monotonic(), None
+		if not self.idle_timeout:
+			return None  # Turned off by a reloaded configuration
+
+		with self.lock:
+			for monitor in self.monitors.values():
+				if not monitor.is_connected:
+					continue
+
+				# Monitor is in use, look again later
+				if not monitor.lock.acquire(False):
+					next_check = self.idle_timeout
+					continue
+
+				remaining = monitor.last_used + self.idle_timeout - now
+				if remaining <= 0:
+					monitor.disconnect()
+				elif next_check is None or remaining < next_check:
+					next_check = remaining
+				monitor.lock.release()
+
+		return next_check
+
+
+	def invalidate(self):
+		"""
+		Forget the device state kept by every monitor, e.g. when a device was
+		plugged into or unplugged from the host.
+		"""
+		with self.lock:
+			for monitor in self.monitors.values():
+				monitor.invalidate()
+
+
+	def close(self):
+		"""
+		Close every connection in the pool.
+		"""
+		with self.lock:
+			self.reaper = None
+			self.wakeup.notify()
+			for monitor in self.monitors.values():
+				with monitor.lock:
+					if monitor.is_connected:
+						monitor.disconnect()
@@ -0,0 +1,485 @@
+import json
+import socket
+import logging
+from time import monotonic
+from . import constants
+from .monitor import Monitor
+from .stats import span
+
+
+
+class QMPMonitor(Monitor):
+	"""
+	Monitor that speaks QEMU's JSON protocol (QMP) over a TCP or UNIX socket.
+	Replies are matched to their commands instead of read with a deadline, and
+	asynchronous events such as DEVICE_DELETED are kept for 'wait_event'.
+
+	Human monitor commands are passed through 'human-monitor-command', so
+	every method of Monitor keeps working.
+	"""
+
+	def __init__(self, host, timeout=constants.MONITOR_TIMEOUT):
+		"""
+		Initialize QMPMonitor class.
+
+		Args:
+			host (str): "IP:Port" or "unix:/path/to/socket", optionally
+				prefixed with "qmp:"
+			timeout (float, optional): Deadline for each command's reply
+		"""
+		Monitor.__init__(self, host, timeout)
+		self.sock = None
+		self.buffer = b""
+		self.events = []
+		self.query_usb = True  # Unset when QEMU lacks 'x-query-usb'
+
+
+	@staticmethod
+	def parse_address(host):
+		"""
+		Parse QMP address.
+
+		Args:
+			host (str): "IP:Port" or "unix:/path/to/socket", optionally
+				prefixed with "qmp:"
+
+		Returns:
+			str for UNIX socket path, tuple (IP address, port) otherwise
+		"""
+		if host.startswith(constants.QMP_PREFIX):
+			host = host[len(constants.QMP_PREFIX):]
+
+		if host.startswith(constants.QMP_UNIX_PREFIX):
+			return host[len(constants.QMP_UNIX_PREFIX):]
+
+		return Monitor.parse_address(host)
+
+
+	def connect(self, retry=True, retry_wait=constants.MONITOR_BACKOFF_INITIAL,
+			max_retries=None, deadline=constants.MONITOR_CONNECT_DEADLINE):
+		"""
+		Connect to QMP socket and negotiate capabilities. Like Monitor, a busy
+		monitor is waited for until 'deadline' and a refused connection fails
+		at once. The reason of a failure is kept in 'last_error'.
+
+		Args:
+			retry (bool, optional): Unused, kept for Monitor compatibility
+			retry_wait (float, optional): Unused
+			max_retries (int, optional): Unused
+			deadline (float, optional): Seconds until giving up
+		"""
+		if self.is_connected:
+			return True
+
+		end = monotonic() + deadline
+		try:
+			with span("qmp.connect"):
+				if type(self.host) is str:
+					self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+					self.sock.settimeout(deadline)
+					self.sock.connect(self.host)
+				else:
+					self.sock = socket.create_connection(self.host, deadline)
+
+				self.buffer, self.events = b"", []
+				self.is_connected = True
+
+				# Greeting, then leave capabilities negotiation mode
+				greeting = self.__receive(max(end - monotonic(), 0))
+				if not (greeting and "QMP" in greeting):
+					raise ConnectionAbortedError(
+						constants.MONITOR_IN_USE if self.is_connected
+							else constants.MONITOR_NO_GREETING
+					)
+
+				if "return" not in self.execute("qmp_capabilities"):
+					raise ConnectionAbortedError(constants.QMP_NEGOTIATION_FAILED)
+		except (ConnectionRefusedError, FileNotFoundError):
+			self.last_error = constants.MONITOR_REFUSED
+			self.disconnect()
+		except Exception as exc:
+			logging.debug(exc)
+			self.last_error = str(exc) or type(exc).__name__
+			self.disconnect()
+		else:
+			self.last_error = None
+
+		return self.is_connected
+
+
+	def disconnect(self):
+		"""
+		Close QMP socket.
+		"""
+		if self.sock:
+			self.sock.close()
+			self.sock = None
+		self.is_connected = False
+		return not self.is_connected
+
+
+	def check_connection(self):
+		"""
+		Verify that an open connection is still usable. Pending events are
+		collected.
+
+		Returns:
+			bool, connection is usable or not
+		"""
+		while self.is_connected:
+			message = self.__receive(0)
+			if message is None:
+				break
+			if "event" in message:
+				self.keep_event(message)
+		return self.is_connected
+
+
+	def __receive(self, timeout):
+		"""
+		Read one message from the socket.
+
+		Args:
+			timeout (float): Deadline in seconds, 0 does not block
+
+		Returns:
+			dict, None if nothing was received before the deadline
+		"""
+		deadline = monotonic() + timeout
+
+		while b"\n" not in self.buffer:
+			remaining = deadline - monotonic()
+			try:
+				self.sock.settimeout(max(remaining, 0))
+				data = self.sock.recv(4096)
+			except (socket.timeout, BlockingIOError):
+				return None
+			except OSError:
+				data = b""
+
+			if not data:
+				self.disconnect()
+				return None
+			self.buffer += data
+
+		line, self.buffer = self.buffer.split(b"\n", 1)
+		try:
+			return json.loads(line.decode("utf-8"))
+		except ValueError:
+			return {}
+
+
+	def execute(self, name, arguments=None, timeout=None):
+		"""
+		Run QMP command and wait for its reply. Events received in the
+		meantime are kept in 'events'.
+
+		Args:
+			name (str): Command name
+			arguments (dict, optional): Command arguments
+			timeout (float, optional): Deadline in seconds for the reply
+
+		Returns:
+			dict with either "return" or "error", empty if there was no reply
+		"""
+		with span("qmp." + name):
+			return self.__execute([(name, arguments)], timeout)[0]
+
+
+	def execute_batch(self, commands, timeout=None):
+		"""
+		Send several QMP commands in one write and read their replies, which
+		QEMU sends in order.
+
+		Args:
+			commands (list of tuple): (name, arguments or None)
+			timeout (float, optional): Deadline in seconds for each reply
+
+		Returns:
+			list of dict, reply for each command as returned by 'execute'
+		"""
+		with span("qmp.batch"):
+			return self.__execute(commands, timeout)
+
+
+	def __execute(self, commands, timeout):
+		"""
+		Send commands and read until all of their replies arrived.
+
+		Args:
+			commands (list of tuple): (name, arguments or None)
+			timeout (float): Deadline in seconds for each reply, None for the
+				default
+
+		Returns:
+			list of dict, each with either "return" or "error", empty if
+			there was no reply
+		"""
+		if not self.is_connected:
+			return [{} for command in commands]
+
+		messages = []
+		for name, arguments in commands:
+			message = {"execute": name}
+			if arguments:
+				message["arguments"] = arguments
+			messages.append(json.dumps(message).encode("utf-8") + b"\n")
+
+		try:
+			self.sock.sendall(b"".join(messages))
+		except OSError:
+			self.disconnect()
+			return [{} for command in commands]
+
+		timeout = self.timeout if timeout is None else timeout
+		responses = []
+		while len(responses) < len(commands):
+			response = self.__reply(monotonic() + timeout)
+			if response is None:
+				# Later replies would be matched to the wrong commands
+				logging.warning(constants.MONITOR_READ_TIMEOUT % timeout)
+				self.disconnect()
+				break
+			responses.append(response)
+
+		return responses + [{} for command in commands[len(responses):]]
+
+
+	def __reply(self, deadline):
+		"""
+		Read until the next reply arrives, keeping events for later.
+
+		Args:
+			deadline (float): 'monotonic' time to give up at
+
+		Returns:
+			dict with either "return" or "error", None if there was no reply
+		"""
+		while self.is_connected:
+			response = self.__receive(deadline - monotonic())
+			if response is None:
+				return None
+
+			if "event" in response:
+				self.keep_event(response)
+			elif "return" in response or "error" in response:
+				if "error" in response:
+					logging.debug(response["error"].get("desc"))
+				return response
+
+		return None
+
+
+	def wait_event(self, name, timeout=None, **data):
+		"""
+		Wait for asynchronous event.
+
+		Args:
+			name (str): Event name, e.g. "DEVICE_DELETED"
+			timeout (float, optional): Deadline in seconds
+			**data: Values the event's data must contain
+
+		Returns:
+			dict, the event or None when the deadline passed
+		"""
+		def matches(event):
+			return event.get("event") == name and all(
+				event.get("data", {}).get(k) == v for k, v in data.items()
+			)
+
+		deadline = monotonic() + (self.timeout if timeout is None else timeout)
+		while True:
+			for event in self.events:
+				if matches(event):
+					self.events.remove(event)
+					return event
+
+			remaining = deadline - monotonic()
+			if remaining <= 0 or not self.is_connected:
+				return None
+
+			event = self.__receive(remaining)
+			if event is not None:
+				self.keep_event(event)
+
+
+	def keep_event(self, event):
+		"""
+		Keep an event for 'wait_event'. Only the newest ones are kept, the
+		others are not waited for by anybody.
+
+		Args:
+			event (dict): Event received from QEMU
+		"""
+		self.events.append(event)
+		del self.events[:-constants.QMP_EVENTS_KEPT]
+
+
+	def command(self, value, timeout=None):
+		"""
+		Run human monitor command through QMP.
+
+		Args:
+			value (str): Command to run
+			timeout (float, optional): Deadline in seconds for the reply
+
+		Returns:
+			str, reply of the monitor
+		"""
+		response = self.execute(
+			"human-monitor-command", {"command-line": value}, timeout
+		)
+		return response.get("return", "")
+
+
+	def stream(self, value, parser, timeout=None):
+		"""
+		Run human monitor command through QMP and parse its reply, which
+		arrives as a single message.
+
+		Args:
+			value (str): Command to run
+			parser (ReplyParser): Parser of the reply
+			timeout (float, optional): Deadline in seconds for the reply
+
+		Returns:
+			iterator of UsbDevice
+		"""
+		return iter(parser.feed(self.command(value, timeout).encode("utf-8")))
+
+
+	def commands(self, values, timeout=None):
+		"""
+		Run several human monitor commands through QMP in one write.
+
+		Args:
+			values (list): Commands to run
+			timeout (float, optional): Deadline in seconds for each reply
+
+		Returns:
+			list of str, reply for each command
+		"""
+		return [response.get("return", "") for response in self.execute_batch(
+			[("human-monitor-command", {"command-line": v}) for v in values],
+			timeout
+		)]
+
+
+	@staticmethod
+	def response_error(response):
+		"""
+		Error text of a QMP reply.
+
+		Args:
+			response (dict): Reply from 'execute'
+
+		Returns:
+			str, empty when the command succeeded
+		"""
+		if "return" in response:
+			return ""
+		return response.get("error", {}).get("desc") or constants.MONITOR_NO_REPLY
+
+
+	def device_add_batch(self, devices):
+		"""
+		Attach several host USB devices with a single write.
+
+		Args:
+			devices (list of tuple): (vendor id, product id, user ID), as
+				returned by 'device_ids'
+
+		Returns:
+			list of str, error text for each device, empty when it was added
+		"""
+		if not devices:
+			return []
+		self.invalidate()
+		return [self.response_error(r) for r in self.execute_batch([
+			("device_add", {
+				"driver": "usb-host", "id": userid,
+				"vendorid": int(vendor_id, 16), "productid": int(product_id, 16)
+			}) for vendor_id, product_id, userid in devices
+		])]
+
+
+	def device_del_batch(self, userids):
+		"""
+		Request removal of several USB devices with a single write.
+
+		Args:
+			userids (list): IDs of the devices inside QEMU
+
+		Returns:
+			list of str, error text for each device, empty when removal was
+			requested
+		"""
+		if not userids:
+			return []
+		self.invalidate()
+
+		# Events of earlier removals must not confirm these
+		self.events = [
+			event for event in self.events
+				if event.get("event") != "DEVICE_DELETED" or
+					event.get("data", {}).get("device") not in userids
+		]
+		return [self.response_error(r) for r in self.execute_batch([
+			("device_del", {"id": userid}) for userid in userids
+		])]
+
+
+	def wait_removed_batch(self, userids,
+			timeout=constants.MONITOR_RELEASE_TIMEOUT):
+		"""
+		Wait until the virtual machine released devices after 'device_del',
+		confirmed by DEVICE_DELETED events instead of polling.
+
+		Args:
+			userids (list): IDs of the devices inside QEMU
+			timeout (float, optional): Deadline in seconds, shared by all
+
+		Returns:
+			list of bool, released or not for each device
+		"""
+		deadline = monotonic() + timeout
+		with span("qmp.wait_removed"):
+			return [
+				self.wait_device_deleted(userid, max(deadline - monotonic(), 0))
+					for userid in userids
+			]
+
+
+	def wait_device_deleted(self, userid, timeout=None):
+		"""
+		Wait until QEMU reports that the device was released.
+
+		Args:
+			userid (str): ID of the device inside QEMU
+			timeout (float, optional): Deadline in seconds
+
+		Returns:
+			bool, released or not
+		"""
+		return bool(self.wait_event("DEVICE_DELETED", timeout, device=userid))
+
+
+	def usb_devices(self):
+		"""
+		List USB devices from monitor. QEMU has no structured USB query, the
+		text of 'x-query-usb' is used and 'info usb' when that is missing.
+		"""
+		if not self.is_connected:
+			return []
+
+		if self.query_usb:
+			response = self.execute("x-query-usb")
+			if "return" in response:
+				return self.parse_usb(
+					response["return"].get("human-readable-text", "")
+				)
+
+			if "error" in response:
+				self.query_usb = False
+
+		return Monitor.usb_devices(self)
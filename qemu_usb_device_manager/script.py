@@ -0,0 +1,230 @@
+import sys
+import logging
+from io import StringIO
+from contextlib import redirect_stdout
+from . import constants
+from .stats import span
+
+
+
+def machine_client(client, name):
+	"""
+	Client for another virtual machine, sharing the configuration file and
+	monitor connections of a client.
+
+	Args:
+		client (Client): Client to share with
+		name (str): Virtual machine name
+
+	Returns:
+		Client
+	"""
+	with redirect_stdout(StringIO()):  # No welcome message
+		return type(client)(name, client.config_filepath, pool=client.pool)
+
+
+def run_commands(client, commands):
+	"""
+	Run commands like 'main' does for '-c', for callers that serve more than
+	one batch: 'exit' and errors end the batch, not the process.
+
+	Args:
+		client (Client): Client of the virtual machine
+		commands (list): Commands to run
+	"""
+	try:
+		Script(client).run(commands)
+	except SystemExit:
+		pass
+	except Exception as exc:
+		logging.exception(exc)
+		print(constants.SCRIPT_COMMAND_FAILED % exc)
+
+
+
+class Script(object):
+	"""
+	Runs a list of commands that is parsed before anything runs, so a typo on
+	the last line does not leave the first half done. Consecutive commands
+	that talk to the monitor share one session: the connection is held from
+	the first to the last of them and the device state is queried once.
+	Consecutive 'add' or 'remove' commands are merged into a single
+	operation, checked against that state and sent in one write.
+	"""
+
+	# Commands that can be merged with the ones next to them
+	mergeable = ("command_add", "command_remove")
+
+
+	def __init__(self, client, echo=True):
+		"""
+		Initialize Script class.
+
+		Args:
+			client (Client): Client that runs the commands
+			echo (bool, optional): Print every command before it runs
+		"""
+		self.client = client
+		self.echo = echo
+
+
+	@staticmethod
+	def read(path):
+		"""
+		Read commands from a file, one per line.
+
+		Args:
+			path (str): Script file path, "-" for standard input
+
+		Returns:
+			list of str, None if the file cannot be read
+		"""
+		try:
+			if path == "-":
+				lines = sys.stdin.read().splitlines()
+			else:
+				with open(path) as f:
+					lines = f.read().splitlines()
+		except (OSError, UnicodeDecodeError) as exc:
+			print(constants.SCRIPT_CANNOT_READ % (path, exc))
+			return None
+
+		return lines
+
+
+	def parse(self, lines):
+		"""
+		Parse every command. Blank lines and lines starting with "#" are
+		skipped.
+
+		Args:
+			lines (list): Commands
+
+		Returns:
+			list of tuple: (text, command, args, method), None if a command
+			is unknown
+		"""
+		steps = []
+		for number, text in enumerate(lines, 1):
+			command, args = self.client.parse_command(text)
+			if not command or command.startswith("#"):
+				continue
+
+			entry = self.client.command_table.get(command)
+			if not entry:
+				print(constants.SCRIPT_UNKNOWN_COMMAND % (number, text.strip()))
+				return None
+			steps.append((text.strip(), command, args, entry[0]))
+		return steps
+
+
+	def groups(self, steps):
+		"""
+		Split commands into runs that talk to the monitor and runs that do
+		not, and merge consecutive 'add' or 'remove' commands.
+
+		Args:
+			steps (list): Parsed commands from 'parse'
+
+		Returns:
+			list of tuple: (talks to the monitor, list of lists of steps that
+			run as one)
+		"""
+		groups = []
+		for step in steps:
+			text, command, args, method = step
+			session = self.client.needs_monitor(command, args)
+
+			if not groups or groups[-1][0] != session:
+				groups.append((session, []))
+			batches = groups[-1][1]
+
+			if session and method in self.mergeable and batches and \
+					batches[-1][0][3] == method:
+				batches[-1].append(step)
+			else:
+				batches.append([step])
+		return groups
+
+
+	def run(self, lines):
+		"""
+		Parse and run commands.
+
+		Args:
+			lines (list): Commands
+
+		Returns:
+			bool, False if a command is unknown and nothing ran
+		"""
+		steps = self.parse(lines)
+		if steps is None:
+			return False
+
+		for session, batches in self.groups(steps):
+			if session and self.client.vm_config and self.client.monitor:
+				self.run_session(batches)
+				continue
+
+			for batch in batches:
+				self.run_batch(batch)
+		return True
+
+
+	def run_session(self, batches):
+		"""
+		Run commands while holding the monitor of the active machine.
+
+		Args:
+			batches (list): Lists of steps that run as one
+		"""
+		client = self.client
+		monitor = client.monitor
+		held = client.pool.acquire(monitor)  # Fails again in the commands
+
+		try:
+			with span("script.session"):
+				snapshot = monitor.device_index() if held else None
+				for batch in batches:
+					self.run_batch(batch, snapshot)
+		finally:
+			if held:
+				client.pool.release(monitor)
+
+
+	def run_batch(self, batch, snapshot=None):
+		"""
+		Run one command, or several merged 'add' or 'remove' commands.
+
+		Args:
+			batch (list): Steps that run as one
+			snapshot (DeviceIndex, optional): Device state shared by the
+				session, updated by every 'add' and 'remove'
+		"""
+		client = self.client
+		method = batch[0][3]
+
+		# Unmerged, also when no machine is set to say so for every command
+		if method not in self.mergeable or not client.vm_config:
+			for text, command, args, method in batch:
+				if self.echo:
+					print(">" + text)
+				with span("client." + command):
+					client.dispatch_command(command, args)
+			return
+
+		with span("script.merged"):
+			host_devices = snapshot.devices if snapshot else None
+			devices = []
+			for text, command, args, method in batch:
+				if self.echo:
+					print(">" + text)
+				if method == "command_add":
+					devices.extend(client.add_targets(args, host_devices))
+				else:
+					devices.extend(client.remove_targets(args, host_devices))
+
+			if method == "command_add":
+				client.add_devices(devices, snapshot)
+			else:
+				client.remove_devices(devices, snapshot)
@@ -0,0 +1,176 @@
+import json
+import logging
+from time import perf_counter, time
+from threading import Lock
+from contextlib import contextmanager
+from collections import deque
+from . import constants
+
+
+
+class Histogram(object):
+	"""
+	Latency distribution of a single span. Totals cover every sample, while
+	percentiles are taken from the most recent samples.
+	"""
+	__slots__ = ("count", "total", "maximum", "samples")
+
+
+	def __init__(self, size=constants.STATS_SAMPLES):
+		"""
+		Initialize Histogram class.
+
+		Args:
+			size (int, optional): Amount of recent samples kept
+		"""
+		self.count = 0
+		self.total = 0.0
+		self.maximum = 0.0
+		self.samples = deque(maxlen=size)
+
+
+	def add(self, seconds):
+		"""
+		Add sample.
+
+		Args:
+			seconds (float): Duration
+		"""
+		self.count += 1
+		self.total += seconds
+		self.maximum = max(self.maximum, seconds)
+		self.samples.append(seconds)
+
+
+	def percentile(self, fraction):
+		"""
+		Nearest-rank percentile of recent samples.
+
+		Args:
+			fraction (float): Percentile between 0 and 1
+
+		Returns:
+			float, seconds
+		"""
+		if not self.samples:
+			return 0.0
+		samples = sorted(self.samples)
+		return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+
+
+
+class Stats(object):
+	"""
+	In-process timing of named spans, e.g. monitor connects, monitor round
+	trips, parsing and client commands. Spans can also be appended as JSON
+	lines to the log file.
+	"""
+
+	def __init__(self):
+		"""
+		Initialize Stats class.
+		"""
+		self.histograms = {}
+		self.log_file = None  # Open while spans are written, see 'open'
+		self.lock = Lock()
+
+
+	def open(self, path):
+		"""
+		Append every following span to a file. The file stays open, so
+		writing a span costs no more than the write itself.
+
+		Args:
+			path (str): Log file path
+
+		Returns:
+			bool, False if the file cannot be opened
+		"""
+		try:
+			self.log_file = open(path, "a")
+		except OSError as exc:
+			logging.exception(exc)
+			return False
+		return True
+
+
+	@contextmanager
+	def span(self, name):
+		"""
+		Time the enclosed block.
+
+		Args:
+			name (str): Span name
+		"""
+		start = perf_counter()
+		try:
+			yield
+		finally:
+			self.record(name, perf_counter() - start)
+
+
+	def record(self, name, seconds):
+		"""
+		Add duration to the span's histogram.
+
+		Args:
+			name (str): Span name
+			seconds (float): Duration
+		"""
+		with self.lock:
+			histogram = self.histograms.get(name)
+			if histogram is None:
+				histogram = self.histograms[name] = Histogram()
+			histogram.add(seconds)
+
+			if self.log_file:
+				self.write(name, seconds)
+
+
+	def write(self, name, seconds):
+		"""
+		Append span to the log file as JSON line, flushed right away so it
+		is not mixed up with lines written by logging.
+
+		Args:
+			name (str): Span name
+			seconds (float): Duration
+		"""
+		try:
+			self.log_file.write(json.dumps({
+				"time": time(), "span": name, "ms": round(seconds * 1000, 3)
+			}) + "\n")
+			self.log_file.flush()
+		except (OSError, ValueError) as exc:
+			logging.exception(exc)
+			self.log_file = None
+
+
+	def reset(self):
+		"""
+		Forget every sample.
+		"""
+		with self.lock:
+			self.histograms = {}
+
+
+	def summary(self):
+		"""
+		Summary of every span, sorted by name.
+
+		Returns:
+			list of tuple: (name, count, total ms, mean ms, p50 ms, p99 ms,
+			max ms)
+		"""
+		with self.lock:
+			return [
+				(name, h.count, h.total * 1000, h.total / h.count * 1000,
+					h.percentile(0.5) * 1000, h.percentile(0.99) * 1000,
+					h.maximum * 1000)
+				for name, h in sorted(self.histograms.items())
+			]
+
+
+# Shared by every monitor and client of the process
+stats = Stats()
+span = stats.span
@@ -0,0 +1,137 @@
+import os
+import logging
+from threading import Lock
+from . import constants
+from .devices import UsbDevice
+from .stats import span
+
+
+USB_CLASS_HUB = 9  # QEMU leaves hubs out of 'info usbhost' as well
+
+
+
+class SysfsInventory(object):
+	"""
+	Host USB devices read from sysfs, for when this program runs on the host
+	machine. Gives the same devices as 'info usbhost' without a monitor round
+	trip.
+
+	Every entry is read once and cached by its name, inode and change time. A
+	device that is unplugged and plugged back in gets a new sysfs node and is
+	therefore read again, so each call only costs a directory listing and one
+	lstat per entry.
+	"""
+
+	def __init__(self, root=constants.SYSFS_USB_DEVICES):
+		"""
+		Initialize SysfsInventory class.
+
+		Args:
+			root (str, optional): sysfs USB device directory
+		"""
+		self.root = root
+		self.entries = {}  # name -> ((inode, ctime), device fields or None)
+		self.lock = Lock()
+
+
+	@staticmethod
+	def available(root=constants.SYSFS_USB_DEVICES):
+		"""
+		Test if sysfs lists USB devices.
+
+		Args:
+			root (str, optional): sysfs USB device directory
+
+		Returns:
+			bool
+		"""
+		return os.path.isdir(root)
+
+
+	def read(self, name):
+		"""
+		Read device fields of a sysfs entry.
+
+		Args:
+			name (str): Entry name, e.g. "1-1.2"
+
+		Returns:
+			dict, keyword arguments for UsbDevice, None for hubs and entries
+			that are not devices
+		"""
+		path = os.path.join(self.root, name)
+
+		def attribute(key, default=None):
+			try:
+				with open(os.path.join(path, key)) as f:
+					return f.read().strip()
+			except OSError:
+				return default
+
+		try:
+			fields = {
+				"bus": int(attribute("busnum")),
+				"addr": int(attribute("devnum")),
+				"device_class": int(attribute("bDeviceClass"), 16),
+				"vendor_id": int(attribute("idVendor"), 16),
+				"product_id": int(attribute("idProduct"), 16),
+			}
+		except (TypeError, ValueError):
+			return None
+
+		if fields["device_class"] == USB_CLASS_HUB:
+			return None
+
+		try:
+			fields["speed"] = float(attribute("speed", "0"))
+		except ValueError:
+			fields["speed"] = 0.0
+
+		fields["port"] = name.split("-", 1)[1] if "-" in name else name
+		fields["product"] = attribute("product")
+		return fields
+
+
+	def devices(self):
+		"""
+		List USB devices connected to host, ordered like 'info usbhost'.
+
+		Returns:
+			list of UsbDevice, new objects on every call
+		"""
+		with span("sysfs.usbhost"), self.lock:
+			try:
+				# Interfaces ("1-1:1.0") are not devices
+				entries = [
+					entry for entry in os.scandir(self.root) if ":" not in entry.name
+				]
+			except OSError as exc:
+				logging.exception(exc)
+				return []
+
+			cache, self.entries = self.entries, {}
+			for entry in entries:
+				try:
+					stat = entry.stat(follow_symlinks=False)
+				except OSError:
+					continue  # Unplugged while listing
+				key = (stat.st_ino, stat.st_ctime_ns)
+
+				cached = cache.get(entry.name)
+				if cached and cached[0] == key:
+					self.entries[entry.name] = cached
+				else:
+					self.entries[entry.name] = (key, self.read(entry.name))
+
+			fields = [f for _, f in self.entries.values() if f]
+
+		fields.sort(key=lambda f: (f["bus"], f["addr"]))
+		return [UsbDevice(**f) for f in fields]
+
+
+	def invalidate(self):
+		"""
+		Forget every cached entry.
+		"""
+		with self.lock:
+			self.entries = {}
@@ -1,8 +1,6 @@
 import os
 import re
-from urllib.request import urlopen
-from platform import system
-from subprocess import check_output
+from random import uniform
 from . import constants
 
 
@@ -17,6 +15,9 @@ def get_gateway():
 	Returns:
 		str
 	"""
+	from platform import system
+	from subprocess import check_output
+
 	if system() != "Windows":
 		print(constants.UTIL_GATEWAY_UNSUPPORTED)
 		return
@@ -33,6 +34,8 @@ def download_string(url):
 	Returns:
 		str
 	"""
+	from urllib.request import urlopen
+
 	return urlopen(url).read().decode("utf-8")
 
 
@@ -67,4 +70,23 @@ def find_file(directories, filename, extensions):
 		for extension in extensions:
 			path = os.path.join(directory, filename + extension)
 			if os.path.isfile(path):
-				return path
\ No newline at end of file
+				return path
+
+
+def backoff(initial, maximum):
+	"""
+	Exponential backoff with jitter. Every delay is picked between half and
+	all of the current step, so clients that were turned away together do
+	not retry together.
+
+	Args:
+		initial (float): First step in seconds
+		maximum (float): Largest step in seconds
+
+	Returns:
+		generator of float, seconds to wait before each retry
+	"""
+	step = initial
+	while True:
+		yield uniform(step / 2, step)
+		step = min(step * 2, maximum)
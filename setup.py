@@ -10,6 +10,7 @@ setup(
 	py_modules=["qemu_usb_device_manager"],
 	packages=["qemu_usb_device_manager"],
 	license="BSD-2-Clause",
+	python_requires=">=3.7",  # Lazy package exports and asyncio.get_running_loop
 	entry_points={
         "console_scripts": ["usb_dm=qemu_usb_device_manager:run"],
     },